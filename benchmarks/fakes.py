@@ -0,0 +1,171 @@
+"""Deterministic stand-ins for the embedding model and the LLM.
+
+They let the benchmarks run offline and give identical vectors and answers on
+every run, so differences between commits come from the code under test.
+"""
+
+import asyncio
+import hashlib
+import re
+import time
+from typing import Any, AsyncIterator, Iterator, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForLLMRun,
+    CallbackManagerForLLMRun,
+)
+from langchain_core.embeddings import Embeddings
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+
+class HashEmbeddings(Embeddings):
+    """Bag-of-words embeddings built from hashed word (and bigram) features.
+
+    Unlike random fake embeddings, texts that share words get similar vectors, so
+    recall and ranking behave like a real (if weak) model. Vectors are
+    L2-normalized, like the HuggingFace embeddings used in production.
+    """
+
+    def __init__(self, dimension: int = 384, cost_ms_per_text: float = 0.0):
+        """Initialize the embedder.
+
+        `cost_ms_per_text` adds a simulated model time per text, to mimic a real
+        model in throughput tests.
+        """
+        self.dimension = dimension
+        self.cost_ms_per_text = cost_ms_per_text
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed a list of texts."""
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query."""
+        return self.encode([text])[0].tolist()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Embed texts into an (n, dimension) float32 matrix."""
+        if self.cost_ms_per_text:
+            time.sleep(self.cost_ms_per_text * len(texts) / 1000)
+        matrix = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            words = _WORD.findall(text.lower())
+            bigrams = [f"{a} {b}" for a, b in zip(words, words[1:], strict=False)]
+            for feature in words + bigrams:
+                digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+                value = int.from_bytes(digest, "little")
+                sign = 1.0 if value & 1 else -1.0
+                matrix[row, (value >> 1) % self.dimension] += sign
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return matrix / norms
+
+
+class OverlapCrossEncoder:
+    """Pair scorer with the `CrossEncoder.predict` interface.
+
+    The score of a (query, text) pair is the weighted fraction of the query words
+    and bigrams found in the text, in [0, 1], so reading both texts together ranks
+    exact matches above chunks that merely share hashed features with the query.
+    `cost_ms_per_pair` adds a simulated model time per pair.
+    """
+
+    def __init__(self, cost_ms_per_pair: float = 0.0):
+        """Initialize the scorer."""
+        self.cost_ms_per_pair = cost_ms_per_pair
+
+    def predict(
+        self, sentences: List[Tuple[str, str]], batch_size: int = 32, **kwargs: Any
+    ) -> np.ndarray:
+        """Score each (query, text) pair."""
+        if self.cost_ms_per_pair:
+            time.sleep(self.cost_ms_per_pair * len(sentences) / 1000)
+        scores = np.zeros(len(sentences), dtype=np.float32)
+        for row, (query, text) in enumerate(sentences):
+            # Short words (articles, prepositions) carry no signal; numbers do
+            words = [
+                word
+                for word in _WORD.findall(query.lower())
+                if len(word) > 3 or word.isdigit()
+            ]
+            if not words:
+                continue
+            found = set(_WORD.findall(text.lower()))
+            bigrams = list(zip(words, words[1:], strict=False))
+            lowered = " ".join(_WORD.findall(text.lower()))
+            matched = sum(word in found for word in words) + 2 * sum(
+                f"{a} {b}" in lowered for a, b in bigrams
+            )
+            scores[row] = matched / (len(words) + 2 * len(bigrams))
+        return scores
+
+
+class StubChatModel(BaseChatModel):
+    """Chat model that streams a fixed answer with configurable latency.
+
+    The first token takes `first_token_delay` plus `prefill_delay_per_token` per
+    (estimated) prompt token, so longer prompts answer later, as with a real LLM.
+    """
+
+    answer: str = (
+        "Según el contexto, la norma citada establece el procedimiento aplicable. "
+        "Fuente: documentos recuperados."
+    )
+    first_token_delay: float = 0.2
+    token_delay: float = 0.01
+    prefill_delay_per_token: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "stub"
+
+    def _prefill(self, messages: List[BaseMessage]) -> float:
+        characters = sum(len(str(message.content)) for message in messages)
+        return self.first_token_delay + self.prefill_delay_per_token * characters / 4
+
+    def _tokens(self) -> List[str]:
+        words = self.answer.split(" ")
+        return [word if i == 0 else " " + word for i, word in enumerate(words)]
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        tokens = self._tokens()
+        time.sleep(self._prefill(messages) + self.token_delay * (len(tokens) - 1))
+        message = AIMessage(content="".join(tokens))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self._prefill(messages))
+        for i, token in enumerate(self._tokens()):
+            if i:
+                time.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self._prefill(messages))
+        for i, token in enumerate(self._tokens()):
+            if i:
+                await asyncio.sleep(self.token_delay)
+            yield ChatGenerationChunk(message=AIMessageChunk(content=token))
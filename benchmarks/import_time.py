@@ -0,0 +1,114 @@
+"""Import-time and cold-start benchmark.
+
+Each measurement runs in a fresh interpreter, so module caches from previous runs
+do not hide the real cost. Besides the import time of the main modules, it times
+two cold-start commands on an existing vectorstore (listing the sources and
+exporting the text of one source) and reports whether they imported torch.
+
+Usage:
+    python benchmarks/import_time.py --repeat 5 --name legislacion_MAX_INNER_PRODUCT
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MODULES = [
+    "vectorstore.embeddings",
+    "vectorstore.vectorstore_manager",
+    "llm.llm_manager",
+    "server.app",
+    "main",
+]
+
+# Snippet run in a child interpreter: it prints the elapsed seconds and whether
+# torch ended up in sys.modules
+_TIMED = """
+import sys, time
+start = time.perf_counter()
+{body}
+print(time.perf_counter() - start, "torch" in sys.modules)
+"""
+
+_LIST_SOURCES = """
+from vectorstore.vectorstore_manager import VectorStoreManager
+manager = VectorStoreManager(path={path!r}, name={name!r})
+sources = manager.list_sources()
+"""
+
+_EXPORT_SOURCE = """
+from vectorstore.vectorstore_manager import VectorStoreManager
+manager = VectorStoreManager(path={path!r}, name={name!r})
+sources = manager.list_sources()
+if sources:
+    manager.extract_texts_by_source(sources[0])
+"""
+
+
+def run(body: str, repeat: int) -> Dict[str, object]:
+    """Run a snippet `repeat` times in fresh interpreters."""
+    seconds: List[float] = []
+    torch_loaded = False
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-c", _TIMED.format(body=body)],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=False,
+        )
+        if completed.returncode != 0:
+            error = completed.stderr.strip().splitlines()
+            return {"error": error[-1] if error else "unknown error"}
+        elapsed, loaded = completed.stdout.strip().splitlines()[-1].split()
+        seconds.append(float(elapsed))
+        torch_loaded = torch_loaded or loaded == "True"
+    return {
+        "median_ms": 1000 * statistics.median(seconds),
+        "min_ms": 1000 * min(seconds),
+        "torch_loaded": torch_loaded,
+    }
+
+
+def main() -> None:
+    """Measure and print the import and cold-start times."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--name", default="legislacion_MAX_INNER_PRODUCT")
+    parser.add_argument("--path", default="derecho_files")
+    parser.add_argument("--json", action="store_true", help="Print JSON")
+    args = parser.parse_args()
+
+    results: Dict[str, Dict[str, object]] = {}
+    for module in MODULES:
+        results[f"import {module}"] = run(f"import {module}", args.repeat)
+    if os.path.exists(os.path.join(ROOT, "database", args.name)):
+        results["list_sources"] = run(
+            _LIST_SOURCES.format(path=args.path, name=args.name), args.repeat
+        )
+        results["export_source"] = run(
+            _EXPORT_SOURCE.format(path=args.path, name=args.name), args.repeat
+        )
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{'command':<42} {'median ms':>10} {'min ms':>10}  torch")
+    for command, result in results.items():
+        if "error" in result:
+            print(f"{command:<42} error: {result['error']}")
+            continue
+        print(
+            f"{command:<42} {result['median_ms']:>10.1f} {result['min_ms']:>10.1f}"
+            f"  {'yes' if result['torch_loaded'] else 'no'}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,452 @@
+"""Retrieval and generation benchmark over a recorded query workload.
+
+Builds a `VectorStoreManager` from a synthetic (or fixture) corpus with the
+deterministic `HashEmbeddings`, replays the queries of a workload file and
+reports ingestion throughput, search latency percentiles, memory footprint,
+recall@k against exact search and end-to-end time-to-first-token with a stub
+LLM. Everything runs offline and the results are written as JSON so they can be
+compared across commits.
+
+Usage:
+    python -m benchmarks.rag_benchmark --docs 200 --k 5 --output results.json
+    python -m benchmarks.rag_benchmark --strategy COSINE --compare results.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import textwrap
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+
+from benchmarks.fakes import HashEmbeddings, OverlapCrossEncoder, StubChatModel
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_WORKLOAD = os.path.join(ROOT, "benchmarks", "workloads", "legal_queries.jsonl")
+
+TOPICS = [
+    "robo agravado pena privativa de libertad delito patrimonio",
+    "recurso de apelación plazo resolución judicial segunda instancia",
+    "despido arbitrario trabajador indemnización estabilidad laboral",
+    "sociedad anónima constitución estatuto junta general accionistas",
+    "seguridad y salud en el trabajo empleador riesgos prevención",
+    "habeas corpus libertad individual proceso constitucional",
+    "infracciones tributarias sanciones administración tributaria multa",
+    "prescripción de la acción penal plazo extinción",
+    "juzgados de paz letrados competencia cuantía",
+    "contratación del Estado licitación pública proveedores",
+    "protección de datos personales titular consentimiento tratamiento",
+    "licencia por maternidad paternidad subsidio",
+    "impuesto a la renta cuarta categoría retenciones",
+    "nulidad del acto administrativo procedimiento administrativo general",
+    "responsabilidad civil extracontractual daños indemnización",
+    "Ministerio Público investigación fiscal acción penal",
+    "derecho de defensa debido proceso tutela jurisdiccional",
+    "registro de la propiedad inmueble inscripción registral",
+    "pensión de alimentos hijos menores de edad",
+    "violencia familiar medidas de protección víctimas",
+    "comercio ambulatorio licencias municipales ordenanza",
+    "evaluación de impacto ambiental proyectos de inversión",
+    "jornada de trabajo horas extraordinarias descanso",
+    "compensación por tiempo de servicios depósitos",
+]
+CONNECTORS = [
+    "De conformidad con lo dispuesto en la presente ley,",
+    "Para efectos de la aplicación de esta norma,",
+    "Sin perjuicio de las responsabilidades civiles y penales,",
+    "La autoridad competente verifica que",
+    "En los casos previstos en el reglamento,",
+]
+
+
+def write_synthetic_corpus(folder: str, n_docs: int, seed: int = 0) -> None:
+    """Write `n_docs` deterministic law-like text files to `folder`.
+
+    The layout mimics text extracted from a PDF: lines wrapped at 90 characters,
+    no blank lines between articles and a chapter heading every five articles.
+    """
+    rng = random.Random(seed)
+    os.makedirs(folder, exist_ok=True)
+    for number in range(n_docs):
+        topic = TOPICS[number % len(TOPICS)].split()
+        articles = []
+        for article in range(1, rng.randint(8, 20)):
+            sentences = [
+                f"{rng.choice(CONNECTORS)} "
+                + " ".join(rng.choice(topic) for _ in range(rng.randint(8, 18)))
+                + "."
+                for _ in range(rng.randint(2, 5))
+            ]
+            if article % 5 == 1:
+                articles.append(f"CAPÍTULO {article // 5 + 1}")
+            articles.append(
+                textwrap.fill(f"Artículo {article}.- " + " ".join(sentences), width=90)
+            )
+        text = f"LEY N° {number:05d}\n" + "\n".join(articles)
+        path = os.path.join(folder, f"ley_{number:05d}.txt")
+        with open(path, "w", encoding="utf-8") as file:
+            file.write(text)
+
+
+def load_workload(path: str) -> List[Dict[str, Any]]:
+    """Read a JSON-lines workload (`query` and an optional `source` filter)."""
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def percentiles(seconds: List[float]) -> Dict[str, float]:
+    """p50/p95/p99, mean and max of a list of durations, in milliseconds."""
+    values = np.asarray(seconds) * 1000
+    if not len(values):
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50_ms": float(p50),
+        "p95_ms": float(p95),
+        "p99_ms": float(p99),
+        "mean_ms": float(values.mean()),
+        "max_ms": float(values.max()),
+    }
+
+
+def run_benchmark(args: argparse.Namespace) -> Dict[str, Any]:
+    """Run every stage of the benchmark and return the results."""
+    # The managers read their configuration from the environment
+    os.environ["FLAG_EMBEDDINGS"] = "0"
+    os.environ["DISTANCE_STRATEGY"] = args.strategy
+    os.environ["INDEX_TYPE"] = args.index_type
+    os.environ["QUERY_CACHE_SIZE"] = "0"
+    os.environ["ANSWER_CACHE"] = "0"
+    os.environ.setdefault("LLM_TEMPERATURE", "0")
+
+    from llm.answer_cache import AnswerCache, AnswerKey
+    from llm.context_packer import ContextPacker
+    from llm.llm_manager import GenerationStats, LLMManager
+    from vectorstore.index_factory import IndexFactory
+    from vectorstore.legal_splitter import LegalTextSplitter
+    from vectorstore.reranker import Reranker
+    from vectorstore.vectorstore_manager import VectorStoreManager
+
+    workload = load_workload(args.workload)
+    workdir = tempfile.mkdtemp(prefix="rag-bench-")
+    cwd = os.getcwd()
+    os.chdir(workdir)
+    try:
+        if args.corpus:
+            shutil.copytree(args.corpus, "corpus")
+        else:
+            write_synthetic_corpus("corpus", args.docs, args.seed)
+
+        embeddings = HashEmbeddings(args.dimension, args.embed_cost_ms)
+        manager = VectorStoreManager(path="corpus", name="bench", embeddings=embeddings)
+        manager.text_splitter = LegalTextSplitter(
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            structured=args.chunking == "legal",
+        )
+
+        start = time.perf_counter()
+        manager.create_vectorstore()
+        ingest_seconds = time.perf_counter() - start
+        index = manager.vectorstore.index
+        chunks = index.ntotal
+
+        queries = [item["query"] for item in workload]
+        filters = [item.get("source") for item in workload]
+        latencies = []
+        for _ in range(args.repeat):
+            for query, filtro in zip(queries, filters, strict=True):
+                start = time.perf_counter()
+                manager.search_batch([query], args.k, [filtro], args.mode)
+                latencies.append(time.perf_counter() - start)
+        start = time.perf_counter()
+        manager.search_batch(queries, args.k, filters, args.mode)
+        batch_seconds = time.perf_counter() - start
+
+        recall = _recall_at_k(manager, embeddings, queries, filters, args, IndexFactory)
+
+        llm_manager = LLMManager()
+        llm_manager.llm = StubChatModel(
+            first_token_delay=args.llm_first_token_ms / 1000,
+            token_delay=args.llm_token_ms / 1000,
+            prefill_delay_per_token=args.llm_prefill_ms_per_1k / 1_000_000,
+        )
+        packer = ContextPacker(token_budget=args.context_budget, enabled=not args.no_pack)
+        reranker = Reranker(
+            OverlapCrossEncoder(args.rerank_cost_ms),
+            enabled=args.rerank,
+            candidates=args.rerank_candidates,
+            budget_ms=args.rerank_budget_ms,
+        )
+        if args.answer_cache:
+            llm_manager.answer_cache = AnswerCache("answers.sqlite", namespace="bench")
+
+        def ask(query: str, filtro: Optional[str]) -> Tuple[Any, Any, float, float]:
+            start = time.perf_counter()
+            candidates = manager.search_batch(
+                [query], reranker.fetch_k(args.k), [filtro], args.mode
+            )[0]
+            results = reranker.rerank(query, candidates, args.k)
+            packed = packer.pack(results)
+            cache_key = None
+            if llm_manager.answer_cache is not None:
+                cache_key = AnswerKey.for_results(manager, query, results)
+            first = None
+            for _ in llm_manager.stream_response_with_context(
+                query, packed.text, GenerationStats(), cache_key
+            ):
+                first = first or time.perf_counter() - start
+            total = time.perf_counter() - start
+            return results, packed, first or total, total
+
+        e2e = list(zip(queries, filters, strict=True))[: args.e2e_queries]
+        ttft, totals, retrieved_tokens, context_tokens = [], [], [], []
+        returned, precision = [], []
+        for query, filtro in e2e:
+            results, packed, first, total = ask(query, filtro)
+            returned.append(len(results))
+            if not args.corpus and not filtro:
+                precision.append(_topic_precision(query, results))
+            retrieved_tokens.append(packed.retrieved_tokens)
+            context_tokens.append(packed.tokens)
+            ttft.append(first)
+            totals.append(total)
+        # The same questions again, answered from the cache
+        cached_totals = [
+            ask(query, filtro)[3] for query, filtro in e2e if args.answer_cache
+        ]
+
+        return {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "platform": platform.platform(),
+                "params": {
+                    key: value
+                    for key, value in vars(args).items()
+                    if key not in ("output", "compare")
+                },
+            },
+            "ingestion": {
+                "documents": len(os.listdir("corpus")),
+                "chunks": chunks,
+                "seconds": ingest_seconds,
+                "chunks_per_second": chunks / ingest_seconds if ingest_seconds else 0.0,
+            },
+            "search": {
+                "queries": len(latencies),
+                **percentiles(latencies),
+                "batch_queries_per_second": (
+                    len(queries) / batch_seconds if batch_seconds else 0.0
+                ),
+            },
+            "recall": recall,
+            "memory": {
+                "index_bytes": int(faiss.serialize_index(index).nbytes),
+                "bytes_per_vector": (
+                    int(faiss.serialize_index(index).nbytes) / chunks if chunks else 0
+                ),
+                "peak_rss_bytes": _peak_rss_bytes(),
+            },
+            "context": {
+                "results_mean": float(np.mean(returned or [0])),
+                "topic_precision": float(np.mean(precision or [0])),
+                "retrieved_tokens_mean": float(np.mean(retrieved_tokens or [0])),
+                "packed_tokens_mean": float(np.mean(context_tokens or [0])),
+            },
+            "answer_cache": {
+                "hits": llm_manager.answer_cache.stats.hits,
+                "misses": llm_manager.answer_cache.stats.misses,
+                "repeat_end_to_end": percentiles(cached_totals),
+            }
+            if args.answer_cache
+            else {},
+            "rerank": {
+                "pairs": reranker.stats.pairs,
+                "cached_pairs": reranker.stats.cached_pairs,
+                "skipped": reranker.stats.skipped,
+                "pairs_per_second": reranker.stats.pairs_per_second,
+            }
+            if args.rerank
+            else {},
+            "generation": {
+                "queries": len(ttft),
+                "time_to_first_token": percentiles(ttft),
+                "end_to_end": percentiles(totals),
+            },
+        }
+    finally:
+        os.chdir(cwd)
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+def _recall_at_k(
+    manager: Any,
+    embeddings: HashEmbeddings,
+    queries: List[str],
+    filters: List[Optional[str]],
+    args: argparse.Namespace,
+    index_factory: Any,
+) -> Dict[str, Any]:
+    """Recall@k of the unfiltered queries against an exact flat index."""
+    if args.mode == "lexical":
+        return {}
+    unfiltered = [
+        query for query, filtro in zip(queries, filters, strict=True) if not filtro
+    ]
+    vectorstore = manager.vectorstore
+    ids = [vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)]
+    texts = [vectorstore.docstore.search(_id).page_content for _id in ids]
+    exact = index_factory(manager.strategy, index_type="FLAT").build(embeddings.dimension)
+    exact.add(embeddings.encode(texts))
+    _, truth = exact.search(embeddings.encode(unfiltered), args.k)
+    found = manager.search_batch(unfiltered, args.k, None, args.mode)
+    hits = sum(
+        len({result.id for result in results} & {ids[p] for p in row if p >= 0})
+        for results, row in zip(found, truth, strict=True)
+    )
+    return {
+        "k": args.k,
+        "queries": len(unfiltered),
+        "recall_at_k": hits / (len(unfiltered) * args.k) if unfiltered else 0.0,
+    }
+
+
+def _topic_precision(query: str, results: List[Any]) -> float:
+    """Fraction of the results that come from a synthetic law of the query topic.
+
+    The topic of a query is the one of `TOPICS` that shares most words with it;
+    synthetic law `n` is about `TOPICS[n % len(TOPICS)]`.
+    """
+    if not results:
+        return 0.0
+    words = set(query.lower().split())
+    topic = max(
+        range(len(TOPICS)), key=lambda i: len(words & set(TOPICS[i].lower().split()))
+    )
+    matches = 0
+    for result in results:
+        digits = "".join(filter(str.isdigit, os.path.basename(result.source or "")))
+        matches += bool(digits) and int(digits) % len(TOPICS) == topic
+    return matches / len(results)
+
+
+def _peak_rss_bytes() -> Optional[int]:
+    try:
+        import resource
+    except ImportError:
+        # Not available on Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        return None
+    return completed.stdout.strip()
+
+
+def _flatten(results: Dict[str, Any], prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        if isinstance(value, dict):
+            flat.update(_flatten(value, f"{prefix}{key}."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool):
+            flat[f"{prefix}{key}"] = value
+    return flat
+
+
+def print_summary(results: Dict[str, Any], baseline: Optional[Dict[str, Any]]) -> None:
+    """Print the metrics, with the relative change against a baseline if given."""
+    current = _flatten({k: v for k, v in results.items() if k != "meta"})
+    previous = _flatten({k: v for k, v in (baseline or {}).items() if k != "meta"})
+    for key, value in current.items():
+        line = f"{key:<45} {value:>14.3f}"
+        if previous.get(key):
+            line += f"  ({100 * (value - previous[key]) / previous[key]:+.1f}%)"
+        print(line)
+
+
+def main() -> None:
+    """Parse the arguments, run the benchmark and write the results."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workload", default=DEFAULT_WORKLOAD)
+    parser.add_argument("--corpus", help="Folder of documents instead of synthetic")
+    parser.add_argument("--docs", type=int, default=200, help="Synthetic documents")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--chunk-size", type=int, help="Maximum chunk characters (1500 legal, 1000)"
+    )
+    parser.add_argument("--chunk-overlap", type=int, default=50)
+    parser.add_argument(
+        "--chunking", default="legal", help="legal (by article) or recursive"
+    )
+    parser.add_argument("--strategy", default="EUCLIDEAN_DISTANCE")
+    parser.add_argument("--index-type", default="FLAT")
+    parser.add_argument("--mode", default="dense", help="dense, lexical or hybrid")
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--dimension", type=int, default=384)
+    parser.add_argument("--embed-cost-ms", type=float, default=0.0)
+    parser.add_argument("--repeat", type=int, default=5, help="Passes over workload")
+    parser.add_argument("--e2e-queries", type=int, default=10)
+    parser.add_argument("--llm-first-token-ms", type=float, default=200.0)
+    parser.add_argument("--llm-token-ms", type=float, default=10.0)
+    parser.add_argument(
+        "--llm-prefill-ms-per-1k",
+        type=float,
+        default=50.0,
+        help="Simulated prompt processing time per 1000 prompt tokens",
+    )
+    parser.add_argument("--context-budget", type=int, help="Context token budget")
+    parser.add_argument("--no-pack", action="store_true", help="Raw chunks as context")
+    parser.add_argument("--rerank", action="store_true", help="Cross-encoder re-ranking")
+    parser.add_argument(
+        "--answer-cache", action="store_true", help="Ask the questions twice, cached"
+    )
+    parser.add_argument("--rerank-candidates", type=int, default=30)
+    parser.add_argument("--rerank-cost-ms", type=float, default=0.0)
+    parser.add_argument("--rerank-budget-ms", type=float, default=0.0)
+    parser.add_argument("--output", help="Write the results as JSON to this file")
+    parser.add_argument("--compare", help="Baseline JSON results to compare with")
+    parser.add_argument("--keep", action="store_true", help="Keep the work folder")
+    args = parser.parse_args()
+    if args.corpus:
+        args.corpus = os.path.abspath(args.corpus)
+    if args.output:
+        args.output = os.path.abspath(args.output)
+
+    results = run_benchmark(args)
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_summary(results, baseline)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,255 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from telemetry.instruments import record_cache
+from telemetry.tracing import span
+from vectorstore.search_result import SearchResult
+
+
+@dataclass(frozen=True)
+class AnswerKey:
+    """What an answer depends on: the question, its context and the store version."""
+
+    query_vector: np.ndarray
+    chunk_ids: tuple
+    store: str
+    version: str
+
+    @classmethod
+    def for_results(
+        cls, vectorstore: Any, query: str, results: List[SearchResult]
+    ) -> "AnswerKey":
+        """Key of an answer to `query` generated from `results`.
+
+        `vectorstore` is a `VectorStoreManager` or a `ShardedVectorStore`; the query
+        embedding comes from its query cache when the query was just searched.
+        """
+        return cls(
+            query_vector=np.asarray(vectorstore.query_vector(query), dtype=np.float32),
+            chunk_ids=tuple(sorted({result.id for result in results})),
+            store=vectorstore.name,
+            version=vectorstore.store_version,
+        )
+
+    @property
+    def context_key(self) -> str:
+        """Digest of the set of chunk ids."""
+        return hashlib.blake2b(
+            "\x00".join(self.chunk_ids).encode("utf-8"), digest_size=16
+        ).hexdigest()
+
+
+@dataclass
+class AnswerCacheStats:
+    """Usage of the answer cache since it was opened."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    invalidated: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Fraction of lookups answered from the cache."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class AnswerCache:
+    """Persistent semantic cache of LLM answers, in a SQLite file.
+
+    A lookup hits when an entry was generated from exactly the same set of chunk
+    ids, for the same store version and LLM `namespace` (model and prompt), and
+    its question embedding has a cosine similarity of at least `threshold` with
+    the new one. Paraphrases of a question that retrieve the same articles thus
+    reuse the answer, while a question that retrieves other chunks never does.
+
+    The chunk-id set is an exact key, so only the few entries that share it are
+    compared by embedding. Storing an answer for a new store version deletes the
+    entries of the previous versions of that store; the least recently used
+    entries are evicted beyond `max_entries` or `max_bytes`.
+    """
+
+    def __init__(
+        self,
+        path: Optional[str] = None,
+        namespace: str = "",
+        threshold: Optional[float] = None,
+        max_entries: Optional[int] = None,
+        max_bytes: Optional[int] = None,
+    ):
+        """Open (or create) the cache.
+
+        Args:
+            path: SQLite file (`ANSWER_CACHE_PATH`).
+            namespace: LLM model and prompt the answers belong to.
+            threshold: Minimum cosine similarity between question embeddings
+                (`ANSWER_CACHE_THRESHOLD`).
+            max_entries: Maximum number of answers (`ANSWER_CACHE_MAX_ENTRIES`).
+            max_bytes: Maximum total size of the answers
+                (`ANSWER_CACHE_MAX_MB`).
+
+        """
+        self.path = path or os.getenv("ANSWER_CACHE_PATH", "cache/answers.sqlite")
+        self.namespace = namespace
+        self.threshold = (
+            threshold
+            if threshold is not None
+            else float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+        )
+        self.max_entries = max_entries or int(
+            os.getenv("ANSWER_CACHE_MAX_ENTRIES", "10000")
+        )
+        self.max_bytes = max_bytes or int(
+            float(os.getenv("ANSWER_CACHE_MAX_MB", "64")) * 1024 * 1024
+        )
+        self.stats = AnswerCacheStats()
+        self._lock = threading.Lock()
+        # Last version stored per store, to purge older versions only once
+        self._versions: Dict[str, str] = {}
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False)
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            CREATE TABLE IF NOT EXISTS answers (
+                id INTEGER PRIMARY KEY,
+                namespace TEXT NOT NULL,
+                store TEXT NOT NULL,
+                version TEXT NOT NULL,
+                context TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                answer TEXT NOT NULL,
+                bytes INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS answers_key
+                ON answers (namespace, store, version, context);
+            CREATE INDEX IF NOT EXISTS answers_last_used ON answers (last_used);
+            """
+        )
+
+    @classmethod
+    def from_env(cls, namespace: str = "") -> Optional["AnswerCache"]:
+        """Cache configured in the environment, or None unless `ANSWER_CACHE=1`."""
+        if os.getenv("ANSWER_CACHE", "0") != "1":
+            return None
+        return cls(namespace=namespace)
+
+    def get(self, key: AnswerKey) -> Optional[str]:
+        """Return the cached answer for the key, or None."""
+        vector = _normalize(key.query_vector)
+        with span("llm.answer_cache") as current, self._lock:
+            rows = self._connection.execute(
+                "SELECT id, vector, answer FROM answers "
+                "WHERE namespace = ? AND store = ? AND version = ? AND context = ?",
+                (self.namespace, key.store, key.version, key.context_key),
+            ).fetchall()
+            best, answer = None, None
+            for _id, blob, text in rows:
+                similarity = float(np.dot(vector, np.frombuffer(blob, np.float32)))
+                if similarity >= self.threshold and (
+                    best is None or similarity > best[1]
+                ):
+                    best, answer = (_id, similarity), text
+            if best is not None:
+                self._connection.execute(
+                    "UPDATE answers SET last_used = ? WHERE id = ?",
+                    (time.time(), best[0]),
+                )
+                self._connection.commit()
+                self.stats.hits += 1
+            else:
+                self.stats.misses += 1
+            current.set("hit", best is not None)
+        record_cache("answers", int(best is not None), int(best is None))
+        return answer
+
+    def put(self, key: AnswerKey, answer: str) -> None:
+        """Store an answer, evicting old versions and the least recently used."""
+        if not answer:
+            return
+        now = time.time()
+        vector = _normalize(key.query_vector)
+        with self._lock:
+            if self._versions.get(key.store) != key.version:
+                self._purge_versions(key.store, key.version)
+                self._versions[key.store] = key.version
+            self._connection.execute(
+                "INSERT INTO answers (namespace, store, version, context, vector, "
+                "answer, bytes, created, last_used) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    self.namespace,
+                    key.store,
+                    key.version,
+                    key.context_key,
+                    vector.tobytes(),
+                    answer,
+                    len(answer.encode("utf-8")) + vector.nbytes,
+                    now,
+                    now,
+                ),
+            )
+            self._evict()
+            self._connection.commit()
+
+    def clear(self) -> None:
+        """Delete every cached answer."""
+        with self._lock:
+            self._connection.execute("DELETE FROM answers")
+            self._connection.commit()
+            self._versions.clear()
+
+    def __len__(self) -> int:
+        """Return the number of cached answers."""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM answers").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the SQLite connection."""
+        with self._lock:
+            self._connection.close()
+
+    def _purge_versions(self, store: str, version: str) -> None:
+        """Delete the answers of the other versions of a store."""
+        deleted = self._connection.execute(
+            "DELETE FROM answers WHERE store = ? AND version != ?", (store, version)
+        ).rowcount
+        self.stats.invalidated += deleted
+
+    def _evict(self) -> None:
+        """Delete the least recently used answers beyond the limits."""
+        entries, size = self._connection.execute(
+            "SELECT COUNT(*), COALESCE(SUM(bytes), 0) FROM answers"
+        ).fetchone()
+        if entries <= self.max_entries and size <= self.max_bytes:
+            return
+        victims: List[int] = []
+        for _id, nbytes in self._connection.execute(
+            "SELECT id, bytes FROM answers ORDER BY last_used"
+        ):
+            if entries <= self.max_entries and size <= self.max_bytes:
+                break
+            victims.append(_id)
+            entries -= 1
+            size -= nbytes
+        self._connection.executemany(
+            "DELETE FROM answers WHERE id = ?", [(_id,) for _id in victims]
+        )
+        self.stats.evictions += len(victims)
+
+
+def _normalize(vector: Sequence[float]) -> np.ndarray:
+    """Unit-length float32 copy of a vector, so a dot product is the cosine."""
+    vector = np.asarray(vector, dtype=np.float32).reshape(-1)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
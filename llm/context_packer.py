@@ -0,0 +1,270 @@
+import hashlib
+import math
+import os
+import re
+from dataclasses import dataclass, field
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from telemetry.instruments import CONTEXT_TOKENS
+from telemetry.tracing import span
+from vectorstore.search_result import SearchResult
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+_SENTENCE_END = re.compile(r"[.;:!?]\s")
+# Rough average for Spanish legal text with OpenAI-style BPE tokenizers
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    """Approximate number of LLM tokens of a text."""
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def simhash(text: str, shingle: int = 3) -> int:
+    """64-bit SimHash of the word shingles of a text.
+
+    Texts that share most of their shingles get hashes that differ in few bits,
+    so near-duplicate chunks can be found with a Hamming distance check.
+    """
+    words = _WORD.findall(text.lower())
+    features = [
+        " ".join(words[i : i + shingle]) for i in range(max(1, len(words) - shingle + 1))
+    ]
+    digests = b"".join(
+        hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        for feature in features
+    )
+    # One row of 64 bits per feature; each bit votes +1 or -1
+    bits = np.unpackbits(np.frombuffer(digests, dtype=np.uint8).reshape(-1, 8), axis=1)
+    votes = bits.sum(axis=0) * 2 > len(features)
+    return int.from_bytes(np.packbits(votes).tobytes(), "big")
+
+
+def overlap(left: str, right: str, min_overlap: int) -> int:
+    """Length of the longest suffix of `left` that is a prefix of `right`.
+
+    Returns 0 if it is shorter than `min_overlap` characters.
+    """
+    if min(len(left), len(right)) < min_overlap:
+        return 0
+    head = right[:min_overlap]
+    start = max(0, len(left) - len(right))
+    while (index := left.find(head, start)) != -1:
+        if right.startswith(left[index:]):
+            return len(left) - index
+        start = index + 1
+    return 0
+
+
+@dataclass
+class Passage:
+    """Text of one or more merged chunks of the same source."""
+
+    text: str
+    source: Optional[str]
+    rank: int
+    metadata: Dict[str, Any] = field(default_factory=dict)
+    chunks: int = 1
+
+
+@dataclass
+class PackedContext:
+    """Context ready for `PROMPT_TEMPLATE` and what packing removed."""
+
+    text: str
+    sources: List[str]
+    tokens: int
+    retrieved_tokens: int
+    chunks: int
+    merged: int = 0
+    duplicates: int = 0
+    dropped: int = 0
+
+    @property
+    def saved_ratio(self) -> float:
+        """Fraction of the retrieved tokens that did not reach the prompt."""
+        if not self.retrieved_tokens:
+            return 0.0
+        return 1 - self.tokens / self.retrieved_tokens
+
+
+class ContextPacker:
+    """Turns search results into a compact, cited context for the LLM.
+
+    1. Chunks of the same source whose texts overlap (the splitter's
+       `chunk_overlap`) or contain one another are merged into one passage.
+    2. Passages whose SimHash is within `max_distance` bits of a better-ranked
+       passage are dropped as near-duplicates.
+    3. Passages are grouped under one short citation per source (`[1] ley.pdf,
+       p. 3`) and packed in rank order into `token_budget` tokens; the last one is
+       cut at a sentence boundary if it does not fit whole.
+
+    With `enabled=False` it returns the raw results, as `search_similarity` did.
+    """
+
+    def __init__(
+        self,
+        token_budget: Optional[int] = None,
+        max_distance: Optional[int] = None,
+        min_overlap: Optional[int] = None,
+        enabled: Optional[bool] = None,
+    ):
+        """Initialize the packer.
+
+        Args:
+            token_budget: Maximum context tokens (`CONTEXT_TOKEN_BUDGET`).
+            max_distance: SimHash bits under which two passages are duplicates
+                (`CONTEXT_SIMHASH_DISTANCE`).
+            min_overlap: Shortest text overlap, in characters, that merges two
+                chunks (`CONTEXT_MIN_OVERLAP`).
+            enabled: Whether to pack at all (`CONTEXT_PACKING`).
+
+        """
+        self.token_budget = token_budget or int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+        self.max_distance = (
+            max_distance
+            if max_distance is not None
+            else int(os.getenv("CONTEXT_SIMHASH_DISTANCE", "3"))
+        )
+        self.min_overlap = min_overlap or int(os.getenv("CONTEXT_MIN_OVERLAP", "30"))
+        self.enabled = (
+            enabled if enabled is not None else os.getenv("CONTEXT_PACKING", "1") == "1"
+        )
+
+    def pack(self, results: List[SearchResult]) -> PackedContext:
+        """Build the context from results sorted from best to worst."""
+        retrieved = str([result.to_dict() for result in results])
+        retrieved_tokens = estimate_tokens(retrieved)
+        if not self.enabled:
+            return PackedContext(
+                text=retrieved,
+                sources=list(dict.fromkeys(r.source for r in results if r.source)),
+                tokens=retrieved_tokens,
+                retrieved_tokens=retrieved_tokens,
+                chunks=len(results),
+            )
+
+        with span("context.pack", chunks=len(results)) as current:
+            passages = [
+                Passage(result.content, result.source, rank, dict(result.metadata))
+                for rank, result in enumerate(results)
+            ]
+            merged = self._merge(passages)
+            unique = self._deduplicate(merged)
+            packed = self._pack(unique)
+            packed.retrieved_tokens = retrieved_tokens
+            packed.chunks = len(results)
+            packed.merged = len(passages) - len(merged)
+            packed.duplicates = len(merged) - len(unique)
+            current.set("tokens", packed.tokens)
+            current.set("retrieved_tokens", retrieved_tokens)
+        CONTEXT_TOKENS.labels("retrieved").inc(retrieved_tokens)
+        CONTEXT_TOKENS.labels("packed").inc(packed.tokens)
+        return packed
+
+    def _merge(self, passages: List[Passage]) -> List[Passage]:
+        """Merge overlapping or contained passages of the same source."""
+        merged: List[Passage] = []
+        for passage in passages:
+            pending = passage
+            while True:
+                for other in merged:
+                    if other.source != pending.source:
+                        continue
+                    joined = self._join(other.text, pending.text)
+                    if joined is not None:
+                        merged.remove(other)
+                        pending = Passage(
+                            joined,
+                            other.source,
+                            min(other.rank, pending.rank),
+                            other.metadata,
+                            other.chunks + pending.chunks,
+                        )
+                        break
+                else:
+                    # No more passages to join with
+                    break
+            merged.append(pending)
+        return sorted(merged, key=lambda passage: passage.rank)
+
+    def _join(self, first: str, second: str) -> Optional[str]:
+        """Text of both passages if they overlap or one contains the other."""
+        if second in first:
+            return first
+        if first in second:
+            return second
+        if length := overlap(first, second, self.min_overlap):
+            return first + second[length:]
+        if length := overlap(second, first, self.min_overlap):
+            return second + first[length:]
+        return None
+
+    def _deduplicate(self, passages: List[Passage]) -> List[Passage]:
+        """Drop passages that are near-duplicates of a better-ranked one."""
+        kept: List[Passage] = []
+        hashes: List[int] = []
+        for passage in passages:
+            value = simhash(passage.text)
+            if any(
+                bin(value ^ other).count("1") <= self.max_distance for other in hashes
+            ):
+                continue
+            kept.append(passage)
+            hashes.append(value)
+        return kept
+
+    def _pack(self, passages: List[Passage]) -> PackedContext:
+        """Group the passages by source and fit them into the token budget."""
+        citations: Dict[Optional[str], str] = {}
+        blocks: Dict[Optional[str], List[str]] = {}
+        used, dropped = 0, 0
+        for passage in passages:
+            header = ""
+            if passage.source not in citations:
+                citations[passage.source] = f"[{len(citations) + 1}]"
+                header = f"{citations[passage.source]} {_citation(passage)}\n"
+            cost = estimate_tokens(header + passage.text) + 1
+            text = passage.text
+            if used + cost > self.token_budget:
+                text = _truncate(text, self.token_budget - used - estimate_tokens(header))
+                if not text:
+                    if header:
+                        del citations[passage.source]
+                    dropped += 1
+                    continue
+                cost = estimate_tokens(header + text) + 1
+            blocks.setdefault(passage.source, []).append(header + text)
+            used += cost
+
+        text = "\n\n".join("\n…\n".join(block) for block in blocks.values())
+        return PackedContext(
+            text=text,
+            sources=[source for source in citations if source],
+            tokens=estimate_tokens(text),
+            retrieved_tokens=0,
+            chunks=0,
+            dropped=dropped,
+        )
+
+
+def _citation(passage: Passage) -> str:
+    """Short reference of a passage: file name and page, if known."""
+    citation = os.path.basename(passage.source) if passage.source else "?"
+    if passage.metadata.get("page") is not None:
+        citation += f", p. {passage.metadata['page']}"
+    return citation
+
+
+def _truncate(text: str, tokens: int, min_tokens: int = 40) -> str:
+    """Cut a text to about `tokens` tokens at the last sentence boundary.
+
+    Returns an empty string if less than `min_tokens` fit.
+    """
+    if tokens < min_tokens:
+        return ""
+    limit = tokens * CHARS_PER_TOKEN
+    cut = [match.end() for match in _SENTENCE_END.finditer(text, 0, limit)]
+    return text[: cut[-1]].rstrip() if cut else text[:limit].rstrip() + "…"
@@ -1,11 +1,26 @@
+import asyncio
+import hashlib
 import os
-from typing import Optional
+import time
+from dataclasses import dataclass
+from functools import cached_property
+from typing import AsyncIterator, Iterator, Optional
 
+import httpx
 from dotenv import load_dotenv
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_openai import ChatOpenAI
 from rich.console import Console
 
+from llm.answer_cache import AnswerCache, AnswerKey
+from telemetry.instruments import (
+    LLM_BYTES,
+    LLM_REQUESTS,
+    LLM_TIME_TO_FIRST_TOKEN,
+    LLM_TOKENS,
+    utf8_len,
+)
+from telemetry.tracing import span
+
 console = Console()
 
 PROMPT_TEMPLATE = ChatPromptTemplate(
@@ -13,7 +28,7 @@ PROMPT_TEMPLATE = ChatPromptTemplate(
         (
             "system",
             "Answer the user's question, using the context provided, and at the end mention the source of the context used.",  # noqa: E501
-        ), 
+        ),
         (
             "user",
             "User query: '{user question}' context to answer user question: '{context}'",
@@ -22,56 +37,312 @@ PROMPT_TEMPLATE = ChatPromptTemplate(
 )
 
 
+@dataclass
+class GenerationStats:
+    """Latency and throughput of a streamed response."""
+
+    time_to_first_token: Optional[float] = None
+    total_seconds: float = 0.0
+    tokens: int = 0
+    prompt_tokens: int = 0
+    response_bytes: int = 0
+    # True if the answer came from the answer cache instead of the LLM
+    cached: bool = False
+
+    @property
+    def tokens_per_second(self) -> float:
+        """Tokens generated per second after the first token arrived."""
+        if self.time_to_first_token is None:
+            return 0.0
+        elapsed = self.total_seconds - self.time_to_first_token
+        return self.tokens / elapsed if elapsed > 0 else 0.0
+
+
 class LLMManager:
     """LLM Manager class to generate responses using the LLM model."""
 
-    def __init__(self):
-        """LLM Manager class to generate responses using the LLM model."""
+    def __init__(self, answer_cache: Optional[AnswerCache] = None):
+        """LLM Manager class to generate responses using the LLM model.
+
+        Answers to questions with a `cache_key` are reused from `answer_cache`
+        (by default, the one enabled by `ANSWER_CACHE=1`).
+        """
         load_dotenv()
+        self.answer_cache = (
+            answer_cache
+            if answer_cache is not None
+            else AnswerCache.from_env(namespace=_cache_namespace())
+        )
+
+        # Concurrent async requests share a pool of keep-alive connections
+        self.max_concurrency = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+        self._async_client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=self.max_concurrency,
+                max_keepalive_connections=self.max_concurrency,
+            ),
+            timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "120")), connect=10.0),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.last_stats = GenerationStats()
+
+    @cached_property
+    def llm(self):
+        """ChatOpenAI client, built on first use.
 
-        # Initialize ChatOpenAI
-        self.llm = ChatOpenAI(
+        Importing the OpenAI SDK takes about a second, so it is deferred until the
+        first question instead of slowing down startup.
+        """
+        from langchain_openai import ChatOpenAI
+
+        return ChatOpenAI(
             model_name=os.getenv("LLM_MODEL_NAME"),
             temperature=float(os.getenv("LLM_TEMPERATURE")),
             api_key=os.getenv("LLM_API_KEY"),
             base_url=os.getenv("LLM_BASE_URL"),
+            http_async_client=self._async_client,
         )
 
     def generate_response(self, prompt: str) -> str:
         """Generate a response using the LLM."""
         try:
-            response = self.llm.invoke(prompt)
+            LLM_BYTES.labels("prompt").inc(utf8_len(prompt))
+            with span("llm.generate", operation="generate") as current:
+                response = self.llm.invoke(prompt)
+                _record_response(current, "generate", response)
             return response.content
         except Exception as e:
+            LLM_REQUESTS.labels("generate", "error").inc()
             return f"Error generating response: {str(e)}"
 
-    def generate_response_with_context(self, prompt: str, context: str) -> str:
-        """Generate a response using the LLM with context."""
+    def generate_response_with_context(
+        self, prompt: str, context: str, cache_key: Optional[AnswerKey] = None
+    ) -> str:
+        """Generate a response using the LLM with context.
+
+        With a `cache_key`, a cached answer to a similar question over the same
+        chunks is returned without calling the LLM.
+        """
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
         try:
-            prompt = PROMPT_TEMPLATE.invoke({"user question": prompt, "context": context})
-            response = self.llm.invoke(prompt)
+            prompt = _build_prompt(prompt, context)
+            with span("llm.generate", operation="generate") as current:
+                response = self.llm.invoke(prompt)
+                _record_response(current, "generate", response)
+            self._store(cache_key, response.content)
             return response.content
         except Exception as e:
+            LLM_REQUESTS.labels("generate", "error").inc()
             return f"Error generating response: {str(e)}"
 
+    async def agenerate_response_with_context(
+        self, prompt: str, context: str, cache_key: Optional[AnswerKey] = None
+    ) -> str:
+        """Async version of `generate_response_with_context`.
+
+        At most `LLM_MAX_CONCURRENCY` requests are in flight at once; the rest wait
+        for a free slot instead of overloading the provider.
+        """
+        cached = self._cached(cache_key)
+        if cached is not None:
+            return cached
+        try:
+            prompt = _build_prompt(prompt, context)
+            with span("llm.queue"):
+                await self._semaphore.acquire()
+            try:
+                with span("llm.generate", operation="generate") as current:
+                    response = await self.llm.ainvoke(prompt)
+                    _record_response(current, "generate", response)
+            finally:
+                self._semaphore.release()
+            self._store(cache_key, response.content)
+            return response.content
+        except Exception as e:
+            LLM_REQUESTS.labels("generate", "error").inc()
+            return f"Error generating response: {str(e)}"
+
+    def stream_response_with_context(
+        self,
+        prompt: str,
+        context: str,
+        stats: Optional[GenerationStats] = None,
+        cache_key: Optional[AnswerKey] = None,
+    ) -> Iterator[str]:
+        """Yield the response tokens as they arrive from the LLM.
+
+        Time-to-first-token and tokens/sec are recorded in `stats` (if given) and
+        in `self.last_stats` once the stream ends. A cached answer (see
+        `generate_response_with_context`) is yielded whole.
+        """
+        stats = stats if stats is not None else GenerationStats()
+        self.last_stats = stats
+        start = time.perf_counter()
+        cached = self._cached(cache_key)
+        if cached is not None:
+            _record_cached(stats, cached, start)
+            yield cached
+            return
+        status = "error"
+        tokens = []
+        try:
+            prompt = _build_prompt(prompt, context)
+            with span("llm.generate", operation="stream") as current:
+                for chunk in self.llm.stream(prompt):
+                    _record_chunk(stats, chunk, start)
+                    if chunk.content:
+                        tokens.append(chunk.content)
+                        yield chunk.content
+                status = "ok"
+                _record_stream(current, stats)
+            self._store(cache_key, "".join(tokens))
+        except GeneratorExit:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            yield f"Error generating response: {str(e)}"
+        finally:
+            stats.total_seconds = time.perf_counter() - start
+            LLM_REQUESTS.labels("stream", status).inc()
+
+    async def astream_response_with_context(
+        self,
+        prompt: str,
+        context: str,
+        stats: Optional[GenerationStats] = None,
+        cache_key: Optional[AnswerKey] = None,
+    ) -> AsyncIterator[str]:
+        """Async version of `stream_response_with_context`.
+
+        Shares the `LLM_MAX_CONCURRENCY` limit with `agenerate_response_with_context`;
+        the time spent waiting for a slot counts towards time-to-first-token.
+        """
+        stats = stats if stats is not None else GenerationStats()
+        self.last_stats = stats
+        start = time.perf_counter()
+        cached = self._cached(cache_key)
+        if cached is not None:
+            _record_cached(stats, cached, start)
+            yield cached
+            return
+        status = "error"
+        tokens = []
+        try:
+            prompt = _build_prompt(prompt, context)
+            with span("llm.queue"):
+                await self._semaphore.acquire()
+            try:
+                with span("llm.generate", operation="stream") as current:
+                    async for chunk in self.llm.astream(prompt):
+                        _record_chunk(stats, chunk, start)
+                        if chunk.content:
+                            tokens.append(chunk.content)
+                            yield chunk.content
+                    status = "ok"
+                    _record_stream(current, stats)
+            finally:
+                self._semaphore.release()
+            self._store(cache_key, "".join(tokens))
+        except GeneratorExit:
+            status = "cancelled"
+            raise
+        except Exception as e:
+            yield f"Error generating response: {str(e)}"
+        finally:
+            stats.total_seconds = time.perf_counter() - start
+            LLM_REQUESTS.labels("stream", status).inc()
+
+    async def aclose(self) -> None:
+        """Close the pooled HTTP connections used by the async methods."""
+        await self._async_client.aclose()
+
+    def _cached(self, cache_key: Optional[AnswerKey]) -> Optional[str]:
+        """Return the cached answer for the key, if the cache has one."""
+        if self.answer_cache is None or cache_key is None:
+            return None
+        return self.answer_cache.get(cache_key)
+
+    def _store(self, cache_key: Optional[AnswerKey], answer: str) -> None:
+        """Cache a complete answer generated for the key."""
+        if self.answer_cache is not None and cache_key is not None:
+            self.answer_cache.put(cache_key, answer)
+
     def stream_generate_response_with_context(
         self, prompt: str, context: str
     ) -> Optional[None | str]:
         """Generate a response using the LLM with context and stream the response."""
-        try:
-            prompt = PROMPT_TEMPLATE.invoke({"user question": prompt, "context": context})
-            self.llm = ChatOpenAI(
-                model_name=os.getenv("LLM_MODEL_NAME"),
-                temperature=float(os.getenv("LLM_TEMPERATURE")),
-                api_key=os.getenv("LLM_API_KEY"),
-                base_url=os.getenv("LLM_BASE_URL"),
-                streaming=True,
-            )
-            for chunk in self.llm.stream(prompt):
-                console.print(chunk.content, end="", style="bold green", justify="full")
-            console.print("\n")
-        except Exception as e:
-            return f"Error generating response: {str(e)}"
+        for token in self.stream_response_with_context(prompt, context):
+            console.print(token, end="", style="bold green", markup=False)
+        console.print("\n")
+
+
+def _cache_namespace() -> str:
+    """Identify the model, temperature and prompt the cached answers depend on."""
+    template = hashlib.blake2b(
+        repr(PROMPT_TEMPLATE.messages).encode("utf-8"), digest_size=8
+    ).hexdigest()
+    return ":".join(
+        [os.getenv("LLM_MODEL_NAME", ""), os.getenv("LLM_TEMPERATURE", ""), template]
+    )
+
+
+def _build_prompt(prompt: str, context: str):
+    """Fill `PROMPT_TEMPLATE` with the question and the retrieved context."""
+    with span("llm.prompt"):
+        LLM_BYTES.labels("question").inc(utf8_len(prompt))
+        LLM_BYTES.labels("context").inc(utf8_len(context))
+        return PROMPT_TEMPLATE.invoke({"user question": prompt, "context": context})
+
+
+def _record_chunk(stats: GenerationStats, chunk, start: float) -> None:
+    """Update the stream statistics with a received chunk."""
+    if stats.time_to_first_token is None and chunk.content:
+        stats.time_to_first_token = time.perf_counter() - start
+    usage = getattr(chunk, "usage_metadata", None)
+    if usage and usage.get("input_tokens"):
+        stats.prompt_tokens = usage["input_tokens"]
+    if usage and usage.get("output_tokens"):
+        # The server reports the exact token count in the last chunk
+        stats.tokens = usage["output_tokens"]
+    elif chunk.content:
+        stats.tokens += 1
+    if chunk.content:
+        stats.response_bytes += utf8_len(chunk.content)
+
+
+def _record_cached(stats: GenerationStats, answer: str, start: float) -> None:
+    """Fill the stream statistics of an answer served from the cache."""
+    stats.cached = True
+    stats.time_to_first_token = time.perf_counter() - start
+    stats.total_seconds = stats.time_to_first_token
+    stats.response_bytes = utf8_len(answer)
+
+
+def _record_stream(current, stats: GenerationStats) -> None:
+    """Add the statistics of a finished stream to the metrics and its span."""
+    if stats.time_to_first_token is not None:
+        LLM_TIME_TO_FIRST_TOKEN.observe(stats.time_to_first_token)
+        current.set("time_to_first_token_ms", 1000 * stats.time_to_first_token)
+    LLM_TOKENS.labels("completion").inc(stats.tokens)
+    LLM_TOKENS.labels("prompt").inc(stats.prompt_tokens)
+    LLM_BYTES.labels("response").inc(stats.response_bytes)
+    current.set("completion_tokens", stats.tokens)
+    current.set("prompt_tokens", stats.prompt_tokens)
+
+
+def _record_response(current, operation: str, response) -> None:
+    """Add a complete (non-streamed) response to the metrics and its span."""
+    usage = getattr(response, "usage_metadata", None) or {}
+    completion = usage.get("output_tokens", 0)
+    prompt = usage.get("input_tokens", 0)
+    LLM_REQUESTS.labels(operation, "ok").inc()
+    LLM_TOKENS.labels("completion").inc(completion)
+    LLM_TOKENS.labels("prompt").inc(prompt)
+    LLM_BYTES.labels("response").inc(utf8_len(response.content))
+    current.set("completion_tokens", completion)
+    current.set("prompt_tokens", prompt)
 
 
 def test_llm_manager():
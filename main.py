@@ -1,71 +1,127 @@
 import os
-import shutil
-import time
-from typing import List
+from typing import Optional
 
+from dotenv import load_dotenv
 from loguru import logger
 from rich.console import Console
-from rich.progress import Progress
+from rich.progress_bar import ProgressBar
 from rich.table import Table
 
+from llm.answer_cache import AnswerKey
+from llm.context_packer import ContextPacker
 from llm.llm_manager import LLMManager
+from vectorstore.ingest_worker import JobQueue, start_worker
+from vectorstore.reranker import Reranker
 from vectorstore.vectorstore_manager import VectorStoreManager
 
 logger.add("warnings.log", level="WARNING", format="{time} - {level} - {message}")
 console = Console()
 
 
-path = "derecho_files"
-name_vectorstore = "legislacion_MAX_INNER_PRODUCT"
-vectorstore = VectorStoreManager(name=name_vectorstore, path=path)
-llm_manager = LLMManager()
+load_dotenv()
+path = os.getenv("VECTORSTORE_PATH", "derecho_files")
+name_vectorstore = os.getenv("VECTORSTORE_NAME", "legislacion_MAX_INNER_PRODUCT")
 
 
-def interact_with_vectorstore(files_to_add: List[str], add_files: bool) -> None:
-    """Interact with the vectorstore."""
-    if add_files:
-        with Progress() as progress:
-            task = progress.add_task(
-                "[cyan]Añadiendo archivos al vectorstore...", total=len(files_to_add)
-            )
-            os.makedirs("temp", exist_ok=True)
-            for file in files_to_add:
-                shutil.copy(file, "temp")
-            if vectorstore.add_list_files_vectorstore(path_files="temp"):
-                progress.update(task, advance=len(files_to_add))
+def report_ingestion(jobs: JobQueue, job_id: int) -> Optional[int]:
+    """Print the progress of a background ingestion job.
+
+    Returns:
+        Optional[int]: The job id while it is still queued or running, else None.
+
+    """
+    job = jobs.get(job_id)
+    if job is None:
+        return None
+    if job.active:
+        status = Table.grid(padding=(0, 1))
+        status.add_row(
+            ProgressBar(
+                total=job.files_total or None, completed=job.files_parsed, width=30
+            ),
+            f"[dim]Ingesta en segundo plano: {job.files_parsed}/{job.files_total} "
+            f"archivos · {job.batches} lotes · {job.chunks} chunks[/dim]",
+        )
+        console.print(status)
+        return job_id
+    if job.status == "done":
+        console.print("[bold green]Vectorstore actualizado correctamente.[/bold green]")
+        for fuente in job.files_failed:
+            console.print(f"[bold red]No se pudo procesar:[/bold red] {fuente}")
+    else:
         console.print(
-            "[bold green]Archivos añadidos correctamente al vectorstore.[/bold green]"
+            f"[bold red]Error al actualizar el vectorstore:[/bold red] {job.error}"
         )
-        shutil.rmtree("temp")
+    return None
 
+
+def interact_with_vectorstore(
+    vectorstore: VectorStoreManager,
+    llm_manager: LLMManager,
+    jobs: Optional[JobQueue] = None,
+    job_id: Optional[int] = None,
+) -> None:
+    """Interact with the vectorstore.
+
+    While the ingestion job `job_id` runs in the worker process, queries are
+    answered from the current index and its progress is shown before each prompt
+    (press Enter to refresh it). The new index replaces the current one as soon
+    as the worker publishes it.
+    """
     console.print("\n[bold cyan]Interacción con la base de datos vectorial[/bold cyan]")
     console.print("[bold green]Escribe tu consulta o 'exit' para salir.[/bold green]\n")
+    context_packer = ContextPacker()
+    reranker = Reranker()
 
     while True:
+        if jobs is not None and job_id is not None:
+            job_id = report_ingestion(jobs, job_id)
+        # Generación publicada por el worker de ingesta, cargada aparte
+        vectorstore = vectorstore.reopen() or vectorstore
         try:
             query = console.input("[bold yellow]Consulta > [/bold yellow]").strip()
             if query.lower() == "exit":
                 console.print("[bold red]Saliendo de la interacción...[/bold red]")
                 break
+            if not query:
+                continue
         except KeyboardInterrupt:
             console.print("[bold red]Saliendo de la interacción...[/bold red]")
             break
 
         try:
-            context = vectorstore.search_similarity(query=query)
+            # Con RERANK=1 se piden más candidatos y el cross-encoder elige los mejores
+            k = 5
+            candidates = vectorstore.search_batch([query], k=reranker.fetch_k(k))[0]
+            results = reranker.rerank(query, candidates, k)
+            # Fusiona, deduplica y recorta los chunks antes de enviarlos al LLM
+            packed = context_packer.pack(results)
+            context = packed.text
             vectorstore_ = vectorstore.vectorstore.distance_strategy
             print(vectorstore_)
             console.print("[bold purple]Contexto:[/bold purple]\n")
-            console.print(context)
-            respuesta_llm = llm_manager.generate_response_with_context(query, context)
+            console.print(context, markup=False)
+            console.print(
+                f"[dim]{packed.tokens} tokens de contexto "
+                f"({packed.retrieved_tokens} recuperados)[/dim]\n"
+            )
             console.print("[bold purple]Respuesta:[/bold purple]\n")
-            # Simular respuesta en vivo con velocidad constante de 128 caracteres*s
-            respuesta = respuesta_llm
-            chars_per_second = 128
-            sleep_time = 1 / chars_per_second
-            for char in respuesta:
-                console.print(char, end="", style="bold green")
-                time.sleep(sleep_time)
+            cache_key = None
+            if llm_manager.answer_cache is not None:
+                cache_key = AnswerKey.for_results(vectorstore, query, results)
+            # Mostrar los tokens a medida que llegan del LLM
+            for token in llm_manager.stream_response_with_context(
+                query, context, cache_key=cache_key
+            ):
+                console.print(token, end="", style="bold green", markup=False)
+            stats = llm_manager.last_stats
+            if stats.cached:
+                console.print("\n\n[dim]Respuesta reutilizada de la caché[/dim]")
+            elif stats.time_to_first_token is not None:
+                console.print(
+                    f"\n\n[dim]Primer token en {stats.time_to_first_token:.2f} s · "
+                    f"{stats.tokens_per_second:.1f} tokens/s[/dim]"
+                )
             console.print("\n")
         except Exception as e:
             logger.error(f"Error al realizar la consulta: {e}")
@@ -78,13 +134,17 @@ def main() -> None:
     Initialize and manage a vector store for legal documents. It performs the
     following operations:
     1. Checks if vector store exists, creates it if not
-    2. Compares existing files in the path with those in vector store
+    2. Detects added, changed, renamed and deleted files using the file manifest
     3. Creates a table showing status of each file
-    4. Initiates interaction with vector store for any new files
+    4. Queues the re-indexing of what changed in the background ingestion worker
+       and initiates interaction with vector store
 
     The function runs in a loop until the vector store is properly initialized,
-    then processes any new files found in the specified path.
+    then processes any changes found in the specified path.
     """
+    # The embedding model and the FAISS index load on first use
+    vectorstore = VectorStoreManager(name=name_vectorstore, path=path)
+    llm_manager = LLMManager()
     while True:
         # limpiar la consola
         console.clear()
@@ -103,8 +163,14 @@ def main() -> None:
         else:
             break
 
-    lista_fuentes = {os.path.basename(fuente) for fuente in vectorstore.list_sources()}
-    lista_path = os.listdir(path)
+    diff = vectorstore.detect_changes()
+    lista_path = [
+        *diff.unchanged,
+        *diff.added,
+        *diff.changed,
+        *diff.renamed,
+        *diff.duplicates,
+    ]
 
     table = Table(
         title="Estado de Archivos en el Vectorstore",
@@ -113,28 +179,50 @@ def main() -> None:
     table.add_column("Archivo", justify="left")
     table.add_column("Estado", justify="center")
 
-    files_to_add = []
-    for fuente in lista_path:
-        if fuente not in lista_fuentes:
-            table.add_row(fuente, "[yellow]Se añadirá[/yellow]")
-            logger.warning(
-                f"El archivo '{fuente}' no está en el vectorstore. Se procede a añadir."
-            )
-            files_to_add.append(os.path.join(path, fuente))
-        else:
-            fuente_sin_guion_bajo = os.path.splitext(fuente)[0].replace("_", " ").lower()
-            fuente_sin_guion_bajo = (
-                fuente_sin_guion_bajo[:100] + "..."
-                if len(fuente_sin_guion_bajo) > 100
-                else fuente_sin_guion_bajo
-            )
-            fuente_sin_guion_bajo = fuente_sin_guion_bajo.capitalize()
-            table.add_row(
-                fuente_sin_guion_bajo, "[green]Ya está en el vectorstore[/green]"
-            )
+    for ruta in diff.added:
+        fuente = os.path.basename(ruta)
+        table.add_row(fuente, "[yellow]Se añadirá[/yellow]")
+        logger.warning(
+            f"El archivo '{fuente}' no está en el vectorstore. Se procede a añadir."
+        )
+    for ruta in diff.changed:
+        fuente = os.path.basename(ruta)
+        table.add_row(fuente, "[yellow]Modificado, se reindexará[/yellow]")
+        logger.warning(f"El archivo '{fuente}' ha cambiado. Se procede a reindexar.")
+    for ruta, anterior in diff.renamed.items():
+        table.add_row(
+            os.path.basename(ruta),
+            f"[cyan]Renombrado desde '{os.path.basename(anterior)}'[/cyan]",
+        )
+    for ruta, original in diff.duplicates.items():
+        table.add_row(
+            os.path.basename(ruta),
+            f"[cyan]Copia de '{os.path.basename(original)}', se indexará[/cyan]",
+        )
+    for ruta in diff.deleted:
+        fuente = os.path.basename(ruta)
+        table.add_row(fuente, "[red]Eliminado, se quitará del vectorstore[/red]")
+        logger.warning(f"El archivo '{fuente}' ya no existe. Se procede a eliminar.")
+    for ruta in diff.unchanged:
+        fuente = os.path.basename(ruta)
+        fuente_sin_guion_bajo = os.path.splitext(fuente)[0].replace("_", " ").lower()
+        fuente_sin_guion_bajo = (
+            fuente_sin_guion_bajo[:100] + "..."
+            if len(fuente_sin_guion_bajo) > 100
+            else fuente_sin_guion_bajo
+        )
+        fuente_sin_guion_bajo = fuente_sin_guion_bajo.capitalize()
+        table.add_row(fuente_sin_guion_bajo, "[green]Ya está en el vectorstore[/green]")
 
     console.print(table)
-    interact_with_vectorstore(files_to_add, bool(files_to_add))
+    jobs, job_id = None, None
+    if diff.has_changes:
+        # Los cambios se indexan en otro proceso; mientras tanto se consulta el índice
+        # actual
+        jobs = JobQueue()
+        job_id = jobs.submit(name_vectorstore, path)
+        start_worker()
+    interact_with_vectorstore(vectorstore, llm_manager, jobs, job_id)
 
 
 if __name__ == "__main__":
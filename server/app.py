@@ -0,0 +1,300 @@
+import asyncio
+import contextlib
+import hmac
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, AsyncIterator, Dict
+
+from aiohttp import web
+from dotenv import load_dotenv
+from loguru import logger
+
+from llm.answer_cache import AnswerKey
+from llm.context_packer import ContextPacker
+from llm.llm_manager import GenerationStats, LLMManager
+from server.query_batcher import QueryBatcher
+from telemetry.metrics import REGISTRY
+from vectorstore.reranker import Reranker
+from vectorstore.sharded_store import ShardedVectorStore
+from vectorstore.snapshot_archive import snapshot_key
+from vectorstore.vectorstore_manager import SEARCH_MODES, VectorStoreManager
+
+BATCHER_KEY = web.AppKey("batcher", QueryBatcher)
+LLM_KEY = web.AppKey("llm_manager", LLMManager)
+PACKER_KEY = web.AppKey("context_packer", ContextPacker)
+EXECUTOR_KEY = web.AppKey("executor", ThreadPoolExecutor)
+SNAPSHOT_TOKEN_KEY = web.AppKey("snapshot_token", str)
+
+
+def create_app(
+    vectorstore: VectorStoreManager | ShardedVectorStore,
+    llm_manager: LLMManager,
+    search_workers: int | None = None,
+    reranker: Reranker | None = None,
+) -> web.Application:
+    """Build the aiohttp application that serves concurrent queries.
+
+    Endpoints:
+        GET /health: Liveness and micro-batching statistics.
+        GET /metrics: Telemetry in the Prometheus text format, or as JSON with
+            `?format=json`.
+        POST /search: `{"query", "k", "source", "mode"}` → retrieved chunks.
+        POST /ask: Same body; streams the answer as NDJSON lines (`context`,
+            one `token` line per chunk and a final `done` line with the stats).
+        GET /snapshot: Streams a signed snapshot archive of the vectorstore, so a
+            new node can start with `python -m vectorstore.snapshot_archive
+            import http://<host>/snapshot` instead of re-embedding the corpus.
+            Requires `Authorization: Bearer <SNAPSHOT_TOKEN>`; disabled when
+            `SNAPSHOT_TOKEN` is not set.
+
+    Retrieval runs in a thread pool of `search_workers` threads
+    (`SERVER_SEARCH_WORKERS`), so slow LLM streams never block other searches.
+    Results are re-ranked by `reranker` (by default configured from `RERANK*`)
+    in the same thread pool.
+
+    Every `VECTORSTORE_WATCH_SECONDS` (0 disables it) the server checks whether
+    the ingestion worker has published a new generation of the vectorstore; it
+    loads it in the background and swaps it in, while in-flight searches finish
+    on the previous one.
+    """
+    executor = ThreadPoolExecutor(
+        max_workers=search_workers or int(os.getenv("SERVER_SEARCH_WORKERS", "4")),
+        thread_name_prefix="search",
+    )
+    app = web.Application()
+    app[EXECUTOR_KEY] = executor
+    app[BATCHER_KEY] = QueryBatcher(
+        vectorstore, executor, reranker=reranker or Reranker()
+    )
+    app[LLM_KEY] = llm_manager
+    app[PACKER_KEY] = ContextPacker()
+    app[SNAPSHOT_TOKEN_KEY] = os.getenv("SNAPSHOT_TOKEN", "")
+    app.router.add_get("/health", health)
+    app.router.add_get("/metrics", metrics)
+    app.router.add_post("/search", search)
+    app.router.add_post("/ask", ask)
+    app.router.add_get("/snapshot", snapshot)
+    app.cleanup_ctx.append(_watch_generations)
+    app.on_cleanup.append(_cleanup)
+    return app
+
+
+async def health(request: web.Request) -> web.Response:
+    """Report that the server is up, with the micro-batching statistics."""
+    batcher = request.app[BATCHER_KEY]
+    return web.json_response(
+        {
+            "status": "ok",
+            "batches": batcher.batches,
+            "queries": batcher.queries,
+            "mean_batch_size": batcher.mean_batch_size,
+            "rerank": batcher.reranker.enabled if batcher.reranker else False,
+        }
+    )
+
+
+async def metrics(request: web.Request) -> web.Response:
+    """Export the stage latencies, counters and cache hit ratios."""
+    if request.query.get("format") == "json":
+        return web.json_response(REGISTRY.snapshot())
+    return web.Response(
+        body=REGISTRY.to_prometheus().encode("utf-8"),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+async def search(request: web.Request) -> web.Response:
+    """Return the chunks most similar to the query."""
+    body = await _read_query(request)
+    results = await request.app[BATCHER_KEY].search(
+        body["query"], body["k"], body["source"], body["mode"]
+    )
+    return web.json_response(
+        {"results": [result.to_dict() | {"score": result.score} for result in results]}
+    )
+
+
+async def ask(request: web.Request) -> web.StreamResponse:
+    """Retrieve the context for the query and stream the LLM answer."""
+    body = await _read_query(request)
+    start = time.perf_counter()
+    batcher = request.app[BATCHER_KEY]
+    results = await batcher.search(body["query"], body["k"], body["source"], body["mode"])
+    retrieval_seconds = time.perf_counter() - start
+    packed = request.app[PACKER_KEY].pack(results)
+    cache_key = None
+    if request.app[LLM_KEY].answer_cache is not None:
+        # The query embedding is usually in the query cache, but may need the model
+        cache_key = await asyncio.get_running_loop().run_in_executor(
+            request.app[EXECUTOR_KEY],
+            AnswerKey.for_results,
+            batcher.vectorstore,
+            body["query"],
+            results,
+        )
+
+    response = web.StreamResponse(headers={"Content-Type": "application/x-ndjson"})
+    await response.prepare(request)
+    await _write_line(
+        response,
+        {
+            "type": "context",
+            "sources": packed.sources,
+            "context_tokens": packed.tokens,
+        },
+    )
+    stats = GenerationStats()
+    async for token in request.app[LLM_KEY].astream_response_with_context(
+        body["query"], packed.text, stats, cache_key
+    ):
+        await _write_line(response, {"type": "token", "content": token})
+    await _write_line(
+        response,
+        {
+            "type": "done",
+            "retrieval_seconds": retrieval_seconds,
+            "time_to_first_token": stats.time_to_first_token,
+            "total_seconds": stats.total_seconds,
+            "tokens": stats.tokens,
+            "tokens_per_second": stats.tokens_per_second,
+            "cached": stats.cached,
+        },
+    )
+    await response.write_eof()
+    return response
+
+
+async def snapshot(request: web.Request) -> web.StreamResponse:
+    """Stream a snapshot archive of the vectorstore as it is written."""
+    token = request.app[SNAPSHOT_TOKEN_KEY]
+    if not token:
+        raise web.HTTPForbidden(text="Exportación desactivada: configure SNAPSHOT_TOKEN")
+    supplied = request.headers.get("Authorization", "").encode("utf-8")
+    if not hmac.compare_digest(supplied, f"Bearer {token}".encode("utf-8")):
+        raise web.HTTPUnauthorized(
+            text="Token no válido", headers={"WWW-Authenticate": "Bearer"}
+        )
+    vectorstore = request.app[BATCHER_KEY].vectorstore
+    if isinstance(vectorstore, ShardedVectorStore):
+        raise web.HTTPNotImplemented(text="Exporte cada shard por separado")
+    try:
+        snapshot_key()
+    except ValueError as e:
+        raise web.HTTPServiceUnavailable(text=str(e)) from e
+    response = web.StreamResponse(
+        headers={
+            "Content-Type": "application/gzip",
+            "Content-Disposition": f'attachment; filename="{vectorstore.name}.tar.gz"',
+        }
+    )
+    await response.prepare(request)
+    loop = asyncio.get_running_loop()
+    # Compression and hashing run in a thread, not in the event loop
+    await loop.run_in_executor(
+        None, vectorstore.export_snapshot, _ResponseWriter(response, loop)
+    )
+    await response.write_eof()
+    return response
+
+
+class _ResponseWriter:
+    """Blocking file-like writer over a streamed response, used from a thread."""
+
+    def __init__(self, response: web.StreamResponse, loop: asyncio.AbstractEventLoop):
+        self.response = response
+        self.loop = loop
+
+    def write(self, data: bytes) -> int:
+        # Waiting for each write applies the client's backpressure to the export
+        asyncio.run_coroutine_threadsafe(
+            self.response.write(bytes(data)), self.loop
+        ).result()
+        return len(data)
+
+    def flush(self) -> None:
+        pass
+
+
+async def _read_query(request: web.Request) -> Dict[str, Any]:
+    """Validate the JSON body shared by `/search` and `/ask`."""
+    try:
+        body = await request.json()
+    except json.JSONDecodeError as e:
+        raise web.HTTPBadRequest(text="El cuerpo debe ser JSON") from e
+    query = body.get("query") if isinstance(body, dict) else None
+    if not isinstance(query, str) or not query.strip():
+        raise web.HTTPBadRequest(text="Falta la consulta ('query')")
+    mode = body.get("mode")
+    if mode is not None and mode not in SEARCH_MODES:
+        raise web.HTTPBadRequest(text=f"Modo de búsqueda desconocido: {mode}")
+    try:
+        k = int(body.get("k", 5))
+    except (TypeError, ValueError) as e:
+        raise web.HTTPBadRequest(text="'k' debe ser un entero") from e
+    return {"query": query, "k": k, "source": body.get("source"), "mode": mode}
+
+
+async def _write_line(response: web.StreamResponse, data: Dict[str, Any]) -> None:
+    await response.write((json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8"))
+
+
+async def _watch_generations(app: web.Application) -> AsyncIterator[None]:
+    """Run `_swap_generations` for the lifetime of the application."""
+    interval = float(os.getenv("VECTORSTORE_WATCH_SECONDS", "2"))
+    task = asyncio.create_task(_swap_generations(app, interval)) if interval else None
+    yield
+    if task is not None:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+async def _swap_generations(app: web.Application, interval: float) -> None:
+    """Replace the vectorstore when a newer generation is published on disk."""
+    batcher = app[BATCHER_KEY]
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            # Loading runs outside the search pool so searches are not delayed
+            fresh = await loop.run_in_executor(None, batcher.vectorstore.reopen)
+        except Exception as e:
+            logger.error(f"No se pudo cargar la nueva generación del vectorstore: {e}")
+            continue
+        if fresh is not None:
+            batcher.vectorstore = fresh
+
+
+async def _cleanup(app: web.Application) -> None:
+    app[EXECUTOR_KEY].shutdown(wait=False)
+    await app[LLM_KEY].aclose()
+
+
+def main() -> None:
+    """Serve the vectorstore configured by `VECTORSTORE_NAME` over HTTP.
+
+    With `VECTORSTORE_COLLECTIONS` or `VECTORSTORE_SHARDS` it serves a
+    `ShardedVectorStore` instead, searching all its shards in parallel.
+    """
+    load_dotenv()
+    path = os.getenv("VECTORSTORE_PATH", "derecho_files")
+    name = os.getenv("VECTORSTORE_NAME", "legislacion_MAX_INNER_PRODUCT")
+    # Varias colecciones o shards (VECTORSTORE_COLLECTIONS, VECTORSTORE_SHARDS)
+    vectorstore = ShardedVectorStore.from_env(path, name) or VectorStoreManager(
+        path=path, name=name
+    )
+    if not vectorstore.exist_vectorstore():
+        logger.error(f"No se encontró el vectorstore '{vectorstore.name}'.")
+        return
+    app = create_app(vectorstore, LLMManager())
+    web.run_app(
+        app,
+        host=os.getenv("SERVER_HOST", "127.0.0.1"),
+        port=int(os.getenv("SERVER_PORT", "8080")),
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,137 @@
+import asyncio
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from telemetry.instruments import SEARCH_BATCH_SIZE
+from vectorstore.metadata_index import Filter
+from vectorstore.reranker import Reranker
+from vectorstore.search_result import SearchResult
+from vectorstore.sharded_store import ShardedVectorStore
+from vectorstore.vectorstore_manager import VectorStoreManager
+
+
+@dataclass
+class _PendingQuery:
+    """A query waiting for its micro-batch to be searched."""
+
+    query: str
+    filtro: Filter
+    future: asyncio.Future = field(repr=False)
+
+
+class QueryBatcher:
+    """Micro-batches concurrent searches into `VectorStoreManager.search_batch`.
+
+    Queries that arrive within `max_wait_ms` of each other (up to `max_batch`) with
+    the same `k` and search mode are embedded in a single model call and searched
+    with a single FAISS matrix search. The batch runs in `executor` so the event
+    loop keeps serving requests while FAISS (which releases the GIL) searches.
+
+    With an enabled `reranker`, each batch fetches `reranker.fetch_k(k)`
+    candidates and re-scores all of them with one cross-encoder pass in the same
+    executor call.
+    """
+
+    def __init__(
+        self,
+        vectorstore: VectorStoreManager | ShardedVectorStore,
+        executor: Executor,
+        max_batch: Optional[int] = None,
+        max_wait_ms: Optional[float] = None,
+        reranker: Optional[Reranker] = None,
+    ):
+        """Initialize the batcher over a vectorstore and a thread pool."""
+        self.vectorstore = vectorstore
+        self.executor = executor
+        self.reranker = reranker
+        self.max_batch = max_batch or int(os.getenv("SERVER_MAX_BATCH", "32"))
+        self.max_wait = (
+            max_wait_ms
+            if max_wait_ms is not None
+            else float(os.getenv("SERVER_BATCH_WAIT_MS", "5"))
+        ) / 1000
+        self.batches = 0
+        self.queries = 0
+        self._pending: Dict[Tuple[int, str], List[_PendingQuery]] = defaultdict(list)
+        self._timers: Dict[Tuple[int, str], asyncio.TimerHandle] = {}
+        # References to the running batches so they are not garbage-collected
+        self._tasks: Set[asyncio.Task] = set()
+
+    @property
+    def mean_batch_size(self) -> float:
+        """Average number of queries per searched batch."""
+        return self.queries / self.batches if self.batches else 0.0
+
+    async def search(
+        self,
+        query: str,
+        k: int = 5,
+        filtro: Filter = None,
+        mode: Optional[str] = None,
+    ) -> List[SearchResult]:
+        """Search a query together with the other queries of its micro-batch."""
+        loop = asyncio.get_running_loop()
+        key = (k, (mode or self.vectorstore.search_mode).lower())
+        pending = _PendingQuery(query, filtro, loop.create_future())
+        self._pending[key].append(pending)
+        if len(self._pending[key]) >= self.max_batch:
+            self._flush(key)
+        elif key not in self._timers:
+            self._timers[key] = loop.call_later(self.max_wait, self._flush, key)
+        return await pending.future
+
+    def _flush(self, key: Tuple[int, str]) -> None:
+        """Send the pending queries of a key to the thread pool."""
+        timer = self._timers.pop(key, None)
+        if timer is not None:
+            timer.cancel()
+        batch = self._pending.pop(key, [])
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(key, batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    def _search(
+        self, queries: List[str], k: int, filters: List[Filter], mode: str
+    ) -> List[List[SearchResult]]:
+        """Search a batch and re-rank it, in the executor."""
+        if self.reranker is None:
+            return self.vectorstore.search_batch(queries, k, filters, mode)
+        candidates = self.vectorstore.search_batch(
+            queries, self.reranker.fetch_k(k), filters, mode
+        )
+        return self.reranker.rerank_batch(queries, candidates, k)
+
+    async def _run(self, key: Tuple[int, str], batch: List[_PendingQuery]) -> None:
+        k, mode = key
+        start = time.perf_counter()
+        try:
+            results = await asyncio.get_running_loop().run_in_executor(
+                self.executor,
+                self._search,
+                [pending.query for pending in batch],
+                k,
+                [pending.filtro for pending in batch],
+                mode,
+            )
+        except Exception as e:
+            for pending in batch:
+                if not pending.future.done():
+                    pending.future.set_exception(e)
+            return
+        self.batches += 1
+        self.queries += len(batch)
+        SEARCH_BATCH_SIZE.observe(len(batch))
+        logger.debug(
+            f"Lote de {len(batch)} consultas resuelto en "
+            f"{1000 * (time.perf_counter() - start):.1f} ms"
+        )
+        for pending, found in zip(batch, results, strict=True):
+            if not pending.future.done():
+                pending.future.set_result(found)
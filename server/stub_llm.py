@@ -0,0 +1,148 @@
+import argparse
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+from aiohttp import web
+
+DEFAULT_ANSWER = (
+    "Según el contexto proporcionado, la norma establece lo siguiente. "
+    "Fuente: documento recuperado."
+)
+
+
+@dataclass
+class StubConfig:
+    """Answer and timing of the stub model."""
+
+    tokens: List[str] = field(default_factory=list)
+    token_delay: float = 0.02
+    first_token_delay: float = 0.2
+    requests: int = 0
+
+
+CONFIG_KEY = web.AppKey("config", StubConfig)
+
+
+def create_stub_app(
+    answer: str = DEFAULT_ANSWER,
+    token_delay: float = 0.02,
+    first_token_delay: float = 0.2,
+) -> web.Application:
+    """Build a local OpenAI-compatible endpoint for load tests.
+
+    `POST /v1/chat/completions` answers every request with `answer`, one word per
+    chunk when `stream` is true, after `first_token_delay` seconds and then
+    `token_delay` seconds per token, so throughput can be measured without a real
+    model. Point `LLM_BASE_URL` at `http://host:port/v1`.
+    """
+    words = answer.split(" ")
+    app = web.Application()
+    app[CONFIG_KEY] = StubConfig(
+        tokens=[word if i == 0 else " " + word for i, word in enumerate(words)],
+        token_delay=token_delay,
+        first_token_delay=first_token_delay,
+    )
+    app.router.add_get("/v1/models", models)
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+async def models(request: web.Request) -> web.Response:
+    """List the single stub model."""
+    return web.json_response(
+        {"object": "list", "data": [{"id": "stub", "object": "model"}]}
+    )
+
+
+async def chat_completions(request: web.Request) -> web.StreamResponse:
+    """Answer a chat completion, streamed as server-sent events if requested."""
+    body = await request.json()
+    config = request.app[CONFIG_KEY]
+    config.requests += 1
+    tokens = config.tokens
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+    model = body.get("model") or "stub"
+    await asyncio.sleep(config.first_token_delay)
+
+    if not body.get("stream"):
+        await asyncio.sleep(config.token_delay * (len(tokens) - 1))
+        return web.json_response(
+            {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": "".join(tokens)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": _usage(tokens),
+            }
+        )
+
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for i, token in enumerate(tokens):
+        if i:
+            await asyncio.sleep(config.token_delay)
+        delta = {"content": token} if i else {"role": "assistant", "content": token}
+        await _send(response, _chunk(completion_id, model, delta, None))
+    last = _chunk(completion_id, model, {}, "stop")
+    if body.get("stream_options", {}).get("include_usage"):
+        last["usage"] = _usage(tokens)
+    await _send(response, last)
+    await response.write(b"data: [DONE]\n\n")
+    await response.write_eof()
+    return response
+
+
+def _chunk(
+    completion_id: str, model: str, delta: Dict[str, Any], finish_reason: str | None
+) -> Dict[str, Any]:
+    return {
+        "id": completion_id,
+        "object": "chat.completion.chunk",
+        "created": int(time.time()),
+        "model": model,
+        "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+    }
+
+
+def _usage(tokens: List[str]) -> Dict[str, int]:
+    return {
+        "prompt_tokens": 0,
+        "completion_tokens": len(tokens),
+        "total_tokens": len(tokens),
+    }
+
+
+async def _send(response: web.StreamResponse, data: Dict[str, Any]) -> None:
+    await response.write(f"data: {json.dumps(data, ensure_ascii=False)}\n\n".encode())
+
+
+def main() -> None:
+    """Run the stub endpoint from the command line."""
+    parser = argparse.ArgumentParser(description="Stub OpenAI-compatible LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    args = parser.parse_args()
+    web.run_app(
+        create_stub_app(
+            token_delay=args.token_delay, first_token_delay=args.first_token_delay
+        ),
+        host=args.host,
+        port=args.port,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""Metrics of the ingestion, retrieval and generation stages.
+
+Stage durations are recorded by `telemetry.tracing.span` in `rag_stage_seconds`;
+this module defines the counts that complement them.
+"""
+
+from telemetry.metrics import REGISTRY
+
+SEARCH_QUERIES = REGISTRY.counter(
+    "rag_search_queries", "Queries searched, by search mode.", ("mode",)
+)
+SEARCH_RESULTS = REGISTRY.counter("rag_search_results", "Chunks returned by searches.")
+SEARCH_RESULT_BYTES = REGISTRY.counter(
+    "rag_search_result_bytes", "UTF-8 bytes of the chunks returned by searches."
+)
+SEARCH_BATCH_SIZE = REGISTRY.histogram(
+    "rag_search_batch_size",
+    "Queries per micro-batch searched by the server.",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128),
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "rag_cache_requests", "Cache lookups, by cache and result.", ("cache", "result")
+)
+CACHE_HIT_RATIO = REGISTRY.gauge(
+    "rag_cache_hit_ratio", "Fraction of cache lookups that were hits.", ("cache",)
+)
+INGESTED_CHUNKS = REGISTRY.counter("rag_ingested_chunks", "Chunks added to the index.")
+INGESTED_BYTES = REGISTRY.counter(
+    "rag_ingested_bytes", "UTF-8 bytes of the chunks added to the index."
+)
+LLM_REQUESTS = REGISTRY.counter(
+    "rag_llm_requests", "LLM calls, by operation and status.", ("operation", "status")
+)
+LLM_TOKENS = REGISTRY.counter(
+    "rag_llm_tokens", "LLM tokens, by kind (prompt or completion).", ("kind",)
+)
+LLM_BYTES = REGISTRY.counter(
+    "rag_llm_bytes", "UTF-8 bytes sent to and received from the LLM.", ("kind",)
+)
+CONTEXT_TOKENS = REGISTRY.counter(
+    "rag_context_tokens",
+    "Estimated context tokens, retrieved and after packing.",
+    ("stage",),
+)
+RERANK_PAIRS = REGISTRY.counter(
+    "rag_rerank_pairs",
+    "Query-chunk pairs re-ranked, scored by the model or cached.",
+    ("result",),
+)
+RERANK_SKIPPED = REGISTRY.counter(
+    "rag_rerank_skipped", "Re-ranking batches skipped to stay within the budget."
+)
+LLM_TIME_TO_FIRST_TOKEN = REGISTRY.histogram(
+    "rag_llm_time_to_first_token_seconds", "Time until the first streamed token."
+)
+
+
+def record_cache(cache: str, hits: int, misses: int) -> None:
+    """Count the hits and misses of a batch of lookups in a cache."""
+    if hits:
+        CACHE_REQUESTS.labels(cache, "hit").inc(hits)
+    if misses:
+        CACHE_REQUESTS.labels(cache, "miss").inc(misses)
+    ratio = CACHE_HIT_RATIO.labels(cache)
+    if ratio.function is None:
+        hit = CACHE_REQUESTS.labels(cache, "hit")
+        miss = CACHE_REQUESTS.labels(cache, "miss")
+        ratio.set_function(
+            lambda: (
+                hit.value / (hit.value + miss.value) if hit.value + miss.value else 0.0
+            )
+        )
+
+
+def utf8_len(text: str) -> int:
+    """Size of a text in UTF-8 bytes."""
+    return len(text.encode("utf-8"))
@@ -0,0 +1,347 @@
+import atexit
+import json
+import os
+import threading
+import time
+from bisect import bisect_left
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# Seconds, from sub-millisecond FAISS searches to multi-second LLM answers
+DEFAULT_BUCKETS = (
+    0.0005,
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+Labels = Tuple[str, ...]
+
+
+_enabled: Optional[bool] = None
+
+
+def enabled() -> bool:
+    """Whether instrumentation is on (`TELEMETRY_ENABLED`, on by default).
+
+    The variable is read once, on the first instrumented call, so that values
+    loaded from `.env` by the managers are honoured.
+    """
+    global _enabled
+    if _enabled is None:
+        _enabled = os.getenv("TELEMETRY_ENABLED", "1") == "1"
+    return _enabled
+
+
+class _Metric:
+    """Base class of a metric family with an optional fixed set of label names."""
+
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        """Initialize an empty metric family."""
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Labels, object] = {}
+        self._lock = threading.Lock()
+
+    def labels(self, *values: object):
+        """Child metric for the given label values, created on first use."""
+        # Fast path for string values, the common case in hot loops
+        child = self._children.get(values)
+        if child is None:
+            key = tuple(map(str, values))
+            child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}")
+            with self._lock:
+                child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def children(self) -> List[Tuple[Labels, object]]:
+        """Snapshot of the (label values, child) pairs."""
+        with self._lock:
+            return list(self._children.items())
+
+    def _new_child(self) -> object:
+        raise NotImplementedError
+
+    def _label_text(self, values: Labels, extra: str = "") -> str:
+        pairs = [
+            f'{name}="{_escape(value)}"'
+            for name, value in zip(self.labelnames, values, strict=True)
+        ]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _CounterChild:
+    __slots__ = ("value", "_lock")
+
+    def __init__(self):
+        self.value = 0.0
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1.0) -> None:
+        with self._lock:
+            self.value += amount
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, e.g. queries, tokens or bytes."""
+
+    kind = "counter"
+
+    def _new_child(self) -> _CounterChild:
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        """Increment the unlabelled counter."""
+        self.labels().inc(amount)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        """(suffix, label values, value) of every series."""
+        for values, child in self.children():
+            yield "_total", values, child.value
+
+
+class _GaugeChild:
+    __slots__ = ("value", "function")
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self.function = function
+
+    def get(self) -> float:
+        return self.function() if self.function is not None else self.value
+
+
+class Gauge(_Metric):
+    """Value that can go up and down, or be computed when it is exported."""
+
+    kind = "gauge"
+
+    def _new_child(self) -> _GaugeChild:
+        return _GaugeChild()
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        """(suffix, label values, value) of every series."""
+        for values, child in self.children():
+            yield "", values, child.get()
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "count", "sum", "_lock")
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        # One slot per bucket plus the +Inf bucket
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, value: float) -> None:
+        index = bisect_left(self.bounds, value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+
+    def quantile(self, q: float) -> float:
+        """Upper bound of the bucket that holds the q-quantile."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return 0.0
+        rank, seen = q * total, 0
+        for bound, count in zip(self.bounds, counts, strict=False):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Histogram(_Metric):
+    """Distribution of observations in fixed buckets, e.g. stage latencies."""
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ):
+        """Initialize the histogram with sorted bucket upper bounds."""
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self) -> _HistogramChild:
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        """Record an observation in the unlabelled histogram."""
+        self.labels().observe(value)
+
+    def samples(self) -> Iterator[Tuple[str, Labels, float]]:
+        """(suffix, label values, value) of every series, buckets cumulative."""
+        for values, child in self.children():
+            cumulative = 0
+            for bound, count in zip(
+                self.buckets + (float("inf"),), child.counts, strict=True
+            ):
+                cumulative += count
+                yield f"_bucket:{_format_bound(bound)}", values, cumulative
+            yield "_sum", values, child.sum
+            yield "_count", values, child.count
+
+
+class Registry:
+    """Set of metrics exported together."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        """Add a metric, or return the one already registered with its name."""
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                if type(existing) is not type(metric):
+                    raise ValueError(f"Metric {metric.name} is already a {existing.kind}")
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name: str, documentation: str, labelnames=()) -> Counter:
+        """Register (or get) a counter."""
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames=()) -> Gauge:
+        """Register (or get) a gauge."""
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames=(),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        """Register (or get) a histogram."""
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def metrics(self) -> List[_Metric]:
+        """Return the registered metrics, sorted by name."""
+        with self._lock:
+            return [self._metrics[name] for name in sorted(self._metrics)]
+
+    def to_prometheus(self) -> str:
+        """Metrics in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics():
+            lines.append(f"# HELP {metric.name} {metric.documentation}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for suffix, values, value in metric.samples():
+                extra = ""
+                if suffix.startswith("_bucket:"):
+                    suffix, bound = suffix.split(":", 1)
+                    extra = f'le="{bound}"'
+                labels = metric._label_text(values, extra)
+                lines.append(f"{metric.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    def snapshot(self) -> Dict[str, object]:
+        """Metrics as a JSON-serializable dictionary.
+
+        Histograms report their count, sum, mean and p50/p95/p99 (the upper bound
+        of the bucket holding each quantile) instead of every bucket.
+        """
+        result: Dict[str, object] = {"timestamp": time.time()}
+        for metric in self.metrics():
+            series = []
+            for values, child in metric.children():
+                entry: Dict[str, object] = {
+                    "labels": dict(zip(metric.labelnames, values, strict=True))
+                }
+                if isinstance(child, _HistogramChild):
+                    entry.update(
+                        count=child.count,
+                        sum=child.sum,
+                        mean=child.sum / child.count if child.count else 0.0,
+                        p50=_finite(child.quantile(0.5)),
+                        p95=_finite(child.quantile(0.95)),
+                        p99=_finite(child.quantile(0.99)),
+                    )
+                elif isinstance(child, _GaugeChild):
+                    entry["value"] = child.get()
+                else:
+                    entry["value"] = child.value
+                series.append(entry)
+            result[metric.name] = series
+        return result
+
+    def write_jsonl(self, path: str) -> None:
+        """Append a snapshot of the metrics as one line of a JSON-lines file."""
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        line = json.dumps(self.snapshot(), ensure_ascii=False)
+        with open(path, "a", encoding="utf-8") as file:
+            file.write(line + "\n")
+
+
+REGISTRY = Registry()
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_bound(bound: float) -> str:
+    return "+Inf" if bound == float("inf") else repr(float(bound))
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _finite(value: float) -> Optional[float]:
+    # JSON has no infinity; quantiles past the last bucket are reported as null
+    return None if value == float("inf") else value
+
+
+def _write_on_exit() -> None:
+    path = os.getenv("TELEMETRY_METRICS_FILE")
+    if path and enabled():
+        REGISTRY.write_jsonl(path)
+
+
+atexit.register(_write_on_exit)
@@ -0,0 +1,222 @@
+import atexit
+import contextvars
+import functools
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional, TypeVar
+
+from telemetry.metrics import REGISTRY, enabled
+
+T = TypeVar("T")
+
+STAGE_SECONDS = REGISTRY.histogram(
+    "rag_stage_seconds", "Duration of each pipeline stage.", ("stage",)
+)
+STAGE_ERRORS = REGISTRY.counter(
+    "rag_stage_errors", "Pipeline stages that raised an exception.", ("stage",)
+)
+
+_current: contextvars.ContextVar[Optional["Span"]] = contextvars.ContextVar(
+    "rag_span", default=None
+)
+
+
+class _TraceWriter:
+    """Appends finished spans to a JSON-lines file, buffered and thread-safe."""
+
+    def __init__(self, path: str, sample: float):
+        folder = os.path.dirname(path)
+        if folder:
+            os.makedirs(folder, exist_ok=True)
+        self.sample = sample
+        self._file = open(path, "a", encoding="utf-8", buffering=1 << 16)
+        self._lock = threading.Lock()
+
+    def write(self, record: Dict[str, Any]) -> None:
+        line = json.dumps(record, ensure_ascii=False, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def flush(self) -> None:
+        with self._lock:
+            self._file.flush()
+
+
+_writer: Optional[_TraceWriter] = None
+_writer_lock = threading.Lock()
+_configured = False
+
+
+def _trace_writer() -> Optional[_TraceWriter]:
+    """Span writer of `TELEMETRY_TRACE_FILE`, or None if tracing is off."""
+    global _writer, _configured
+    if not _configured:
+        with _writer_lock:
+            if not _configured:
+                path = os.getenv("TELEMETRY_TRACE_FILE")
+                if path:
+                    sample = float(os.getenv("TELEMETRY_TRACE_SAMPLE", "1.0"))
+                    _writer = _TraceWriter(path, sample)
+                    atexit.register(_writer.flush)
+                _configured = True
+    return _writer
+
+
+def flush_traces() -> None:
+    """Write the buffered spans to the trace file."""
+    if _writer is not None:
+        _writer.flush()
+
+
+class Span:
+    """Timed stage of a request, recorded in `rag_stage_seconds`.
+
+    Spans opened inside another span become its children and share its trace
+    id. If `TELEMETRY_TRACE_FILE` is set, finished spans of sampled traces
+    (`TELEMETRY_TRACE_SAMPLE`) are also written to that file, one JSON per line,
+    with their attributes (token and byte counts, batch sizes...).
+    """
+
+    __slots__ = (
+        "name",
+        "attributes",
+        "start",
+        "duration",
+        "trace_id",
+        "span_id",
+        "parent_id",
+        "sampled",
+        "_token",
+        "_wall",
+    )
+
+    def __init__(self, name: str, attributes: Dict[str, Any]):
+        """Initialize a span that starts timing when entered."""
+        self.name = name
+        self.attributes = attributes
+        self.duration = 0.0
+        self.sampled = False
+        self._token = None
+
+    def set(self, key: str, value: Any) -> None:
+        """Set (or overwrite) an attribute of the span."""
+        self.attributes[key] = value
+
+    def add(self, key: str, amount: float) -> None:
+        """Add to a numeric attribute of the span."""
+        self.attributes[key] = self.attributes.get(key, 0) + amount
+
+    def __enter__(self) -> "Span":
+        """Start timing the span."""
+        writer = _trace_writer()
+        if writer is not None:
+            parent = _current.get()
+            if parent is None:
+                self.trace_id = uuid.uuid4().hex
+                self.parent_id = None
+                self.sampled = random.random() < writer.sample
+            else:
+                self.trace_id = parent.trace_id
+                self.parent_id = parent.span_id
+                self.sampled = parent.sampled
+            self.span_id = uuid.uuid4().hex[:16]
+            self._token = _current.set(self)
+            self._wall = time.time()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        """Stop timing and record the span."""
+        self.duration = time.perf_counter() - self.start
+        STAGE_SECONDS.labels(self.name).observe(self.duration)
+        # A closed generator or a cancelled task is not a failed stage
+        failed = exc_type is not None and issubclass(exc_type, Exception)
+        if failed:
+            STAGE_ERRORS.labels(self.name).inc()
+        if self._token is None:
+            return
+        try:
+            _current.reset(self._token)
+        except ValueError:
+            # Generator spans may be closed from another context
+            pass
+        if self.sampled:
+            record = {
+                "trace_id": self.trace_id,
+                "span_id": self.span_id,
+                "parent_id": self.parent_id,
+                "name": self.name,
+                "start": self._wall,
+                "duration_ms": 1000 * self.duration,
+                **self.attributes,
+            }
+            if failed:
+                record["error"] = exc_type.__name__
+            _writer.write(record)
+
+
+class _NoopSpan:
+    """Span used when telemetry is disabled."""
+
+    __slots__ = ()
+    duration = 0.0
+
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def add(self, key: str, amount: float) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> None:
+        pass
+
+
+_NOOP = _NoopSpan()
+
+
+def span(name: str, **attributes: Any) -> Span:
+    """Context manager that times a stage.
+
+    Example:
+        with span("search.faiss", queries=len(vectors)) as current:
+            ...
+            current.set("results", found)
+
+    """
+    if not enabled():
+        return _NOOP
+    return Span(name, attributes)
+
+
+def traced(name: str, function: Callable[..., T]) -> Callable[..., T]:
+    """Wrap a function so that every call is timed as a `name` span."""
+
+    @functools.wraps(function)
+    def wrapper(*args: Any, **kwargs: Any) -> T:
+        with span(name):
+            return function(*args, **kwargs)
+
+    return wrapper
+
+
+def traced_iter(name: str, iterable: Iterable[T]) -> Iterator[T]:
+    """Iterate timing each wait for the next item as a `name` span.
+
+    Useful for producers, like the parallel document parser, whose work happens
+    while the consumer waits for the next item.
+    """
+    iterator = iter(iterable)
+    while True:
+        with span(name):
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+        yield item
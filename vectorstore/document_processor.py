@@ -1,42 +1,113 @@
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Callable, Iterator, List, Optional
 
 from langchain_community.document_loaders import (
-    DirectoryLoader,
     Docx2txtLoader,
     PyMuPDFLoader,
     TextLoader,
 )
+from langchain_core.documents import Document
+from loguru import logger
+
+LOADERS_CONFIG = {
+    ".pdf": (PyMuPDFLoader, {}),
+    ".txt": (TextLoader, {"encoding": "utf-8"}),
+    ".docx": (Docx2txtLoader, {}),
+    ".doc": (Docx2txtLoader, {}),
+}
+
+
+Split = Callable[[List[Document]], List[Document]]
+
+
+def load_file(file_path: str, split: Optional[Split] = None) -> List[Document]:
+    """Load a single file with the loader that matches its extension.
+
+    If `split` is given, the pages are split into chunks in the same call, so
+    that splitting also runs in the worker processes.
+    """
+    loader_cls, loader_kwargs = LOADERS_CONFIG[os.path.splitext(file_path)[1].lower()]
+    documents = loader_cls(file_path, **loader_kwargs).load()
+    return split(documents) if split is not None and documents else documents
 
 
 class DocumentProcessor:
     """Document Processor class to process files in a directory."""
 
-    def __init__(self, path: str):
+    def __init__(self, path: str, max_workers: Optional[int] = None):
         """Document Processor class to process files in a directory."""
         self.path = path
+        self.max_workers = max_workers or int(
+            os.getenv("INGEST_WORKERS", str(os.cpu_count() or 1))
+        )
+        self.failed_files: List[str] = []
+
+    def list_files(self) -> List[str]:
+        """List the supported files in the directory."""
+        return sorted(
+            os.path.join(self.path, fname)
+            for fname in os.listdir(self.path)
+            if os.path.splitext(fname)[1].lower() in LOADERS_CONFIG
+        )
+
+    def iter_documents(
+        self, files: Optional[List[str]] = None, split: Optional[Split] = None
+    ) -> Iterator[List[Document]]:
+        """Parse files in a process pool and yield the pages of each file in order.
+
+        At most two files per worker are in flight, so a slow consumer keeps the
+        pool from parsing the whole directory into memory ahead of time. With
+        `split` (a picklable callable), each file is yielded already split into
+        chunks by the worker that parsed it.
+        """
+        files = self.list_files() if files is None else files
+        if not files:
+            return
+        if self.max_workers <= 1 or len(files) == 1:
+            for file_path in files:
+                documents = self._load_safely(file_path, split)
+                if documents:
+                    yield documents
+            return
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor:
+            pending = deque()
+            remaining = iter(files)
+            for file_path in remaining:
+                pending.append((file_path, executor.submit(load_file, file_path, split)))
+                if len(pending) >= 2 * self.max_workers:
+                    break
+            while pending:
+                file_path, future = pending.popleft()
+                next_file = next(remaining, None)
+                if next_file is not None:
+                    pending.append(
+                        (next_file, executor.submit(load_file, next_file, split))
+                    )
+                try:
+                    documents = future.result()
+                except Exception as e:
+                    self._record_failure(file_path, e)
+                    continue
+                if documents:
+                    yield documents
 
     def files_to_texts(self) -> list:
         """Convert files in a directory to text."""
-        loaders_config = {
-            "*.pdf": PyMuPDFLoader,
-            "*.txt": (TextLoader, {"encoding": "utf-8"}),
-            "*.docx": Docx2txtLoader,
-            "*.doc": Docx2txtLoader,
-        }
-
-        loaders = [
-            DirectoryLoader(
-                path=self.path,
-                glob=glob,
-                loader_cls=loader if isinstance(loader, type) else loader[0],
-                loader_kwargs=loader[1] if isinstance(loader, tuple) else None,
-            )
-            for glob, loader in loaders_config.items()
-            if any(fname.endswith(glob[1:]) for fname in os.listdir(self.path))
-        ]
-
-        documents = []
-        for loader in loaders:
-            documents.extend(loader.load())
-
-        return documents
+        return list(chain.from_iterable(self.iter_documents()))
+
+    def _load_safely(
+        self, file_path: str, split: Optional[Split] = None
+    ) -> List[Document]:
+        try:
+            return load_file(file_path, split)
+        except Exception as e:
+            self._record_failure(file_path, e)
+            return []
+
+    def _record_failure(self, file_path: str, error: Exception) -> None:
+        logger.error(f"No se pudo procesar '{file_path}': {error}")
+        self.failed_files.append(file_path)
@@ -0,0 +1,206 @@
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from telemetry.instruments import record_cache
+from vectorstore.vector_rows import VectorRows
+
+
+@dataclass
+class CacheStats:
+    """Estadísticas de uso de la caché de embeddings."""
+
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Proporción de textos servidos desde la caché."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class CachedEmbeddings(Embeddings):
+    """Caché persistente de embeddings de documentos indexada por hash de contenido.
+
+    Envuelve cualquier `Embeddings` (HuggingFace u Ollama) y guarda en disco, en
+    `cache_dir/<namespace>/`:
+
+    - `vectors-*.f32`: matriz float32 en bloques mapeados en memoria, con un
+      embedding por fila (`VectorRows`).
+    - `index.sqlite`: índice hash SHA-256 del texto → fila, con la fecha del último
+      uso para desalojar por LRU cuando se supera `max_entries`.
+
+    El espacio de nombres debe identificar el modelo y su normalización, de modo que
+    nunca se mezclen vectores de configuraciones distintas. Solo se cachean los
+    embeddings de documentos: los de consultas pueden usar otra instrucción.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        namespace: str,
+        cache_dir: Optional[str] = None,
+        max_entries: Optional[int] = None,
+    ):
+        """Inicializa la caché sobre el modelo de embeddings indicado.
+
+        Parámetros:
+            embeddings (Embeddings): Modelo de embeddings a envolver.
+            namespace (str): Identificador del modelo y sus ajustes.
+            cache_dir (Optional[str]): Carpeta base (`EMBEDDINGS_CACHE_DIR`).
+            max_entries (Optional[int]): Máximo de vectores guardados
+                (`EMBEDDINGS_CACHE_MAX_ENTRIES`).
+        """
+        self.embeddings = embeddings
+        self.namespace = namespace
+        cache_dir = cache_dir or os.getenv("EMBEDDINGS_CACHE_DIR", "cache/embeddings")
+        self.max_entries = max_entries or int(
+            os.getenv("EMBEDDINGS_CACHE_MAX_ENTRIES", "1000000")
+        )
+        self.folder_path = os.path.join(cache_dir, _safe_name(namespace))
+        os.makedirs(self.folder_path, exist_ok=True)
+        self.stats = CacheStats()
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            os.path.join(self.folder_path, "index.sqlite"), check_same_thread=False
+        )
+        self._connection.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS entries (
+                hash TEXT PRIMARY KEY, row INTEGER NOT NULL, last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS entries_last_used ON entries (last_used);
+            """
+        )
+        self._rows = VectorRows(self.folder_path, lambda: self._connection)
+        self.stats.entries = self._count()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Devuelve los embeddings de los textos, calculando solo los que faltan."""
+        hashes = [_text_hash(text) for text in texts]
+        cached = self._lookup(hashes)
+        missing = _unique_missing(texts, hashes, cached)
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            cached.update(self._store(list(missing), vectors))
+        return [cached[key] for key in hashes]
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Versión asíncrona de `embed_documents`."""
+        hashes = [_text_hash(text) for text in texts]
+        cached = self._lookup(hashes)
+        missing = _unique_missing(texts, hashes, cached)
+        if missing:
+            vectors = await self.embeddings.aembed_documents(list(missing.values()))
+            cached.update(self._store(list(missing), vectors))
+        return [cached[key] for key in hashes]
+
+    def embed_query(self, text: str) -> List[float]:
+        """Delega en el modelo: los embeddings de consultas no se cachean aquí."""
+        return self.embeddings.embed_query(text)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Versión asíncrona de `embed_query`."""
+        return await self.embeddings.aembed_query(text)
+
+    def clear(self) -> None:
+        """Vacía la caché."""
+        with self._lock:
+            self._connection.execute("DELETE FROM entries")
+            self._rows.clear()
+            self._connection.commit()
+            self.stats.entries = 0
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        unique = list(dict.fromkeys(hashes))
+        with self._lock:
+            rows = {}
+            for start in range(0, len(unique), 500):
+                part = unique[start : start + 500]
+                query = "SELECT hash, row FROM entries WHERE hash IN ({})".format(
+                    ",".join("?" * len(part))
+                )
+                rows.update(self._connection.execute(query, part).fetchall())
+            if rows:
+                now = time.time()
+                self._connection.executemany(
+                    "UPDATE entries SET last_used = ? WHERE hash = ?",
+                    [(now, key) for key in rows],
+                )
+                self._connection.commit()
+            hits = sum(1 for key in hashes if key in rows)
+            self.stats.hits += hits
+            self.stats.misses += len(hashes) - hits
+            record_cache("embeddings", hits, len(hashes) - hits)
+            if not rows:
+                return {}
+            vectors = self._rows.read(list(rows.values()))
+            return {
+                key: vector.tolist() for key, vector in zip(rows, vectors, strict=True)
+            }
+
+    def _store(
+        self, hashes: List[str], vectors: List[List[float]]
+    ) -> Dict[str, List[float]]:
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            self._evict(len(hashes))
+            rows = self._rows.write(matrix)
+            now = time.time()
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO entries (hash, row, last_used) VALUES (?, ?, ?)",
+                [(key, row, now) for key, row in zip(hashes, rows, strict=True)],
+            )
+            self._connection.commit()
+            self.stats.entries = self._count()
+        # Devolver los valores en float32, igual que en un acierto de caché
+        return dict(zip(hashes, matrix.tolist(), strict=True))
+
+    def _evict(self, incoming: int) -> None:
+        """Desaloja las entradas usadas hace más tiempo si no caben las nuevas."""
+        overflow = self._count() + incoming - self.max_entries
+        if overflow <= 0:
+            return
+        # Desalojar al menos un 10 % para no hacerlo en cada lote
+        overflow = max(overflow, self.max_entries // 10)
+        victims = self._connection.execute(
+            "SELECT hash, row FROM entries ORDER BY last_used LIMIT ?", (overflow,)
+        ).fetchall()
+        self._connection.executemany(
+            "DELETE FROM entries WHERE hash = ?", [(key,) for key, _ in victims]
+        )
+        self._rows.free(row for _, row in victims)
+        self.stats.evictions += len(victims)
+
+    def _count(self) -> int:
+        return self._connection.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _unique_missing(
+    texts: List[str], hashes: List[str], cached: Dict[str, List[float]]
+) -> Dict[str, str]:
+    """Textos sin embedding en caché, sin repetir los que aparecen varias veces."""
+    return {
+        key: text for key, text in zip(hashes, texts, strict=True) if key not in cached
+    }
+
+
+def _safe_name(namespace: str) -> str:
+    slug = re.sub(r"[^A-Za-z0-9._-]+", "_", namespace).strip("_")[:60]
+    digest = hashlib.sha256(namespace.encode("utf-8")).hexdigest()[:8]
+    return f"{slug}-{digest}"
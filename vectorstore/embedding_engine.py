@@ -0,0 +1,215 @@
+import atexit
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+EMBEDDING_BACKENDS = ("torch", "onnx", "openvino")
+
+
+@dataclass
+class EmbeddingStats:
+    """Rendimiento acumulado del motor de embeddings."""
+
+    chunks: int = 0
+    seconds: float = 0.0
+    characters: int = 0
+    padded_characters: int = 0
+
+    @property
+    def chunks_per_second(self) -> float:
+        """Chunks vectorizados por segundo."""
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    @property
+    def padding_ratio(self) -> float:
+        """Fracción estimada de cada lote ocupada por relleno (en caracteres)."""
+        if not self.padded_characters:
+            return 0.0
+        return 1 - self.characters / self.padded_characters
+
+
+class EmbeddingEngine(Embeddings):
+    """Motor de embeddings de SentenceTransformers optimizado para CPU.
+
+    - Ordena los textos por longitud y los codifica en lotes de `batch_size`, de
+      modo que cada lote agrupa chunks de tamaño parecido y apenas se rellena.
+    - Con `processes > 1` reparte los lotes entre varios procesos (un modelo por
+      proceso) mediante el pool de SentenceTransformers.
+    - Con `backend="onnx"` (u `openvino`) usa ONNX Runtime; `onnx_file` permite
+      elegir un modelo cuantizado en int8 (p. ej. `onnx/model_qint8_avx2.onnx`).
+    - Registra en `stats` los chunks por segundo y el relleno estimado.
+
+    Los embeddings se devuelven normalizados, igual que con
+    `HuggingFaceEmbeddings(encode_kwargs={"normalize_embeddings": True})`.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        batch_size: Optional[int] = None,
+        processes: Optional[int] = None,
+        backend: Optional[str] = None,
+        onnx_file: Optional[str] = None,
+        threads: Optional[int] = None,
+        device: Optional[str] = None,
+    ):
+        """Carga el modelo con la configuración indicada.
+
+        Parámetros:
+            model_name (str): Modelo de SentenceTransformers.
+            batch_size (Optional[int]): Textos por lote (`EMBEDDINGS_BATCH_SIZE`).
+            processes (Optional[int]): Procesos de codificación
+                (`EMBEDDINGS_PROCESSES`); 1 codifica en el proceso actual.
+            backend (Optional[str]): `torch`, `onnx` u `openvino`
+                (`EMBEDDINGS_BACKEND`).
+            onnx_file (Optional[str]): Archivo ONNX del repositorio del modelo
+                (`EMBEDDINGS_ONNX_FILE`), p. ej. una variante cuantizada en int8.
+            threads (Optional[int]): Hilos de torch por proceso
+                (`EMBEDDINGS_THREADS`).
+            device (Optional[str]): Dispositivo; por defecto CUDA si está
+                disponible y si no, CPU.
+        """
+        # torch y SentenceTransformers tardan segundos en importarse
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.batch_size = batch_size or int(os.getenv("EMBEDDINGS_BATCH_SIZE", "64"))
+        self.processes = processes or int(os.getenv("EMBEDDINGS_PROCESSES", "1"))
+        self.backend = (backend or os.getenv("EMBEDDINGS_BACKEND", "torch")).lower()
+        if self.backend not in EMBEDDING_BACKENDS:
+            raise ValueError(
+                f"EMBEDDINGS_BACKEND debe ser uno de {EMBEDDING_BACKENDS}: {self.backend}"
+            )
+        self.onnx_file = onnx_file or os.getenv("EMBEDDINGS_ONNX_FILE") or None
+        self.device = device or ("cuda" if torch.cuda.is_available() else "cpu")
+        threads = threads or int(os.getenv("EMBEDDINGS_THREADS", "0"))
+        if threads:
+            torch.set_num_threads(threads)
+
+        kwargs: Dict[str, Any] = {"device": self.device}
+        if self.backend != "torch":
+            kwargs["backend"] = self.backend
+            if self.onnx_file:
+                kwargs["model_kwargs"] = {"file_name": self.onnx_file}
+        self.model = SentenceTransformer(model_name, **kwargs)
+        self.stats = EmbeddingStats()
+        self._pool: Optional[Dict[str, Any]] = None
+        self._lock = threading.Lock()
+
+    @property
+    def namespace(self) -> str:
+        """Identificador del modelo y del backend para la caché de embeddings."""
+        return engine_namespace(self.model_name, self.backend, self.onnx_file)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Genera los embeddings de una lista de textos."""
+        return self.encode(texts).tolist()
+
+    def embed_query(self, text: str) -> List[float]:
+        """Genera el embedding de una consulta."""
+        return self.encode([text])[0].tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Genera los embeddings de varias consultas en una sola codificación."""
+        return self.encode(texts).tolist()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Codifica los textos en lotes agrupados por longitud.
+
+        Retorna:
+            np.ndarray: Embeddings float32 normalizados, en el orden de `texts`.
+        """
+        if not texts:
+            return np.empty(
+                (0, self.model.get_sentence_embedding_dimension()), np.float32
+            )
+        start = time.perf_counter()
+        lengths = np.fromiter((len(text) for text in texts), np.int64, len(texts))
+        # De mayor a menor, para que un posible error de memoria aparezca al principio
+        order = np.argsort(-lengths, kind="stable")
+        ordered = [texts[i] for i in order]
+
+        if self.processes > 1 and len(texts) > self.batch_size:
+            vectors = self.model.encode_multi_process(
+                ordered,
+                self._get_pool(),
+                batch_size=self.batch_size,
+                # Cada proceso recibe bloques de lotes de longitud parecida
+                chunk_size=self.batch_size * 4,
+                normalize_embeddings=True,
+            )
+        else:
+            vectors = self.model.encode(
+                ordered,
+                batch_size=self.batch_size,
+                normalize_embeddings=True,
+                convert_to_numpy=True,
+                show_progress_bar=False,
+            )
+
+        result = np.empty_like(vectors, dtype=np.float32)
+        result[order] = vectors
+        self._record(lengths[order], time.perf_counter() - start)
+        return result
+
+    def close(self) -> None:
+        """Detiene el pool de procesos de codificación, si se ha iniciado."""
+        with self._lock:
+            if self._pool is not None:
+                self.model.stop_multi_process_pool(self._pool)
+                self._pool = None
+
+    def _get_pool(self) -> Dict[str, Any]:
+        with self._lock:
+            if self._pool is None:
+                logger.info(
+                    f"Iniciando {self.processes} procesos de embeddings "
+                    f"({self.model_name}, {self.backend})"
+                )
+                self._pool = self.model.start_multi_process_pool(
+                    [self.device] * self.processes
+                )
+                atexit.register(self.close)
+            return self._pool
+
+    def _record(self, sorted_lengths: np.ndarray, seconds: float) -> None:
+        # Cada lote se rellena hasta la longitud de su texto más largo (el primero)
+        padded = sum(
+            int(sorted_lengths[i]) * len(sorted_lengths[i : i + self.batch_size])
+            for i in range(0, len(sorted_lengths), self.batch_size)
+        )
+        with self._lock:
+            self.stats.chunks += len(sorted_lengths)
+            self.stats.seconds += seconds
+            self.stats.characters += int(sorted_lengths.sum())
+            self.stats.padded_characters += padded
+
+
+def engine_namespace(
+    model_name: str, backend: Optional[str] = None, onnx_file: Optional[str] = None
+) -> str:
+    """Identificador del modelo y del backend, sin cargar el modelo.
+
+    Parámetros:
+        model_name (str): Modelo de SentenceTransformers.
+        backend (Optional[str]): Backend (`EMBEDDINGS_BACKEND`).
+        onnx_file (Optional[str]): Archivo ONNX (`EMBEDDINGS_ONNX_FILE`).
+
+    Retorna:
+        str: Espacio de nombres para la caché de embeddings.
+    """
+    backend = (backend or os.getenv("EMBEDDINGS_BACKEND", "torch")).lower()
+    onnx_file = onnx_file or os.getenv("EMBEDDINGS_ONNX_FILE") or None
+    namespace = f"huggingface-{model_name}-normalized"
+    if backend != "torch":
+        namespace += f"-{backend}"
+        if onnx_file:
+            namespace += "-" + os.path.splitext(os.path.basename(onnx_file))[0]
+    return namespace
@@ -1,16 +1,70 @@
 import os
+import threading
 import warnings
+from typing import Any, Callable, List, Optional
 
-import torch
 from dotenv import load_dotenv
-from langchain_community.embeddings import OllamaEmbeddings
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from vectorstore.embedding_cache import CachedEmbeddings
+from vectorstore.embedding_engine import EmbeddingEngine, engine_namespace
 
-load_dotenv()
 warnings.filterwarnings("ignore")
 
-MODEL_EMBEDDINGS = os.getenv("MODEL_EMBEDDINGS")
-FLAG_EMBEDDINGS = int(os.getenv("FLAG_EMBEDDINGS"))
+
+class LazyEmbeddings(Embeddings):
+    """Embeddings whose model is only built on the first embedding call.
+
+    Loading a model (and importing torch or the Ollama client) can take seconds, so
+    commands that never embed anything, like listing or exporting sources, never
+    pay for it. Other attributes are forwarded to the loaded model.
+    """
+
+    def __init__(self, factory: Callable[[], Embeddings], namespace: str = ""):
+        """Initialize the proxy with the function that builds the model.
+
+        `namespace` identifies the model without loading it (see
+        `embedding_model_id`).
+        """
+        self._factory = factory
+        self.namespace = namespace
+        self._embeddings: Optional[Embeddings] = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the model has already been built."""
+        return self._embeddings is not None
+
+    def load(self) -> Embeddings:
+        """Build the model if needed and return it."""
+        if self._embeddings is None:
+            with self._lock:
+                if self._embeddings is None:
+                    self._embeddings = self._factory()
+        return self._embeddings
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents with the loaded model."""
+        return self.load().embed_documents(texts)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query with the loaded model."""
+        return self.load().embed_query(text)
+
+    async def aembed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Async version of `embed_documents`."""
+        return await self.load().aembed_documents(texts)
+
+    async def aembed_query(self, text: str) -> List[float]:
+        """Async version of `embed_query`."""
+        return await self.load().aembed_query(text)
+
+    def __getattr__(self, name: str) -> Any:
+        """Forward any other attribute (e.g. `stats`) to the loaded model."""
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return getattr(self.load(), name)
 
 
 class EmbeddingManager:
@@ -26,18 +80,26 @@ class EmbeddingManager:
         return cls._instance
 
     def __init__(self):
-        """Initialize the EmbeddingManager class."""
+        """Initialize the EmbeddingManager class.
+
+        The model itself is loaded lazily, on the first text to embed.
+        """
         if self.__initialized:
             return
         self.__initialized = True
-        if FLAG_EMBEDDINGS == 1:
-            self.__embeddings = OllamaEmbeddings(model=MODEL_EMBEDDINGS)
-        else:
-            self.__embeddings = HuggingFaceEmbeddings(
-                model_name=MODEL_EMBEDDINGS,
-                encode_kwargs={"normalize_embeddings": True},
-                model_kwargs={"device": "cuda" if torch.cuda.is_available() else "cpu"},
+        load_dotenv()
+        model = os.getenv("MODEL_EMBEDDINGS")
+        if int(os.getenv("FLAG_EMBEDDINGS")) == 1:
+            namespace = f"ollama-{model}-raw"
+            self.__embeddings = LazyEmbeddings(
+                lambda: _ollama_embeddings(model), namespace
             )
+        else:
+            # Batched, length-bucketed encoding with optional ONNX/multi-process
+            namespace = engine_namespace(model)
+            self.__embeddings = LazyEmbeddings(lambda: EmbeddingEngine(model), namespace)
+        if os.getenv("EMBEDDINGS_CACHE", "1") == "1":
+            self.__embeddings = CachedEmbeddings(self.__embeddings, namespace=namespace)
 
     @classmethod
     def get_embeddings(cls):
@@ -45,3 +107,78 @@ class EmbeddingManager:
         if cls._instance is None:
             cls._instance = cls()
         return cls._instance.__embeddings
+
+
+def embedding_model_id(embeddings: Embeddings) -> str:
+    """Identify the model (and normalization) behind some embeddings.
+
+    Vectors are only comparable between stores with the same identifier. The
+    model is not loaded: the cache and lazy wrappers know their namespace, and
+    any other `Embeddings` is identified by its class.
+    """
+    namespace = embeddings.__dict__.get("namespace")
+    if namespace:
+        return namespace
+    return f"{type(embeddings).__module__}.{type(embeddings).__qualname__}"
+
+
+def embed_queries(embeddings: Embeddings, queries: List[str]) -> List[List[float]]:
+    """Embed several queries with the model's query path, batched when possible.
+
+    Models that embed queries differently from documents (an instruction prefix,
+    other encode options) keep doing so in the batch. A model without a known
+    batched query path is called once per query with `embed_query`.
+    """
+    from langchain_community.embeddings import (
+        HuggingFaceBgeEmbeddings,
+        HuggingFaceEmbeddings,
+        HuggingFaceInstructEmbeddings,
+        OllamaEmbeddings,
+    )
+
+    if isinstance(embeddings, CachedEmbeddings):
+        # The cache only stores document embeddings
+        embeddings = embeddings.embeddings
+    if isinstance(embeddings, LazyEmbeddings):
+        embeddings = embeddings.load()
+    if isinstance(embeddings, EmbeddingEngine):
+        return embeddings.embed_queries(queries)
+    if isinstance(embeddings, OllamaEmbeddings):
+        return embeddings._embed(
+            [f"{embeddings.query_instruction}{query}" for query in queries]
+        )
+    if isinstance(embeddings, HuggingFaceBgeEmbeddings):
+        encode_kwargs = (
+            getattr(embeddings, "query_encode_kwargs", None) or embeddings.encode_kwargs
+        )
+        return embeddings.client.encode(
+            [
+                embeddings.query_instruction + query.replace("\n", " ")
+                for query in queries
+            ],
+            show_progress_bar=embeddings.show_progress,
+            **encode_kwargs,
+        ).tolist()
+    if isinstance(embeddings, HuggingFaceInstructEmbeddings):
+        return embeddings.client.encode(
+            [[embeddings.query_instruction, query] for query in queries],
+            show_progress_bar=embeddings.show_progress,
+            **embeddings.encode_kwargs,
+        ).tolist()
+    if isinstance(embeddings, HuggingFaceEmbeddings):
+        # Queries and documents are encoded alike
+        return embeddings.embed_documents(queries)
+    if getattr(embeddings, "query_encode_kwargs", None) is not None and hasattr(
+        embeddings, "_embed"
+    ):
+        # langchain_huggingface.HuggingFaceEmbeddings
+        return embeddings._embed(
+            queries, embeddings.query_encode_kwargs or embeddings.encode_kwargs
+        )
+    return [embeddings.embed_query(query) for query in queries]
+
+
+def _ollama_embeddings(model: str) -> Embeddings:
+    from langchain_community.embeddings import OllamaEmbeddings
+
+    return OllamaEmbeddings(model=model)
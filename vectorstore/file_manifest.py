@@ -0,0 +1,157 @@
+import hashlib
+import json
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+@dataclass
+class FileRecord:
+    """Estado de un archivo indexado en el vectorstore."""
+
+    path: str
+    sha256: str
+    size: int
+    mtime: float
+    chunk_ids: List[str] = field(default_factory=list)
+
+
+@dataclass
+class ManifestDiff:
+    """Cambios detectados entre una carpeta y el manifiesto de archivos.
+
+    `renamed` y `duplicates` relacionan cada archivo nuevo con el archivo indexado
+    de idéntico contenido: en el primer caso el original ha desaparecido y en el
+    segundo sigue existiendo. Las copias se indexan con su propia fuente, de modo
+    que también son cambios.
+    """
+
+    added: List[str] = field(default_factory=list)
+    changed: List[str] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    renamed: Dict[str, str] = field(default_factory=dict)
+    duplicates: Dict[str, str] = field(default_factory=dict)
+    unchanged: List[str] = field(default_factory=list)
+    fingerprints: Dict[str, Tuple[str, int, float]] = field(default_factory=dict)
+
+    @property
+    def has_changes(self) -> bool:
+        """Indica si hay archivos que añadir, copiar, reindexar, eliminar o renombrar."""
+        return bool(
+            self.added or self.changed or self.deleted or self.renamed or self.duplicates
+        )
+
+
+class FileManifest:
+    """Manifiesto persistente de los archivos indexados (`files.json`).
+
+    Guarda por cada archivo su hash de contenido, tamaño, fecha de modificación y
+    los ids de sus chunks, de modo que al arrancar se detectan en una sola pasada
+    los archivos nuevos, modificados, eliminados o renombrados. Solo se calcula el
+    hash de los archivos cuyo tamaño o fecha de modificación han cambiado.
+    """
+
+    def __init__(self, manifest_path: str):
+        """Inicializa el manifiesto y lo carga si existe."""
+        self.manifest_path = manifest_path
+        self.records: Dict[str, FileRecord] = {}
+        if os.path.exists(manifest_path):
+            with open(manifest_path, encoding="utf-8") as file:
+                self.records = {
+                    path: FileRecord(**record) for path, record in json.load(file).items()
+                }
+
+    def exists(self) -> bool:
+        """Indica si el manifiesto está guardado en disco."""
+        return os.path.exists(self.manifest_path)
+
+    def save(self) -> None:
+        """Guarda el manifiesto de forma atómica."""
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(
+                {path: asdict(record) for path, record in self.records.items()}, file
+            )
+        os.replace(temp_path, self.manifest_path)
+
+    def diff(self, files: List[str], root: Optional[str] = None) -> ManifestDiff:
+        """Compara los archivos indicados con el manifiesto.
+
+        Parámetros:
+            files (List[str]): Rutas de los archivos presentes.
+            root (Optional[str]): Carpeta de la que proceden los archivos. Si se
+                indica, los archivos registrados bajo ella que ya no están en
+                `files` se consideran eliminados.
+
+        Retorna:
+            ManifestDiff: Los cambios detectados.
+        """
+        diff = ManifestDiff()
+        new_files = []
+        for path in files:
+            stat = os.stat(path)
+            record = self.records.get(path)
+            if record and record.size == stat.st_size and record.mtime == stat.st_mtime:
+                diff.unchanged.append(path)
+                continue
+            sha256 = file_sha256(path)
+            diff.fingerprints[path] = (sha256, stat.st_size, stat.st_mtime)
+            if record is None:
+                new_files.append(path)
+            elif record.sha256 == sha256:
+                # Solo ha cambiado la fecha de modificación
+                diff.unchanged.append(path)
+            else:
+                diff.changed.append(path)
+
+        present = set(files)
+        if root is not None:
+            root = os.path.normpath(root)
+            diff.deleted = [
+                path
+                for path in self.records
+                if path not in present and os.path.dirname(os.path.normpath(path)) == root
+            ]
+
+        by_hash = {record.sha256: path for path, record in self.records.items()}
+        deleted = set(diff.deleted)
+        for path in new_files:
+            original = by_hash.get(diff.fingerprints[path][0])
+            if original is None:
+                diff.added.append(path)
+            elif original in deleted:
+                diff.renamed[path] = original
+                deleted.discard(original)
+            else:
+                diff.duplicates[path] = original
+        diff.deleted = [path for path in diff.deleted if path in deleted]
+        return diff
+
+    def record(
+        self, path: str, fingerprint: Tuple[str, int, float], chunk_ids: List[str]
+    ) -> None:
+        """Registra (o reemplaza) un archivo indexado."""
+        sha256, size, mtime = fingerprint
+        self.records[path] = FileRecord(path, sha256, size, mtime, list(chunk_ids))
+
+    def remove(self, path: str) -> Optional[FileRecord]:
+        """Elimina un archivo del manifiesto y devuelve su registro."""
+        return self.records.pop(path, None)
+
+
+def file_sha256(path: str) -> str:
+    """Calcula el hash SHA-256 del contenido de un archivo."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        while block := file.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_fingerprint(path: str) -> Tuple[str, int, float]:
+    """Devuelve el hash, el tamaño y la fecha de modificación de un archivo."""
+    stat = os.stat(path)
+    return file_sha256(path), stat.st_size, stat.st_mtime
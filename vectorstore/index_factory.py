@@ -0,0 +1,445 @@
+import math
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Dict, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores.faiss import DistanceStrategy
+from loguru import logger
+
+INDEX_TYPES = ("FLAT", "IVF_FLAT", "IVF_PQ", "HNSW", "SQ_FP16", "SQ8", "PQ")
+# Índices que almacenan los vectores comprimidos y admiten re-puntuación exacta
+QUANTIZED_TYPES = ("IVF_PQ", "SQ_FP16", "SQ8", "PQ")
+
+# Mínimo de vectores de entrenamiento por centroide recomendado por FAISS
+MIN_POINTS_PER_CENTROID = 39
+# Índices cuya calidad depende del tamaño del corpus con que se entrenan
+TRAINED_TYPES = ("IVF_FLAT", "IVF_PQ", "PQ")
+
+
+@dataclass
+class IndexReport:
+    """Resultado de evaluar un tipo de índice frente al índice exacto."""
+
+    index_type: str
+    params: Dict[str, int] = field(default_factory=dict)
+    recall_at_k: float = 0.0
+    latency_ms: float = 0.0
+    queries_per_second: float = 0.0
+    build_seconds: float = 0.0
+    memory_bytes: int = 0
+
+
+class IndexFactory:
+    """Fábrica de índices FAISS configurables para el vectorstore.
+
+    Construye el índice indicado por la variable de entorno `INDEX_TYPE`
+    (`FLAT`, `IVF_FLAT`, `IVF_PQ`, `HNSW`, `SQ_FP16`, `SQ8` o `PQ`) usando la
+    métrica de FAISS que corresponde a la estrategia de distancia resuelta por
+    `DistanceStrategyManager`:
+
+    - `EUCLIDEAN_DISTANCE` y `JACCARD` usan `METRIC_L2`.
+    - `MAX_INNER_PRODUCT`, `DOT_PRODUCT` y `COSINE` usan `METRIC_INNER_PRODUCT`
+      (para `COSINE` se asume que los embeddings ya están normalizados).
+
+    Los índices IVF se entrenan con una muestra del corpus y admiten el ajuste en
+    caliente de `nprobe`; los índices HNSW admiten el ajuste de `efSearch`.
+    Los índices cuantizados (`SQ_FP16` y `SQ8` con 2 y 1 byte por dimensión, `PQ`
+    e `IVF_PQ` con `pq_m` códigos por vector) reducen la memoria y pueden
+    re-puntuar sus `rerank_k` mejores candidatos con los vectores completos.
+    """
+
+    def __init__(
+        self,
+        strategy: DistanceStrategy,
+        index_type: Optional[str] = None,
+        nlist: Optional[int] = None,
+        pq_m: Optional[int] = None,
+        pq_bits: Optional[int] = None,
+        hnsw_m: Optional[int] = None,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+        train_sample: Optional[int] = None,
+        rerank_k: Optional[int] = None,
+    ):
+        """Inicializa la fábrica leyendo los valores no indicados del entorno."""
+        self.strategy = strategy
+        self.index_type = (index_type or os.getenv("INDEX_TYPE", "FLAT")).upper()
+        if self.index_type not in INDEX_TYPES:
+            raise ValueError(f"Tipo de índice desconocido: {self.index_type}")
+        self.nlist = nlist or _env_int("INDEX_NLIST")
+        self.pq_m = pq_m or _env_int("INDEX_PQ_M")
+        self.pq_bits = pq_bits or _env_int("INDEX_PQ_BITS", 8)
+        self.hnsw_m = hnsw_m or _env_int("INDEX_HNSW_M", 32)
+        self.nprobe = nprobe or _env_int("INDEX_NPROBE", 16)
+        self.ef_search = ef_search or _env_int("INDEX_EF_SEARCH", 64)
+        self.train_sample = train_sample or _env_int("INDEX_TRAIN_SAMPLE", 50_000)
+        self.rerank_k = (
+            rerank_k if rerank_k is not None else _env_int("INDEX_RERANK_K", 0)
+        )
+
+    @property
+    def is_quantized(self) -> bool:
+        """Indica si el índice configurado almacena los vectores comprimidos."""
+        return self.index_type in QUANTIZED_TYPES
+
+    @property
+    def metric(self) -> int:
+        """Métrica de FAISS que corresponde a la estrategia de distancia."""
+        if self.strategy in (
+            DistanceStrategy.MAX_INNER_PRODUCT,
+            DistanceStrategy.DOT_PRODUCT,
+            DistanceStrategy.COSINE,
+        ):
+            return faiss.METRIC_INNER_PRODUCT
+        return faiss.METRIC_L2
+
+    def relevance_score_fn(self) -> Optional[Callable[[float], float]]:
+        """Función de relevancia para LangChain cuando la métrica no es la esperada.
+
+        LangChain interpreta la puntuación de `COSINE` como una distancia; con un
+        índice de producto interno la puntuación ya es la similitud coseno.
+        """
+        if self.strategy == DistanceStrategy.COSINE:
+            return lambda similarity: similarity
+        return None
+
+    def build(self, dimension: int, n_vectors: Optional[int] = None) -> faiss.Index:
+        """Construye un índice vacío para vectores de la dimensión indicada.
+
+        Parámetros:
+            dimension (int): Dimensión de los embeddings.
+            n_vectors (Optional[int]): Tamaño del corpus de entrenamiento. Si se
+                indica, `nlist` se ajusta al corpus y, si este es demasiado pequeño
+                para entrenar el índice configurado, se usa un índice plano.
+
+        Retorna:
+            faiss.Index: El índice sin entrenar (o listo para usar si es plano o HNSW).
+        """
+        index_type = self.index_type
+        nlist = self._nlist(n_vectors)
+        if n_vectors is not None and index_type in TRAINED_TYPES:
+            if n_vectors < self._min_points(nlist):
+                logger.warning(
+                    f"Corpus de {n_vectors} vectores insuficiente para entrenar "
+                    f"{index_type}; se usa un índice FLAT."
+                )
+                index_type = "FLAT"
+
+        match index_type:
+            case "FLAT":
+                if self.metric == faiss.METRIC_INNER_PRODUCT:
+                    return faiss.IndexFlatIP(dimension)
+                return faiss.IndexFlatL2(dimension)
+            case "IVF_FLAT":
+                quantizer = self._quantizer(dimension)
+                index = faiss.IndexIVFFlat(quantizer, dimension, nlist, self.metric)
+            case "IVF_PQ":
+                quantizer = self._quantizer(dimension)
+                index = faiss.IndexIVFPQ(
+                    quantizer,
+                    dimension,
+                    nlist,
+                    self._pq_m(dimension),
+                    self.pq_bits,
+                    self.metric,
+                )
+            case "HNSW":
+                index = faiss.IndexHNSWFlat(dimension, self.hnsw_m, self.metric)
+            case "SQ_FP16":
+                index = faiss.IndexScalarQuantizer(
+                    dimension, faiss.ScalarQuantizer.QT_fp16, self.metric
+                )
+            case "SQ8":
+                index = faiss.IndexScalarQuantizer(
+                    dimension, faiss.ScalarQuantizer.QT_8bit, self.metric
+                )
+            case "PQ":
+                index = faiss.IndexPQ(
+                    dimension, self._pq_m(dimension), self.pq_bits, self.metric
+                )
+        self.tune(index)
+        return index
+
+    def needs_retrain(self, index: faiss.Index, n_vectors: int) -> bool:
+        """Indica si el índice se entrenó con un corpus demasiado pequeño.
+
+        Ocurre cuando el primer lote no bastaba para entrenar el índice configurado
+        (y se construyó uno plano) o cuando `nlist` se limitó al tamaño de ese
+        lote. Se reentrena cuando el corpus permite el índice configurado o al
+        menos el doble de listas invertidas, de modo que entre dos
+        reentrenamientos el corpus crece en proporción geométrica.
+
+        Parámetros:
+            index (faiss.Index): Índice actual.
+            n_vectors (int): Vectores del corpus actual.
+        """
+        if self.index_type not in TRAINED_TYPES:
+            return False
+        nlist = self._nlist(n_vectors)
+        if index_kind(index) != self.index_type:
+            return n_vectors >= self._min_points(nlist)
+        ivf = faiss.try_extract_index_ivf(index)
+        return ivf is not None and nlist >= 2 * ivf.nlist
+
+    def train(self, index: faiss.Index, vectors: np.ndarray) -> None:
+        """Entrena el índice con una muestra aleatoria del corpus si lo necesita."""
+        if index.is_trained:
+            return
+        sample = vectors
+        if len(vectors) > self.train_sample:
+            rng = np.random.default_rng(seed=1234)
+            sample = vectors[rng.choice(len(vectors), self.train_sample, replace=False)]
+        index.train(np.ascontiguousarray(sample, dtype=np.float32))
+
+    def tune(
+        self,
+        index: faiss.Index,
+        nprobe: Optional[int] = None,
+        ef_search: Optional[int] = None,
+    ) -> None:
+        """Ajusta los parámetros de búsqueda del índice sin reconstruirlo.
+
+        Parámetros:
+            index (faiss.Index): Índice a ajustar.
+            nprobe (Optional[int]): Listas invertidas a visitar en índices IVF.
+            ef_search (Optional[int]): Tamaño de la lista de candidatos en HNSW.
+        """
+        self.nprobe = nprobe or self.nprobe
+        self.ef_search = ef_search or self.ef_search
+        params = faiss.ParameterSpace()
+        if faiss.try_extract_index_ivf(index) is not None:
+            params.set_index_parameter(index, "nprobe", self.nprobe)
+        if hasattr(index, "hnsw"):
+            params.set_index_parameter(index, "efSearch", self.ef_search)
+
+    def search_subset(
+        self,
+        index: faiss.Index,
+        vectors: np.ndarray,
+        k: int,
+        ids: np.ndarray,
+        stored: Optional[Callable[[np.ndarray], Optional[np.ndarray]]] = None,
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Busca solo entre los ids indicados mediante un `IDSelector` de FAISS.
+
+        En los índices aproximados el subconjunto puede quedar fuera de las listas
+        visitadas (IVF) o del grafo explorado (HNSW); si faltan resultados, la
+        búsqueda se repite de forma exhaustiva sobre el subconjunto, de modo que
+        siempre se devuelven `min(k, len(ids))` vecinos. Los índices que no admiten
+        selectores (`PQ`) se buscan siempre de forma exhaustiva sobre el
+        subconjunto.
+
+        Parámetros:
+            index (faiss.Index): Índice sobre el que buscar.
+            vectors (np.ndarray): Matriz de consultas.
+            k (int): Número de vecinos por consulta.
+            ids (np.ndarray): Ids de FAISS (int64) permitidos.
+            stored (Optional[Callable[[np.ndarray], Optional[np.ndarray]]]):
+                Vectores completos de los ids indicados, o None si no están
+                guardados; para la búsqueda exhaustiva se prefieren a los
+                reconstruidos desde el índice.
+
+        Retorna:
+            Tuple[np.ndarray, np.ndarray]: Puntuaciones e ids, como `index.search`.
+        """
+        k = min(k, len(ids))
+        selector = faiss.IDSelectorBatch(ids)
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            params = faiss.SearchParametersIVF(sel=selector, nprobe=self.nprobe)
+        elif hasattr(index, "hnsw"):
+            params = faiss.SearchParametersHNSW(
+                sel=selector, efSearch=max(self.ef_search, k)
+            )
+        elif isinstance(index, (faiss.IndexFlat, faiss.IndexScalarQuantizer)):
+            return index.search(vectors, k, params=faiss.SearchParameters(sel=selector))
+        else:
+            # `IndexPQ` rechaza los parámetros de búsqueda con selector
+            return self._search_exact(index, vectors, k, ids, stored)
+
+        scores, positions = index.search(vectors, k, params=params)
+        if not (positions == -1).any():
+            return scores, positions
+        if ivf is not None:
+            params.nprobe = ivf.nlist
+            return index.search(vectors, k, params=params)
+        return self._search_exact(index, vectors, k, ids, stored)
+
+    def _search_exact(
+        self,
+        index: faiss.Index,
+        vectors: np.ndarray,
+        k: int,
+        ids: np.ndarray,
+        stored: Optional[Callable[[np.ndarray], Optional[np.ndarray]]],
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Búsqueda exacta sobre los vectores completos (o reconstruidos) de `ids`."""
+        subset_vectors = stored(ids) if stored is not None else None
+        if subset_vectors is None:
+            subset_vectors = index.reconstruct_batch(ids)
+        subset = faiss.IndexFlat(index.d, self.metric)
+        subset.add(np.ascontiguousarray(subset_vectors, dtype=np.float32))
+        scores, local = subset.search(vectors, k)
+        return scores, np.where(local == -1, -1, ids[local])
+
+    def rerank(
+        self, query: np.ndarray, vectors: np.ndarray
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Puntúa de forma exacta los candidatos de una consulta.
+
+        Parámetros:
+            query (np.ndarray): Vector de la consulta, de forma (d,).
+            vectors (np.ndarray): Vectores completos de los candidatos, (n, d).
+
+        Retorna:
+            Tuple[np.ndarray, np.ndarray]: El orden de los candidatos de mejor a peor
+                y sus puntuaciones, con el mismo criterio que `index.search`
+                (producto interno o distancia L2 al cuadrado).
+        """
+        if self.metric == faiss.METRIC_INNER_PRODUCT:
+            scores = vectors @ query
+            return np.argsort(-scores, kind="stable"), scores
+        scores = ((vectors - query) ** 2).sum(axis=1)
+        return np.argsort(scores, kind="stable"), scores
+
+    def _quantizer(self, dimension: int) -> faiss.Index:
+        if self.metric == faiss.METRIC_INNER_PRODUCT:
+            return faiss.IndexFlatIP(dimension)
+        return faiss.IndexFlatL2(dimension)
+
+    def _min_points(self, nlist: int) -> int:
+        """Vectores necesarios para entrenar el índice configurado."""
+        min_points = 0 if self.index_type == "PQ" else nlist * MIN_POINTS_PER_CENTROID
+        if self.index_type in ("IVF_PQ", "PQ"):
+            min_points = max(min_points, 2**self.pq_bits * MIN_POINTS_PER_CENTROID)
+        return min_points
+
+    def _nlist(self, n_vectors: Optional[int]) -> int:
+        if self.nlist:
+            nlist = self.nlist
+        elif n_vectors:
+            # Heurística habitual: del orden de 4·sqrt(N) listas invertidas
+            nlist = int(4 * math.sqrt(n_vectors))
+        else:
+            nlist = 1024
+        if n_vectors:
+            nlist = min(nlist, max(1, n_vectors // MIN_POINTS_PER_CENTROID))
+        return max(1, nlist)
+
+    def _pq_m(self, dimension: int) -> int:
+        if self.pq_m:
+            if dimension % self.pq_m:
+                raise ValueError(
+                    f"INDEX_PQ_M={self.pq_m} debe dividir la dimensión {dimension}"
+                )
+            return self.pq_m
+        # Mayor número de subcuantizadores (≤ 64) que divide la dimensión
+        return max(m for m in range(1, min(64, dimension) + 1) if dimension % m == 0)
+
+
+def recall_latency_report(
+    corpus: np.ndarray,
+    queries: np.ndarray,
+    strategy: DistanceStrategy,
+    k: int = 5,
+    configs: Optional[List[Dict]] = None,
+) -> List[IndexReport]:
+    """Compara recall@k y latencia de varios índices frente al índice plano exacto.
+
+    Parámetros:
+        corpus (np.ndarray): Vectores del corpus, de forma (N, d).
+        queries (np.ndarray): Vectores de consulta, de forma (Q, d).
+        strategy (DistanceStrategy): Estrategia de distancia del vectorstore.
+        k (int): Número de vecinos a comparar.
+        configs (Optional[List[Dict]]): Argumentos de `IndexFactory` para cada índice
+            a evaluar. Por defecto se evalúan todos los tipos aproximados con sus
+            valores por defecto y los cuantizados también con re-puntuación exacta
+            de `4 * k` candidatos. Con `rerank_k` se buscan esos candidatos y se
+            ordenan de nuevo con los vectores completos del corpus.
+
+    Retorna:
+        List[IndexReport]: Un informe por configuración; el primero es el índice exacto.
+    """
+    corpus = np.ascontiguousarray(corpus, dtype=np.float32)
+    queries = np.ascontiguousarray(queries, dtype=np.float32)
+    configs = configs or [
+        *({"index_type": index_type} for index_type in INDEX_TYPES[1:]),
+        *(
+            {"index_type": index_type, "rerank_k": 4 * k}
+            for index_type in QUANTIZED_TYPES
+        ),
+    ]
+
+    exact_factory = IndexFactory(strategy, index_type="FLAT")
+    exact = exact_factory.build(corpus.shape[1])
+    exact.add(corpus)
+    _, ground_truth = exact.search(queries, k)
+
+    reports = []
+    for config in [{"index_type": "FLAT"}, *configs]:
+        factory = IndexFactory(strategy, **config)
+        start = time.perf_counter()
+        index = factory.build(corpus.shape[1], n_vectors=len(corpus))
+        factory.train(index, corpus)
+        index.add(corpus)
+        build_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        if factory.rerank_k > k:
+            _, candidates = index.search(queries, factory.rerank_k)
+            found = np.full((len(queries), k), -1, dtype=np.int64)
+            for row, positions in enumerate(candidates):
+                positions = positions[positions >= 0]
+                order, _ = factory.rerank(queries[row], corpus[positions])
+                found[row, : min(k, len(order))] = positions[order[:k]]
+        else:
+            _, found = index.search(queries, k)
+        elapsed = time.perf_counter() - start
+
+        hits = sum(
+            len(set(row_found[row_found >= 0]) & set(row_truth))
+            for row_found, row_truth in zip(found, ground_truth, strict=True)
+        )
+        params = {key: value for key, value in config.items() if key != "index_type"}
+        ivf = faiss.try_extract_index_ivf(index)
+        if ivf is not None:
+            params["nlist"] = ivf.nlist
+        reports.append(
+            IndexReport(
+                # El construido: con un corpus pequeño puede ser plano
+                index_type=index_kind(index),
+                params=params,
+                recall_at_k=hits / (len(queries) * k),
+                latency_ms=1000 * elapsed / len(queries),
+                queries_per_second=len(queries) / elapsed if elapsed else float("inf"),
+                build_seconds=build_seconds,
+                memory_bytes=int(faiss.serialize_index(index).nbytes),
+            )
+        )
+    return reports
+
+
+def index_kind(index: faiss.Index) -> str:
+    """Tipo de `INDEX_TYPES` de un índice FAISS ya construido."""
+    index = faiss.downcast_index(index)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "IVF_PQ"
+    if isinstance(index, faiss.IndexIVFFlat):
+        return "IVF_FLAT"
+    if isinstance(index, faiss.IndexHNSW):
+        return "HNSW"
+    if isinstance(index, faiss.IndexPQ):
+        return "PQ"
+    if isinstance(index, faiss.IndexScalarQuantizer):
+        if index.sq.qtype == faiss.ScalarQuantizer.QT_fp16:
+            return "SQ_FP16"
+        return "SQ8"
+    return "FLAT"
+
+
+def _env_int(name: str, default: Optional[int] = None) -> Optional[int]:
+    value = os.getenv(name)
+    return int(value) if value else default
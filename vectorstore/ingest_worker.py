@@ -0,0 +1,635 @@
+import argparse
+import contextlib
+import json
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+
+from telemetry.tracing import span
+from vectorstore.ingestion_pipeline import IngestProgress
+from vectorstore.segment_store import store_lock
+from vectorstore.snapshot_archive import link_tree, replace_folder
+from vectorstore.vectorstore_manager import VectorStoreManager
+
+try:
+    import fcntl
+except ImportError:  # Windows: no se detectan los trabajadores en marcha
+    fcntl = None
+
+# Archivos que se modifican en el sitio (diario y textos del catálogo, filas de los
+# vectores completos): en la copia de trabajo se copian en lugar de enlazarse. Los
+# bloques de vectores se enlazan y `VectorRows` copia los que modifica
+IN_PLACE_FILES = ("catalog", "vectors/ids.sqlite")
+HEARTBEAT_SECONDS = 10
+# Un trabajo en curso sin latido durante este tiempo se da por abandonado
+STALE_SECONDS = 60
+
+
+@dataclass
+class IngestJob:
+    """Trabajo de ingesta de la cola, con su estado y su avance.
+
+    `status` es `queued`, `running`, `done` o `failed`; `files` es None si el
+    trabajo sincroniza toda la carpeta `path`.
+    """
+
+    id: int
+    store: str
+    path: str
+    files: Optional[List[str]]
+    detect_deletions: bool
+    status: str = "queued"
+    attempts: int = 0
+    files_total: int = 0
+    files_parsed: int = 0
+    files_failed: List[str] = field(default_factory=list)
+    batches: int = 0
+    chunks: int = 0
+    store_version: Optional[str] = None
+    error: Optional[str] = None
+    created_at: float = 0.0
+    finished_at: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        """Indica si el trabajo está en cola o en curso."""
+        return self.status in ("queued", "running")
+
+
+class JobQueue:
+    """Cola persistente de trabajos de ingesta, en un archivo SQLite.
+
+    La comparten los procesos que encolan trabajos (la CLI, un script) y los
+    trabajadores, de modo que el estado y el avance de cada trabajo, por archivo
+    y por lote, sobreviven a un reinicio. Un trabajo en curso cuyo trabajador
+    deja de dar señales durante `STALE_SECONDS` vuelve a la cola.
+    """
+
+    def __init__(self, path: Optional[str] = None):
+        """Abre (o crea) la cola.
+
+        Parámetros:
+            path (Optional[str]): Archivo SQLite (`INGEST_JOBS_PATH`).
+        """
+        self.path = path or os.getenv("INGEST_JOBS_PATH", "database/ingest_jobs.sqlite")
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(
+            self.path, check_same_thread=False, isolation_level=None, timeout=30
+        )
+        self._connection.executescript(
+            """
+            PRAGMA journal_mode = WAL;
+            PRAGMA synchronous = NORMAL;
+            CREATE TABLE IF NOT EXISTS jobs (
+                id INTEGER PRIMARY KEY,
+                store TEXT NOT NULL,
+                path TEXT NOT NULL,
+                files TEXT,
+                detect_deletions INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                files_total INTEGER NOT NULL DEFAULT 0,
+                files_parsed INTEGER NOT NULL DEFAULT 0,
+                files_failed TEXT NOT NULL DEFAULT '[]',
+                batches INTEGER NOT NULL DEFAULT 0,
+                chunks INTEGER NOT NULL DEFAULT 0,
+                store_version TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                heartbeat REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, id);
+            CREATE TABLE IF NOT EXISTS job_files (
+                job_id INTEGER NOT NULL,
+                path TEXT NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (job_id, path)
+            );
+            """
+        )
+
+    def submit(
+        self,
+        store: str,
+        path: str,
+        files: Optional[List[str]] = None,
+        detect_deletions: Optional[bool] = None,
+    ) -> int:
+        """Encola la sincronización de una carpeta (o de algunos de sus archivos).
+
+        Parámetros:
+            store (str): Nombre del vectorstore en `database/`.
+            path (str): Carpeta de los documentos.
+            files (Optional[List[str]]): Archivos de la carpeta a ingerir; por
+                defecto, todos los nuevos o modificados.
+            detect_deletions (Optional[bool]): Si es True, los archivos registrados
+                que ya no existen se eliminan del vectorstore; por defecto, solo al
+                sincronizar toda la carpeta.
+
+        Retorna:
+            int: Id del trabajo.
+        """
+        if detect_deletions is None:
+            detect_deletions = files is None
+        with self._lock:
+            cursor = self._connection.execute(
+                "INSERT INTO jobs (store, path, files, detect_deletions, status, "
+                "created_at) VALUES (?, ?, ?, ?, 'queued', ?)",
+                (
+                    store,
+                    path,
+                    None if files is None else json.dumps(files),
+                    int(detect_deletions),
+                    time.time(),
+                ),
+            )
+        return cursor.lastrowid
+
+    def get(self, job_id: int) -> Optional[IngestJob]:
+        """Estado actual de un trabajo, o None si no existe."""
+        with self._lock:
+            row = self._connection.execute(
+                f"SELECT {_COLUMNS} FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return None if row is None else _job(row)
+
+    def jobs(self, store: Optional[str] = None, active: bool = False) -> List[IngestJob]:
+        """Trabajos de la cola (de un vectorstore, o solo los pendientes)."""
+        query = f"SELECT {_COLUMNS} FROM jobs WHERE 1 = 1"
+        params: List[Any] = []
+        if store is not None:
+            query += " AND store = ?"
+            params.append(store)
+        if active:
+            query += " AND status IN ('queued', 'running')"
+        with self._lock:
+            rows = self._connection.execute(query + " ORDER BY id", params).fetchall()
+        return [_job(row) for row in rows]
+
+    def files(self, job_id: int) -> Dict[str, Dict[str, Any]]:
+        """Estado de cada archivo: `pending`, `parsed`, `failed` o `done`."""
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT path, status, attempts FROM job_files WHERE job_id = ? "
+                "ORDER BY path",
+                (job_id,),
+            ).fetchall()
+        return {path: {"status": status, "attempts": n} for path, status, n in rows}
+
+    def claim(self) -> Optional[IngestJob]:
+        """Toma el trabajo más antiguo de la cola y lo marca en curso."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                self._connection.execute(
+                    "UPDATE jobs SET status = 'queued' "
+                    "WHERE status = 'running' AND heartbeat < ?",
+                    (now - STALE_SECONDS,),
+                )
+                row = self._connection.execute(
+                    "SELECT id FROM jobs WHERE status = 'queued' ORDER BY id LIMIT 1"
+                ).fetchone()
+                if row is not None:
+                    self._connection.execute(
+                        "UPDATE jobs SET status = 'running', attempts = attempts + 1, "
+                        "heartbeat = ?, error = NULL WHERE id = ?",
+                        (now, row[0]),
+                    )
+                self._connection.execute("COMMIT")
+            except BaseException:
+                self._connection.execute("ROLLBACK")
+                raise
+        return None if row is None else self.get(row[0])
+
+    def start_files(self, job_id: int, files: List[str]) -> None:
+        """Registra los archivos que va a ingerir un trabajo."""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.execute("DELETE FROM job_files WHERE job_id = ?", (job_id,))
+            self._connection.executemany(
+                "INSERT INTO job_files (job_id, path, status) VALUES (?, ?, 'pending')",
+                [(job_id, path) for path in files],
+            )
+            self._connection.execute(
+                "UPDATE jobs SET files_total = ?, files_parsed = 0, files_failed = '[]', "
+                "batches = 0, chunks = 0, heartbeat = ? WHERE id = ?",
+                (len(files), time.time(), job_id),
+            )
+            self._connection.execute("COMMIT")
+
+    def update(
+        self,
+        job_id: int,
+        progress: IngestProgress,
+        parsed: List[str],
+        failed: List[str],
+    ) -> None:
+        """Guarda el avance de un trabajo y de los archivos que han cambiado."""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            self._connection.executemany(
+                "UPDATE job_files SET status = 'parsed' WHERE job_id = ? AND path = ?",
+                [(job_id, path) for path in parsed],
+            )
+            self._connection.executemany(
+                "UPDATE job_files SET status = 'failed', attempts = attempts + 1 "
+                "WHERE job_id = ? AND path = ?",
+                [(job_id, path) for path in failed],
+            )
+            self._connection.execute(
+                "UPDATE jobs SET files_parsed = ?, files_failed = ?, batches = ?, "
+                "chunks = ?, heartbeat = ? WHERE id = ?",
+                (
+                    len(progress.parsed),
+                    json.dumps(progress.failed),
+                    progress.batches,
+                    progress.chunks,
+                    time.time(),
+                    job_id,
+                ),
+            )
+            self._connection.execute("COMMIT")
+
+    def heartbeat(self, job_id: int) -> None:
+        """Señala que el trabajador de un trabajo en curso sigue activo."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET heartbeat = ? WHERE id = ?", (time.time(), job_id)
+            )
+
+    def finish(
+        self,
+        job_id: int,
+        status: str,
+        store_version: Optional[str] = None,
+        error: Optional[str] = None,
+    ) -> None:
+        """Cierra un trabajo como `done` (publicado) o `failed`."""
+        with self._lock:
+            self._connection.execute("BEGIN")
+            if status == "done":
+                self._connection.execute(
+                    "UPDATE job_files SET status = 'done' "
+                    "WHERE job_id = ? AND status != 'failed'",
+                    (job_id,),
+                )
+            self._connection.execute(
+                "UPDATE jobs SET status = ?, store_version = ?, error = ?, "
+                "finished_at = ? WHERE id = ?",
+                (status, store_version, error, time.time(), job_id),
+            )
+            self._connection.execute("COMMIT")
+
+    def retry(self, job_id: int, error: str) -> None:
+        """Devuelve a la cola un trabajo que ha fallado."""
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET status = 'queued', error = ? WHERE id = ?",
+                (error, job_id),
+            )
+
+    def close(self) -> None:
+        """Cierra la conexión con SQLite."""
+        with self._lock:
+            self._connection.close()
+
+
+class IngestWorker:
+    """Ejecuta los trabajos de la cola sin interrumpir las consultas.
+
+    Cada trabajo se aplica sobre una copia de trabajo de la carpeta del
+    vectorstore (`database/<nombre>.job-<id>`) hecha con enlaces duros: los
+    segmentos y los índices no se modifican una vez escritos, de modo que solo se
+    copian los archivos de `IN_PLACE_FILES`. Al terminar, la copia sustituye a la
+    carpeta con un renombrado y pasa a ser la generación publicada. Los procesos
+    que sirven consultas siguen usando la generación que tienen cargada hasta que
+    `VectorStoreManager.reopen` carga la nueva.
+
+    Los archivos que no se pueden analizar se reintentan dentro del mismo trabajo
+    hasta `max_attempts` veces, esperando `retry_seconds` por el número de
+    intento; un trabajo que falla por completo (p. ej. porque el servicio de
+    embeddings no responde) vuelve a la cola hasta agotar `max_attempts`.
+    """
+
+    def __init__(
+        self,
+        queue: Optional[JobQueue] = None,
+        max_attempts: Optional[int] = None,
+        retry_seconds: Optional[float] = None,
+        poll_seconds: Optional[float] = None,
+    ):
+        """Inicializa el trabajador.
+
+        Parámetros:
+            queue (Optional[JobQueue]): Cola de trabajos; por defecto, la de
+                `INGEST_JOBS_PATH`.
+            max_attempts (Optional[int]): Intentos por archivo y por trabajo
+                (`INGEST_MAX_ATTEMPTS`).
+            retry_seconds (Optional[float]): Espera base entre intentos
+                (`INGEST_RETRY_SECONDS`).
+            poll_seconds (Optional[float]): Espera entre consultas a una cola
+                vacía (`INGEST_POLL_SECONDS`).
+        """
+        self.queue = queue or JobQueue()
+        self.max_attempts = max_attempts or int(os.getenv("INGEST_MAX_ATTEMPTS", "3"))
+        self.retry_seconds = (
+            retry_seconds
+            if retry_seconds is not None
+            else float(os.getenv("INGEST_RETRY_SECONDS", "5"))
+        )
+        self.poll_seconds = poll_seconds or float(os.getenv("INGEST_POLL_SECONDS", "1"))
+
+    def run(
+        self, until_idle: bool = False, stop: Optional[threading.Event] = None
+    ) -> int:
+        """Procesa trabajos hasta que la cola se vacía (`until_idle`) o `stop`.
+
+        Retorna:
+            int: Número de trabajos procesados.
+        """
+        stop = stop or threading.Event()
+        processed = 0
+        while True:
+            # Mientras se retiene, `start_worker` no lanza otro trabajador
+            with worker_lock(self.queue.path):
+                while not stop.is_set():
+                    job = self.queue.claim()
+                    if job is None:
+                        if until_idle:
+                            break
+                        stop.wait(self.poll_seconds)
+                        continue
+                    self.process(job)
+                    processed += 1
+            # Un trabajo encolado justo antes de soltar el bloqueo no ha lanzado a
+            # ningún trabajador
+            if stop.is_set() or not any(
+                job.status == "queued" for job in self.queue.jobs(active=True)
+            ):
+                return processed
+
+    def process(self, job: IngestJob) -> None:
+        """Ejecuta un trabajo y registra su resultado en la cola."""
+        logger.info(f"Trabajo de ingesta {job.id} (intento {job.attempts}): {job.path}")
+        heartbeat = _Heartbeat(self.queue, job.id)
+        heartbeat.start()
+        try:
+            with span("ingest.job", store=job.store):
+                version = self._run(job)
+        except Exception as e:
+            logger.error(f"Trabajo de ingesta {job.id} fallido: {e}")
+            if job.attempts < self.max_attempts:
+                self.queue.retry(job.id, str(e))
+            else:
+                self.queue.finish(job.id, "failed", error=str(e))
+            return
+        finally:
+            heartbeat.stop()
+        self.queue.finish(job.id, "done", store_version=version)
+        logger.info(f"Trabajo de ingesta {job.id} publicado en la versión {version}")
+
+    def _run(self, job: IngestJob) -> str:
+        """Ingiere en una copia de trabajo y la publica.
+
+        La copia se toma y se publica con el bloqueo de escritura del vectorstore
+        (`store_lock`), que también toman los demás escritores: si alguno ha
+        modificado el vectorstore entretanto, el trabajo falla y se reintenta sobre
+        la versión nueva en lugar de sobrescribirla.
+
+        Retorna:
+            str: Versión del vectorstore publicada.
+        """
+        live = VectorStoreManager(job.path, job.store, read_only=False)
+        folder_path = live.segments.folder_path
+        staging_name = f"{job.store}.job-{job.id}"
+        staging_path = os.path.join(os.path.dirname(folder_path), staging_name)
+        shutil.rmtree(staging_path, ignore_errors=True)
+        try:
+            with store_lock(folder_path):
+                base_version = live.store_version
+                if os.path.isdir(folder_path):
+                    link_tree(folder_path, staging_path, copy=IN_PLACE_FILES)
+            staging = VectorStoreManager(
+                job.path, staging_name, read_only=False, embeddings=live.embeddings
+            )
+            self._ingest(job, staging)
+            staging.segments.wait_for_compaction()
+            staging.lexical_index.wait_for_compaction()
+            version = staging.store_version
+            if version == base_version:
+                # Nada que publicar
+                return version
+            if os.path.isdir(live.snapshot_path):
+                # Los nodos de solo lectura abren la instantánea sin regenerarla
+                staging.build_snapshot()
+            with span("ingest.publish"), store_lock(folder_path):
+                if live.store_version != base_version:
+                    raise RuntimeError(
+                        f"El vectorstore '{job.store}' ha cambiado durante la ingesta"
+                    )
+                replace_folder(staging_path, folder_path)
+            return version
+        finally:
+            shutil.rmtree(staging_path, ignore_errors=True)
+            # Bloqueo de la copia de trabajo, que nadie más usa
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(f"{staging_path}.lock")
+
+    def _ingest(self, job: IngestJob, staging: VectorStoreManager) -> None:
+        """Aplica los cambios del trabajo, reintentando los archivos fallidos."""
+        progress = IngestProgress(callback=_ProgressWriter(self.queue, job.id))
+        diff = staging.detect_changes(
+            job.path, detect_deletions=job.detect_deletions, files=job.files
+        )
+        to_ingest = diff.added + diff.changed
+        progress.files_total = len(to_ingest)
+        self.queue.start_files(job.id, to_ingest)
+        staging.apply_changes(diff, progress)
+        for attempt in range(1, self.max_attempts):
+            failed = list(staging.failed_files)
+            if not failed:
+                break
+            delay = self.retry_seconds * attempt
+            logger.warning(
+                f"{len(failed)} archivos no se pudieron analizar; "
+                f"reintento {attempt} en {delay:.0f} s"
+            )
+            time.sleep(delay)
+            progress.retry(failed)
+            retry = staging.detect_changes(job.path, detect_deletions=False, files=failed)
+            staging.apply_changes(retry, progress)
+
+
+class _ProgressWriter:
+    """Guarda en la cola el avance de un trabajo, con solo los archivos nuevos."""
+
+    def __init__(self, queue: JobQueue, job_id: int):
+        self.queue = queue
+        self.job_id = job_id
+        self._parsed = 0
+        self._failed: set = set()
+        self._lock = threading.Lock()
+
+    def __call__(self, progress: IngestProgress) -> None:
+        with self._lock:
+            parsed = progress.parsed[self._parsed :]
+            self._parsed += len(parsed)
+            failed = set(progress.failed)
+            new_failed = sorted(failed - self._failed)
+            self._failed = failed
+            self.queue.update(self.job_id, progress, parsed, new_failed)
+
+
+class _Heartbeat(threading.Thread):
+    """Hilo que mantiene vivo un trabajo mientras un lote tarda en embeberse."""
+
+    def __init__(self, queue: JobQueue, job_id: int):
+        super().__init__(name="ingest-heartbeat", daemon=True)
+        self.queue = queue
+        self.job_id = job_id
+        self._stopped = threading.Event()
+
+    def run(self) -> None:
+        while not self._stopped.wait(HEARTBEAT_SECONDS):
+            self.queue.heartbeat(self.job_id)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.join()
+
+
+@contextlib.contextmanager
+def worker_lock(jobs_path: str) -> Iterator[None]:
+    """Bloqueo compartido que retiene cada trabajador de la cola mientras la atiende.
+
+    Se usa `flock` sobre `<cola>.worker`; varios trabajadores pueden tenerlo a la
+    vez, y `worker_running` lo comprueba sin esperar.
+    """
+    with open(f"{jobs_path}.worker", "a+b") as file:
+        if fcntl is not None:
+            fcntl.flock(file.fileno(), fcntl.LOCK_SH)
+        yield
+
+
+def worker_running(jobs_path: str) -> bool:
+    """Indica si algún trabajador atiende la cola `jobs_path` (ver `worker_lock`)."""
+    if fcntl is None:
+        return False
+    with open(f"{jobs_path}.worker", "a+b") as file:
+        try:
+            fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return True
+    return False
+
+
+def start_worker(
+    jobs_path: Optional[str] = None, log_file: Optional[str] = None
+) -> Optional[subprocess.Popen]:
+    """Lanza un trabajador en un proceso aparte que termina al vaciarse la cola.
+
+    El proceso no depende del que lo lanza: si este termina, el trabajo en curso
+    sigue hasta publicarse. Si ya hay un trabajador en marcha no se lanza otro:
+    antes de terminar, este vuelve a mirar la cola y toma los trabajos nuevos.
+
+    Parámetros:
+        jobs_path (Optional[str]): Archivo de la cola (`INGEST_JOBS_PATH`).
+        log_file (Optional[str]): Archivo al que se añade el registro del
+            trabajador (`INGEST_LOG_FILE`).
+
+    Retorna:
+        Optional[subprocess.Popen]: Proceso lanzado, o None si ya había uno.
+    """
+    env = dict(os.environ)
+    if jobs_path:
+        env["INGEST_JOBS_PATH"] = jobs_path
+    if worker_running(env.get("INGEST_JOBS_PATH", "database/ingest_jobs.sqlite")):
+        logger.info("Ya hay un trabajador de ingesta en marcha")
+        return None
+    log_file = log_file or os.getenv("INGEST_LOG_FILE", "ingest.log")
+    with open(log_file, "a", encoding="utf-8") as log:
+        return subprocess.Popen(
+            [sys.executable, "-m", "vectorstore.ingest_worker", "work", "--until-idle"],
+            stdout=log,
+            stderr=subprocess.STDOUT,
+            env=env,
+            # Ctrl+C en la consola que lo lanza no interrumpe la ingesta
+            start_new_session=True,
+        )
+
+
+_COLUMNS = (
+    "id, store, path, files, detect_deletions, status, attempts, files_total, "
+    "files_parsed, files_failed, batches, chunks, store_version, error, created_at, "
+    "finished_at"
+)
+
+
+def _job(row: Tuple) -> IngestJob:
+    values = dict(zip(_COLUMNS.split(", "), row, strict=True))
+    values["files"] = None if values["files"] is None else json.loads(values["files"])
+    values["detect_deletions"] = bool(values["detect_deletions"])
+    values["files_failed"] = json.loads(values["files_failed"])
+    return IngestJob(**values)
+
+
+def main() -> None:
+    """Encola y ejecuta trabajos de ingesta del vectorstore de `VECTORSTORE_NAME`."""
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    submit = commands.add_parser("submit", help="Encolar un trabajo de ingesta")
+    submit.add_argument("files", nargs="*", help="Archivos; por defecto, toda la carpeta")
+    work = commands.add_parser("work", help="Ejecutar los trabajos de la cola")
+    work.add_argument(
+        "--until-idle", action="store_true", help="Terminar al vaciarse la cola"
+    )
+    status = commands.add_parser("status", help="Mostrar el estado de los trabajos")
+    status.add_argument("job", nargs="?", type=int, help="Id de un trabajo")
+    args = parser.parse_args()
+
+    load_dotenv()
+    queue = JobQueue()
+    if args.command == "submit":
+        job_id = queue.submit(
+            os.getenv("VECTORSTORE_NAME", "legislacion_MAX_INNER_PRODUCT"),
+            os.getenv("VECTORSTORE_PATH", "derecho_files"),
+            files=args.files or None,
+        )
+        print(job_id)
+    elif args.command == "work":
+        IngestWorker(queue).run(until_idle=args.until_idle)
+    elif args.job is not None:
+        job = queue.get(args.job)
+        if job is None:
+            sys.exit(f"No existe el trabajo {args.job}")
+        print(
+            json.dumps(
+                {**asdict(job), "file_status": queue.files(job.id)},
+                indent=2,
+                ensure_ascii=False,
+            )
+        )
+    else:
+        for job in queue.jobs():
+            print(
+                f"{job.id:>5}  {job.status:<8} {job.store}  "
+                f"{job.files_parsed}/{job.files_total} archivos, {job.chunks} chunks"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import os
+import queue
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from langchain_core.documents import Document
+
+_DONE = object()
+
+
+@dataclass
+class IngestProgress:
+    """Avance de una ingesta, por archivo y por lote.
+
+    `callback` recibe el avance tras cada archivo analizado (o fallido) y cada
+    lote escrito, desde el hilo de la etapa correspondiente. Un archivo que falla
+    y se vuelve a intentar con éxito deja de contar como fallido.
+    """
+
+    files_total: int = 0
+    parsed: List[str] = field(default_factory=list)
+    failed: List[str] = field(default_factory=list)
+    batches: int = 0
+    chunks: int = 0
+    callback: Optional[Callable[["IngestProgress"], None]] = field(
+        default=None, repr=False
+    )
+    _lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    def track(
+        self, stream: Iterable[List[Document]], failed_files: List[str]
+    ) -> Iterator[List[Document]]:
+        """Recorre los archivos analizados notificando cada uno.
+
+        Parámetros:
+            stream (Iterable[List[Document]]): Documentos de cada archivo, como
+                los produce `DocumentProcessor.iter_documents`.
+            failed_files (List[str]): Lista de archivos fallidos que el
+                procesador amplía mientras se recorre el flujo.
+        """
+        reported = 0
+        for documents in stream:
+            reported = self._report_failures(failed_files, reported)
+            source = documents[0].metadata.get("source") if documents else None
+            with self._lock:
+                if source in self.failed:
+                    self.failed.remove(source)
+                self.parsed.append(source)
+            self._notify()
+            yield documents
+        self._report_failures(failed_files, reported)
+
+    def retry(self, paths: List[str]) -> None:
+        """Deja de contar como fallidos los archivos que se van a reintentar."""
+        with self._lock:
+            self.failed = [path for path in self.failed if path not in paths]
+        self._notify()
+
+    def batch_written(self, chunks: int) -> None:
+        """Registra un lote escrito en el índice."""
+        with self._lock:
+            self.batches += 1
+            self.chunks += chunks
+        self._notify()
+
+    def _report_failures(self, failed_files: List[str], reported: int) -> int:
+        if len(failed_files) == reported:
+            return reported
+        with self._lock:
+            for path in failed_files[reported:]:
+                if path not in self.failed:
+                    self.failed.append(path)
+        self._notify()
+        return len(failed_files)
+
+    def _notify(self) -> None:
+        if self.callback is not None:
+            self.callback(self)
+
+
+class IngestionPipeline:
+    """Pipeline de ingesta en streaming: análisis → división → embeddings → escritura.
+
+    El análisis de archivos lo realiza `DocumentProcessor.iter_documents` en un pool
+    de procesos, que también puede dividirlos en chunks; si no, este pipeline
+    divide cada archivo a medida que llega. Los chunks se agrupan en lotes de
+    `batch_size` y pasan por colas acotadas a un hilo de embeddings y a un hilo
+    de escritura. Las colas acotadas aplican
+    contrapresión entre etapas, de modo que la memoria máxima depende del tamaño de
+    lote y no del tamaño del corpus.
+    """
+
+    def __init__(
+        self,
+        split: Optional[Callable[[List[Document]], List[Document]]],
+        embed: Callable[[List[str]], List[List[float]]],
+        write: Callable[[List[Document], List[List[float]]], None],
+        batch_size: Optional[int] = None,
+        queue_size: Optional[int] = None,
+    ):
+        """Inicializa el pipeline.
+
+        Parámetros:
+            split: Función que divide los documentos de un archivo en chunks, o
+                None si llegan ya divididos.
+            embed: Función que genera los embeddings de una lista de textos.
+            write: Función que persiste un lote de chunks con sus embeddings.
+            batch_size (Optional[int]): Chunks por lote (`INGEST_BATCH_SIZE`).
+            queue_size (Optional[int]): Lotes en espera entre etapas
+                (`INGEST_QUEUE_SIZE`).
+        """
+        self.split = split
+        self.embed = embed
+        self.write = write
+        self.batch_size = batch_size or int(os.getenv("INGEST_BATCH_SIZE", "256"))
+        self.queue_size = queue_size or int(os.getenv("INGEST_QUEUE_SIZE", "2"))
+
+    def run(self, document_stream: Iterable[List[Document]]) -> int:
+        """Procesa el flujo de documentos (una lista de páginas por archivo).
+
+        Retorna:
+            int: Número de chunks escritos.
+        """
+        to_embed = queue.Queue(maxsize=self.queue_size)
+        to_write = queue.Queue(maxsize=self.queue_size)
+        errors: List[BaseException] = []
+        stop = threading.Event()
+        written = [0]
+
+        def embed_worker() -> None:
+            while (batch := to_embed.get()) is not _DONE:
+                if stop.is_set():
+                    continue
+                try:
+                    vectors = self.embed([doc.page_content for doc in batch])
+                    _put(to_write, (batch, vectors), stop)
+                except BaseException as e:
+                    errors.append(e)
+                    stop.set()
+            _put(to_write, _DONE, None)
+
+        def write_worker() -> None:
+            while (item := to_write.get()) is not _DONE:
+                if stop.is_set():
+                    continue
+                batch, vectors = item
+                try:
+                    self.write(batch, vectors)
+                    written[0] += len(batch)
+                except BaseException as e:
+                    errors.append(e)
+                    stop.set()
+
+        workers = [
+            threading.Thread(target=embed_worker, name="ingest-embed", daemon=True),
+            threading.Thread(target=write_worker, name="ingest-write", daemon=True),
+        ]
+        for worker in workers:
+            worker.start()
+
+        try:
+            batch: List[Document] = []
+            for documents in document_stream:
+                if stop.is_set():
+                    break
+                chunks = documents if self.split is None else self.split(documents)
+                for chunk in chunks:
+                    batch.append(chunk)
+                    if len(batch) >= self.batch_size:
+                        _put(to_embed, batch, stop)
+                        batch = []
+            if batch and not stop.is_set():
+                _put(to_embed, batch, stop)
+        except BaseException:
+            stop.set()
+            raise
+        finally:
+            _put(to_embed, _DONE, None)
+            for worker in workers:
+                worker.join()
+
+        if errors:
+            raise errors[0]
+        return written[0]
+
+
+def _put(target: queue.Queue, item: object, stop: Optional[threading.Event]) -> None:
+    """Encola respetando la contrapresión; abandona si otra etapa ha fallado."""
+    while True:
+        if stop is not None and stop.is_set():
+            return
+        try:
+            target.put(item, timeout=0.1)
+            return
+        except queue.Full:
+            continue
@@ -0,0 +1,241 @@
+import hashlib
+import os
+import re
+from bisect import bisect_right
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+
+_ORDINALS = (
+    "PRIMERA|SEGUNDA|TERCERA|CUARTA|QUINTA|SEXTA|S[ÉE]PTIMA|OCTAVA|NOVENA|"
+    "D[ÉE]CIMA(?:\\s+\\w+)?|UNDÉCIMA|DUODÉCIMA|[ÚU]NICA"
+)
+
+# Encabezados de la estructura de una norma peruana, al inicio de una línea
+HEADING = re.compile(
+    r"^[ \t]*(?:"
+    r"(?P<title>(?i:t[íi]tulo)\s+(?:PRELIMINAR|Preliminar|[IVXLC]+|\d+)\b)"
+    r"|(?P<chapter>(?i:cap[íi]tulo)\s+(?:[IVXLC]+|\d+|[ÚU]NICO|[ÚU]nico)\b)"
+    r"|(?P<provisions>(?i:disposici[óo]n(?:es)?)\s+(?i:complementarias?|finales?"
+    r"|transitorias?|derogatorias?|modificatorias?)\b)"
+    r"|(?:ART[ÍI]CULO|Art[íi]culo|Art\.)\s+(?P<article>\d+(?:-[A-Z])?|[IVXLC]+)\s*[°º]?"
+    r"\s*(?:\.-|\.|-|:)"
+    rf"|(?P<provision>{_ORDINALS}|(?i:disposici[óo]n)\s+(?:{_ORDINALS}))\s*\.?\s*-"
+    r")",
+    re.MULTILINE,
+)
+
+
+def chunk_id(document: Document) -> str:
+    """Id determinista de un chunk: hash de su fuente, su artículo y su texto.
+
+    El mismo chunk de la misma fuente recibe siempre el mismo id, de modo que
+    volver a ingerirlo no lo duplica en el índice.
+    """
+    key = "\x00".join(
+        [
+            str(document.metadata.get("source") or ""),
+            str(document.metadata.get("article") or ""),
+            document.page_content,
+        ]
+    )
+    return hashlib.blake2b(key.encode("utf-8"), digest_size=16).hexdigest()
+
+
+@dataclass
+class _Unit:
+    """Fragmento de la norma entre dos encabezados."""
+
+    start: int
+    end: int
+    structure: Dict[str, str] = field(default_factory=dict)
+    # Línea del encabezado del artículo, repetida en los trozos si se divide
+    heading: str = ""
+
+
+class LegalTextSplitter:
+    """Divide normas legales según su estructura (Título, Capítulo, Artículo...).
+
+    Cada artículo o disposición es una unidad que no se corta mientras quepa en
+    `chunk_size` caracteres; los artículos cortos consecutivos del mismo capítulo
+    se agrupan en un mismo chunk, y solo los que superan `chunk_size` se dividen
+    con `RecursiveCharacterTextSplitter` y un solapamiento mínimo. Los chunks
+    llevan en sus metadatos el título, el capítulo y el artículo (`"5"` o `"3-7"`
+    si agrupa varios) y un id estable (`chunk_id`).
+
+    Los documentos sin artículos reconocibles se dividen como texto plano.
+    """
+
+    def __init__(
+        self,
+        chunk_size: Optional[int] = None,
+        chunk_overlap: Optional[int] = None,
+        structured: Optional[bool] = None,
+    ):
+        """Inicializa el divisor.
+
+        Parámetros:
+            chunk_size (Optional[int]): Tamaño máximo de un chunk en caracteres
+                (`CHUNK_SIZE`; 1500 por artículos, 1000 como texto plano).
+            chunk_overlap (Optional[int]): Solapamiento entre los trozos de un
+                artículo largo o de un documento sin estructura (`CHUNK_OVERLAP`).
+            structured (Optional[bool]): Si es False, todo se divide como texto
+                plano (`CHUNKING=recursive`).
+        """
+        if structured is None:
+            structured = os.getenv("CHUNKING", "legal").lower() == "legal"
+        self.structured = structured
+        # Los artículos enteros necesitan un máximo mayor para que el tamaño medio
+        # de los chunks sea similar al de la división por caracteres
+        default_size = "1500" if structured else "1000"
+        self.chunk_size = chunk_size or int(os.getenv("CHUNK_SIZE", default_size))
+        if chunk_overlap is None:
+            chunk_overlap = int(os.getenv("CHUNK_OVERLAP", "50"))
+        self.chunk_overlap = chunk_overlap
+        self.plain_splitter = RecursiveCharacterTextSplitter(
+            chunk_size=self.chunk_size,
+            chunk_overlap=self.chunk_overlap,
+            length_function=len,
+        )
+
+    def split_documents(self, documents: List[Document]) -> List[Document]:
+        """Divide las páginas de uno o varios archivos en chunks con id."""
+        pages_by_source: Dict[Optional[str], List[Document]] = {}
+        for document in documents:
+            pages_by_source.setdefault(document.metadata.get("source"), []).append(
+                document
+            )
+        chunks: List[Document] = []
+        for pages in pages_by_source.values():
+            chunks.extend(self._split_source(pages))
+        return chunks
+
+    def _split_source(self, pages: List[Document]) -> List[Document]:
+        """Chunks de un archivo, sin repetidos y con su id."""
+        chunks = None
+        if self.structured:
+            chunks = self._split_structure(pages)
+        if chunks is None:
+            chunks = self.plain_splitter.split_documents(pages)
+
+        unique: Dict[str, Document] = {}
+        for chunk in chunks:
+            chunk.id = chunk_id(chunk)
+            unique.setdefault(chunk.id, chunk)
+        return list(unique.values())
+
+    def _split_structure(self, pages: List[Document]) -> Optional[List[Document]]:
+        """Chunks por artículos, o None si el texto no tiene artículos."""
+        text = "\n".join(page.page_content for page in pages)
+        starts, offset = [], 0
+        for page in pages:
+            starts.append(offset)
+            offset += len(page.page_content) + 1
+
+        units = self._units(text)
+        if not any("article" in unit.structure for unit in units):
+            return None
+
+        chunks: List[Document] = []
+        for group in self._group(text, units):
+            first, last = group[0], group[-1]
+            content = text[first.start : last.end].strip()
+            if not content:
+                continue
+            page = pages[bisect_right(starts, first.start) - 1]
+            metadata = {**page.metadata, **last.structure}
+            articles = [u.structure["article"] for u in group if "article" in u.structure]
+            if len(articles) > 1:
+                metadata["article"] = f"{articles[0]}-{articles[-1]}"
+            chunks.extend(
+                Document(page_content=piece, metadata=dict(metadata))
+                for piece in self._split_long(content, last.heading)
+            )
+        return chunks
+
+    def _split_long(self, content: str, heading: str) -> List[str]:
+        """Divide un artículo más largo que `chunk_size` repitiendo su encabezado."""
+        if len(content) <= self.chunk_size:
+            return [content]
+        position = content.find(heading) if heading else -1
+        if position < 0:
+            return self.plain_splitter.split_text(content)
+        prefix = content[: position + len(heading)].rstrip()
+        splitter = RecursiveCharacterTextSplitter(
+            chunk_size=max(self.chunk_size - len(prefix) - 1, self.chunk_size // 2),
+            chunk_overlap=self.chunk_overlap,
+            length_function=len,
+        )
+        body = content[position + len(heading) :]
+        return [f"{prefix}\n{piece}" for piece in splitter.split_text(body)]
+
+    def _units(self, text: str) -> List[_Unit]:
+        """Fragmentos entre encabezados, con la estructura vigente en cada uno.
+
+        Los encabezados de título, capítulo o grupo de disposiciones no forman
+        una unidad propia: su texto se une al de la unidad siguiente.
+        """
+        units: List[_Unit] = []
+        structure: Dict[str, str] = {}
+        pending: Optional[int] = None
+        matches = list(HEADING.finditer(text))
+        if not matches or matches[0].start() > 0:
+            end = matches[0].start() if matches else len(text)
+            units.append(_Unit(0, end))
+        for i, match in enumerate(matches):
+            end = matches[i + 1].start() if i + 1 < len(matches) else len(text)
+            heading = " ".join(text[match.start() : end].split())[:120]
+            if match.group("title"):
+                structure = {"title": heading}
+            elif match.group("chapter"):
+                structure = {k: v for k, v in structure.items() if k == "title"}
+                structure["chapter"] = heading
+            elif match.group("provisions"):
+                structure = {k: v for k, v in structure.items() if k == "title"}
+                structure["chapter"] = heading
+            else:
+                article = match.group("article") or match.group("provision")
+                structure = {**structure, "article": " ".join(article.split())}
+                start = match.start() if pending is None else pending
+                # El epígrafe del artículo si ocupa su propia línea
+                line = text[match.start() : end].split("\n", 1)[0].strip()
+                if len(line) > 120:
+                    line = match.group(0).strip()
+                units.append(_Unit(start, end, dict(structure), line))
+                pending = None
+                continue
+            if pending is None:
+                pending = match.start()
+        if pending is not None:
+            units.append(_Unit(pending, len(text), dict(structure)))
+        return units
+
+    def _group(self, text: str, units: List[_Unit]) -> List[List[_Unit]]:
+        """Agrupa unidades consecutivas del mismo capítulo que caben en un chunk.
+
+        El texto previo al primer artículo (el encabezado de la norma) se une al
+        primer grupo si cabe.
+        """
+        groups: List[List[_Unit]] = []
+        size = 0
+        for unit in units:
+            length = len(text[unit.start : unit.end].strip())
+            if groups:
+                previous = groups[-1][-1]
+                same_section = not previous.structure or all(
+                    previous.structure.get(key) == unit.structure.get(key)
+                    for key in ("title", "chapter")
+                )
+                if (
+                    same_section
+                    and "article" in unit.structure
+                    and size + length + 2 <= self.chunk_size
+                ):
+                    groups[-1].append(unit)
+                    size += length + 2
+                    continue
+            groups.append([unit])
+            size = length
+        return groups
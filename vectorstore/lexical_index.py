@@ -0,0 +1,548 @@
+import json
+import math
+import os
+import re
+import shutil
+import threading
+import unicodedata
+import zlib
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from loguru import logger
+
+from vectorstore.segment_store import merge_candidates, store_lock
+
+MANIFEST_VERSION = 2
+OPEN_ATTEMPTS = 3
+
+STOPWORDS = frozenset(
+    """
+    a al algo algun alguna algunas alguno algunos ante antes aquel aquella aquellas
+    aquellos asi aun cada como con contra cual cuales cuando de del desde donde dos
+    durante e el ella ellas ellos en entre era eran es esa esas ese eso esos esta
+    estas este esto estos fue fueron ha han hasta hay la las le les lo los mas me mi
+    mis mismo muy ni no nos o os otra otras otro otros para pero por porque que
+    quien quienes se sea sean segun ser si sin sobre son su sus tal tambien te tiene
+    tienen todo todos tu u un una unas uno unos y ya
+    """.split()
+)
+
+# Números con separador de miles ("27.444") o palabras alfanuméricas
+_TOKEN = re.compile(r"\d{1,3}(?:[.,]\d{3})+|[a-z0-9]+")
+
+
+def tokenize(text: str) -> List[str]:
+    """Tokeniza un texto en español para BM25.
+
+    Pasa a minúsculas, elimina tildes y diéresis (`artículo` → `articulo`), une
+    los separadores de miles de los números (`27.444` → `27444`) y descarta las
+    palabras vacías y las letras sueltas.
+    """
+    text = unicodedata.normalize("NFKD", text.casefold())
+    text = "".join(char for char in text if not unicodedata.combining(char))
+    tokens = []
+    for token in _TOKEN.findall(text):
+        if token[0].isdigit():
+            tokens.append(token.replace(".", "").replace(",", ""))
+        elif len(token) > 1 and token not in STOPWORDS:
+            tokens.append(token)
+    return tokens
+
+
+class LexicalSegment:
+    """Segmento inmutable del índice léxico.
+
+    - `terms.json`: término → (desplazamiento, bytes, frecuencia de documento).
+    - `postings.bin`: por término, los documentos (codificados por diferencias) y
+      sus frecuencias como `uint32`, comprimidos con zlib. Se lee mapeado en memoria.
+    - `docs.json` y `lengths.npy`: id de cada documento y su longitud en tokens.
+    """
+
+    def __init__(self, folder_path: str):
+        """Abre el segmento de la carpeta indicada."""
+        self.folder_path = folder_path
+        # Número de secuencia del segmento (`seg-000012` → 12)
+        self.number = _segment_number(os.path.basename(folder_path))
+        with open(os.path.join(folder_path, "terms.json"), encoding="utf-8") as file:
+            self.terms: Dict[str, List[int]] = json.load(file)
+        with open(os.path.join(folder_path, "docs.json"), encoding="utf-8") as file:
+            self.ids: List[str] = json.load(file)
+        self.lengths = np.load(os.path.join(folder_path, "lengths.npy"))
+        path = os.path.join(folder_path, "postings.bin")
+        self._postings = (
+            np.memmap(path, dtype=np.uint8, mode="r") if os.path.getsize(path) else b""
+        )
+
+    def postings(self, term: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """Documentos y frecuencias de un término, o None si no aparece."""
+        entry = self.terms.get(term)
+        if entry is None:
+            return None
+        offset, size, df = entry
+        data = np.frombuffer(
+            zlib.decompress(bytes(self._postings[offset : offset + size])), np.uint32
+        )
+        return np.cumsum(data[:df], dtype=np.int64), data[df:]
+
+    @staticmethod
+    def write(folder_path: str, ids: List[str], token_lists: List[List[str]]) -> None:
+        """Escribe un segmento con los documentos indicados."""
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for doc, tokens in enumerate(token_lists):
+            for term, tf in Counter(tokens).items():
+                postings[term].append((doc, tf))
+        lengths = np.asarray([len(tokens) for tokens in token_lists], dtype=np.uint32)
+        _write_segment(
+            folder_path,
+            ids,
+            lengths,
+            (
+                (term, *map(np.asarray, zip(*postings[term], strict=True)))
+                for term in sorted(postings)
+            ),
+        )
+
+    @staticmethod
+    def merge(
+        folder_path: str, segments: List["LexicalSegment"], deleted: Dict[str, int]
+    ) -> int:
+        """Escribe un segmento con los documentos no eliminados de `segments`.
+
+        Las listas de documentos de cada término se concatenan renumerando los
+        documentos, sin reconstruir las frecuencias de cada documento.
+
+        Retorna:
+            int: Número de documentos del segmento escrito.
+        """
+        ids: List[str] = []
+        lengths = []
+        # Nuevo número de cada documento de cada segmento (-1 si está eliminado)
+        renumbered = []
+        for segment in segments:
+            kept = np.asarray(
+                [not _is_deleted(segment, _id, deleted) for _id in segment.ids], bool
+            )
+            numbers = np.full(len(segment.ids), -1, dtype=np.int64)
+            numbers[kept] = np.arange(len(ids), len(ids) + int(kept.sum()))
+            ids.extend(_id for _id, keep in zip(segment.ids, kept, strict=True) if keep)
+            lengths.append(segment.lengths[kept])
+            renumbered.append(numbers)
+
+        def postings() -> Iterable[Tuple[str, np.ndarray, np.ndarray]]:
+            for term in sorted(set().union(*(segment.terms for segment in segments))):
+                all_docs, all_tfs = [], []
+                for segment, numbers in zip(segments, renumbered, strict=True):
+                    found = segment.postings(term)
+                    if found is None:
+                        continue
+                    docs = numbers[found[0]]
+                    kept = docs >= 0
+                    all_docs.append(docs[kept])
+                    all_tfs.append(found[1][kept])
+                docs = np.concatenate(all_docs)
+                if len(docs):
+                    yield term, docs, np.concatenate(all_tfs)
+
+        _write_segment(
+            folder_path,
+            ids,
+            np.concatenate(lengths) if lengths else np.zeros(0, np.uint32),
+            postings(),
+        )
+        return len(ids)
+
+    def documents(self) -> Iterable[Tuple[str, Counter]]:
+        """Recorre los documentos del segmento con sus frecuencias de términos."""
+        counters = [Counter() for _ in self.ids]
+        for term in self.terms:
+            docs, tfs = self.postings(term)
+            for doc, tf in zip(docs, tfs, strict=True):
+                counters[doc][term] = int(tf)
+        return zip(self.ids, counters, strict=True)
+
+
+def _write_segment(
+    folder_path: str,
+    ids: List[str],
+    lengths: np.ndarray,
+    postings: Iterable[Tuple[str, np.ndarray, np.ndarray]],
+) -> None:
+    """Escribe un segmento a partir de las listas de cada término, en orden."""
+    temp_path = folder_path + ".tmp"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+    terms = {}
+    offset = 0
+    with open(os.path.join(temp_path, "postings.bin"), "wb") as file:
+        for term, docs, tfs in postings:
+            deltas = np.diff(docs, prepend=0).astype(np.uint32)
+            data = zlib.compress(
+                np.concatenate([deltas, np.asarray(tfs, np.uint32)]).tobytes()
+            )
+            file.write(data)
+            terms[term] = [offset, len(data), len(docs)]
+            offset += len(data)
+    with open(os.path.join(temp_path, "terms.json"), "w", encoding="utf-8") as file:
+        json.dump(terms, file, ensure_ascii=False)
+    with open(os.path.join(temp_path, "docs.json"), "w", encoding="utf-8") as file:
+        json.dump(ids, file)
+    np.save(os.path.join(temp_path, "lengths.npy"), np.asarray(lengths, np.uint32))
+    os.replace(temp_path, folder_path)
+
+
+class LexicalIndex:
+    """Índice BM25 en disco, segmentado y de solo anexado.
+
+    Se alimenta en la misma pasada de ingesta que el índice FAISS: cada lote
+    escribe un segmento nuevo (`lexical/seg-000001/`) y las eliminaciones se
+    registran como lápidas en `lexical/manifest.json`. Cada lápida guarda el
+    número del siguiente segmento al eliminar, de modo que solo oculta las copias
+    anteriores: un id eliminado puede volver a añadirse. Los segmentos se fusionan
+    en segundo plano con la misma política escalonada que los segmentos FAISS
+    (`merge_candidates`), descartando los documentos eliminados. Las estadísticas
+    de BM25 (número de documentos, longitud media y frecuencia de documento)
+    incluyen los documentos eliminados hasta la siguiente fusión.
+
+    El índice vive dentro de la carpeta del vectorstore: las fusiones toman su
+    `store_lock` para registrar el resultado y se descartan si la carpeta se ha
+    sustituido o los segmentos fusionados ya no están en el manifiesto.
+    """
+
+    def __init__(
+        self,
+        folder_path: str,
+        k1: float = 1.2,
+        b: float = 0.75,
+        max_segments: Optional[int] = None,
+        merge_factor: Optional[int] = None,
+    ):
+        """Inicializa el índice léxico de la carpeta indicada.
+
+        Parámetros:
+            folder_path (str): Carpeta del índice (`database/<nombre>/lexical`).
+            k1 (float): Saturación de la frecuencia de término de BM25.
+            b (float): Normalización por longitud de documento de BM25.
+            max_segments (Optional[int]): Segmentos a partir de los cuales se
+                fusionan los más pequeños (`VECTORSTORE_MAX_SEGMENTS`).
+            merge_factor (Optional[int]): Segmentos de un mismo escalón de tamaño
+                que se fusionan (`VECTORSTORE_MERGE_FACTOR`).
+        """
+        self.folder_path = folder_path
+        self.k1 = k1
+        self.b = b
+        self.max_segments = max_segments or int(
+            os.getenv("VECTORSTORE_MAX_SEGMENTS", "16")
+        )
+        self.merge_factor = merge_factor or int(
+            os.getenv("VECTORSTORE_MERGE_FACTOR", "4")
+        )
+        self._lock = threading.RLock()
+        self._compaction: Optional[threading.Thread] = None
+        for attempt in range(OPEN_ATTEMPTS):
+            self._manifest = self._read_manifest()
+            self._deleted = _tombstones(self._manifest)
+            try:
+                self._segments = [
+                    LexicalSegment(self._segment_path(segment["name"]))
+                    for segment in self._manifest["segments"]
+                ]
+                break
+            except FileNotFoundError:
+                # Una fusión ha eliminado los segmentos del manifiesto leído
+                if attempt == OPEN_ATTEMPTS - 1:
+                    raise
+
+    @property
+    def manifest_path(self) -> str:
+        """Ruta del manifiesto del índice léxico."""
+        return os.path.join(self.folder_path, "manifest.json")
+
+    def exists(self) -> bool:
+        """Indica si el índice está guardado en disco."""
+        return os.path.exists(self.manifest_path)
+
+    def __len__(self) -> int:
+        """Número de documentos no eliminados."""
+        with self._lock:
+            segments, deleted = self._segments, self._deleted
+        return sum(
+            sum(1 for _id in segment.ids if not _is_deleted(segment, _id, deleted))
+            for segment in segments
+        )
+
+    def add(self, ids: List[str], texts: List[str]) -> None:
+        """Indexa un lote de documentos como un segmento nuevo."""
+        if not ids:
+            return
+        token_lists = [tokenize(text) for text in texts]
+        with self._lock:
+            # Una fusión de otra instancia (anterior a recargar) puede haber
+            # cambiado el manifiesto
+            self._refresh()
+            number = self._manifest["next_segment"]
+            self._manifest["next_segment"] = number + 1
+            name = f"seg-{number:06d}"
+            LexicalSegment.write(self._segment_path(name), ids, token_lists)
+            self._manifest["segments"].append({"name": name, "docs": len(ids)})
+            self._segments = [*self._segments, LexicalSegment(self._segment_path(name))]
+            self._write_manifest()
+            pending = self._tiered_candidates(self._manifest["segments"])
+        if pending:
+            self.compact_in_background(full=False)
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Registra lápidas para los documentos indicados."""
+        with self._lock:
+            self._refresh()
+            sequence = self._manifest["next_segment"]
+            self._deleted = {**self._deleted, **dict.fromkeys(ids, sequence)}
+            self._manifest["deleted"] = self._deleted
+            self._write_manifest()
+
+    def search(self, query: str, k: int) -> List[Tuple[str, float]]:
+        """Devuelve los ids y puntuaciones BM25 de los `k` mejores documentos."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        with self._lock:
+            segments = self._segments
+            deleted = self._deleted
+        if not terms or not segments:
+            return []
+
+        n_docs = sum(len(segment.ids) for segment in segments)
+        avgdl = max(sum(float(s.lengths.sum()) for s in segments) / n_docs, 1.0)
+        postings = [[segment.postings(term) for term in terms] for segment in segments]
+        df = [
+            sum(len(p[i][0]) for p in postings if p[i] is not None)
+            for i in range(len(terms))
+        ]
+        idf = [math.log(1 + (n_docs - d + 0.5) / (d + 0.5)) for d in df]
+
+        candidates: List[Tuple[float, str]] = []
+        for segment, segment_postings in zip(segments, postings, strict=True):
+            scores = np.zeros(len(segment.ids), dtype=np.float32)
+            norm = self.k1 * (1 - self.b + self.b * segment.lengths / avgdl)
+            for term_idf, found in zip(idf, segment_postings, strict=True):
+                if found is None:
+                    continue
+                docs, tfs = found
+                scores[docs] += term_idf * tfs * (self.k1 + 1) / (tfs + norm[docs])
+            matched = np.flatnonzero(scores)
+            # Reservar sitio para los documentos eliminados que haya que descartar
+            top = min(len(matched), k + len(deleted))
+            best = (
+                matched[np.argpartition(-scores[matched], top - 1)[:top]] if top else []
+            )
+            candidates.extend(
+                (float(scores[doc]), segment.ids[doc])
+                for doc in best
+                if not _is_deleted(segment, segment.ids[doc], deleted)
+            )
+        candidates.sort(key=lambda item: -item[0])
+        return [(_id, score) for score, _id in candidates[:k]]
+
+    def compact(self, full: bool = True) -> bool:
+        """Fusiona segmentos en uno, descartando los documentos eliminados.
+
+        La fusión se escribe sin retener el bloqueo del índice, de modo que la
+        ingesta y las búsquedas continúan mientras dura.
+
+        Parámetros:
+            full (bool): Si es True, se fusionan todos los segmentos; si no, solo
+                los de un escalón de tamaño lleno.
+
+        Retorna:
+            bool: True si se ha compactado, False si no había nada que compactar.
+        """
+        with store_lock(self._store_path), self._lock:
+            self._refresh()
+            names = [segment["name"] for segment in self._manifest["segments"]]
+            if full:
+                chosen = names if len(names) > 1 or self._deleted else []
+            else:
+                chosen = [
+                    segment["name"]
+                    for segment in self._tiered_candidates(self._manifest["segments"])
+                ]
+            if not chosen:
+                return False
+            segments = [self._segments[names.index(name)] for name in chosen]
+            deleted = dict(self._deleted)
+            number = self._manifest["next_segment"]
+            self._manifest["next_segment"] = number + 1
+            self._write_manifest()
+            # La carpeta en que se escribe la fusión, aunque se sustituya
+            folder = os.path.realpath(self.folder_path)
+
+        name = f"seg-{number:06d}"
+        docs = LexicalSegment.merge(os.path.join(folder, name), segments, deleted)
+
+        with store_lock(self._store_path), self._lock:
+            self._refresh()
+            names = [segment["name"] for segment in self._manifest["segments"]]
+            if os.path.realpath(self.folder_path) != folder or not set(chosen) <= set(
+                names
+            ):
+                # Carpeta sustituida o índice vaciado mientras se fusionaba
+                logger.warning(f"Fusión de '{self.folder_path}' descartada")
+                shutil.rmtree(os.path.join(folder, name), ignore_errors=True)
+                return False
+            remaining = [
+                segment
+                for segment in self._manifest["segments"]
+                if segment["name"] not in chosen
+            ]
+            self._manifest["segments"] = [{"name": name, "docs": docs}, *remaining]
+            # Una lápida ya aplicada se conserva si aún afecta a otro segmento
+            oldest = min(
+                (
+                    _segment_number(s["name"])
+                    for s in remaining
+                    if _segment_number(s["name"]) < number
+                ),
+                default=None,
+            )
+            self._deleted = {
+                _id: seq
+                for _id, seq in self._deleted.items()
+                if deleted.get(_id) != seq or (oldest is not None and oldest < seq)
+            }
+            self._manifest["deleted"] = self._deleted
+            # Los segmentos fusionados se borran en la siguiente fusión: quien haya
+            # leído el manifiesto anterior aún puede abrirlos
+            retired = self._manifest.get("retired", [])
+            self._manifest["retired"] = chosen
+            self._write_manifest()
+            by_name = {os.path.basename(s.folder_path): s for s in self._segments}
+            self._segments = [
+                by_name.get(s["name"]) or LexicalSegment(self._segment_path(s["name"]))
+                for s in self._manifest["segments"]
+            ]
+            for segment_name in retired:
+                shutil.rmtree(self._segment_path(segment_name), ignore_errors=True)
+        return True
+
+    def compact_in_background(self, full: bool = True) -> threading.Thread:
+        """Lanza la compactación (ver `compact`) en un hilo si no hay otra en curso."""
+        with self._lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(
+                    target=self._compact_safely,
+                    args=(full,),
+                    name="lexical-compaction",
+                    daemon=True,
+                )
+                self._compaction.start()
+            return self._compaction
+
+    def wait_for_compaction(self) -> None:
+        """Espera a que termine la compactación en segundo plano, si hay una."""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def _compact_safely(self, full: bool) -> None:
+        try:
+            # Una fusión escalonada puede llenar el escalón siguiente
+            while self.compact(full) and not full:
+                pass
+        except Exception as e:
+            logger.error(f"Error al fusionar '{self.folder_path}': {e}")
+
+    @property
+    def _store_path(self) -> str:
+        """Carpeta del vectorstore, cuyo `store_lock` protege el índice."""
+        return os.path.dirname(os.path.abspath(self.folder_path))
+
+    def _refresh(self) -> None:
+        """Vuelve a leer el manifiesto si otro proceso lo ha cambiado."""
+        manifest = self._read_manifest()
+        if manifest == self._manifest:
+            return
+        self._manifest = manifest
+        self._deleted = _tombstones(manifest)
+        by_name = {os.path.basename(s.folder_path): s for s in self._segments}
+        self._segments = [
+            by_name.get(s["name"]) or LexicalSegment(self._segment_path(s["name"]))
+            for s in manifest["segments"]
+        ]
+
+    def _tiered_candidates(self, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Segmentos que fusiona la compactación escalonada."""
+        chosen = merge_candidates(
+            [segment["docs"] for segment in segments],
+            self.merge_factor,
+            overflowing=len(segments) > self.max_segments,
+        )
+        return [segments[i] for i in chosen]
+
+    def rebuild(self, ids: List[str], texts: List[str]) -> None:
+        """Reconstruye el índice desde cero con los documentos indicados."""
+        with self._lock:
+            self.clear()
+            self.add(ids, texts)
+
+    def clear(self) -> None:
+        """Elimina todos los segmentos del índice."""
+        with self._lock:
+            shutil.rmtree(self.folder_path, ignore_errors=True)
+            self._manifest = self._read_manifest()
+            self._deleted = {}
+            self._segments = []
+
+    def _read_manifest(self) -> Dict[str, Any]:
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as file:
+                return json.load(file)
+        return {
+            "version": MANIFEST_VERSION,
+            "next_segment": 1,
+            "segments": [],
+            "deleted": {},
+        }
+
+    def _write_manifest(self) -> None:
+        os.makedirs(self.folder_path, exist_ok=True)
+        # Las lápidas se escriben siempre en el formato actual
+        self._manifest["version"] = MANIFEST_VERSION
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(self._manifest, file)
+        os.replace(temp_path, self.manifest_path)
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.folder_path, name)
+
+
+def reciprocal_rank_fusion(
+    rankings: List[List[Tuple[str, float]]], k: int, rrf_k: int = 60
+) -> List[Tuple[str, float]]:
+    """Fusiona varias clasificaciones con Reciprocal Rank Fusion.
+
+    Cada documento suma `1 / (rrf_k + rango)` por cada clasificación en la que
+    aparece; no hace falta que las puntuaciones sean comparables entre sí.
+    """
+    fused: Dict[str, float] = defaultdict(float)
+    for ranking in rankings:
+        for rank, (_id, _) in enumerate(ranking, start=1):
+            fused[_id] += 1 / (rrf_k + rank)
+    return sorted(fused.items(), key=lambda item: -item[1])[:k]
+
+
+def _tombstones(manifest: Dict[str, Any]) -> Dict[str, int]:
+    """Lápidas del manifiesto: id → primer segmento que no ocultan."""
+    deleted = manifest["deleted"]
+    if isinstance(deleted, list):
+        # Versión 1: las lápidas ocultan todos los segmentos existentes
+        return dict.fromkeys(deleted, manifest["next_segment"])
+    return dict(deleted)
+
+
+def _segment_number(name: str) -> int:
+    return int(name.rsplit("-", 1)[1])
+
+
+def _is_deleted(segment: LexicalSegment, _id: str, deleted: Dict[str, int]) -> bool:
+    """Indica si la copia de un documento en un segmento está eliminada."""
+    return deleted.get(_id, 0) > segment.number
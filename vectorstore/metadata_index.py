@@ -0,0 +1,91 @@
+import os
+from collections import defaultdict
+from typing import Any, Dict, Hashable, List, Optional, Tuple, Union
+
+import numpy as np
+from langchain_community.vectorstores import FAISS as FAISS_STORE
+
+Filter = Optional[Union[str, Dict[str, Any]]]
+
+
+class MetadataIndex:
+    """Índice invertido de metadatos: (campo, valor) → posiciones en el índice FAISS.
+
+    Se mantiene durante la ingesta y permite restringir una búsqueda filtrada al
+    subconjunto de vectores que cumple el filtro, en lugar de recuperar candidatos
+    de todo el índice y descartarlos después. Los campos indexados se configuran con
+    `METADATA_INDEX_FIELDS` (por defecto solo `source`).
+
+    Las posiciones son las de `index_to_docstore_id`; al eliminar documentos el
+    índice FAISS se renumera, por lo que el índice de metadatos debe reconstruirse.
+    """
+
+    def __init__(self, fields: Optional[List[str]] = None):
+        """Inicializa el índice con los campos de metadatos a indexar."""
+        if fields is None:
+            fields = os.getenv("METADATA_INDEX_FIELDS", "source").split(",")
+        self.fields = [field.strip() for field in fields if field.strip()]
+        self._postings: Dict[str, Dict[Hashable, List[int]]] = {
+            field: defaultdict(list) for field in self.fields
+        }
+
+    def add(self, metadatas: List[Dict[str, Any]], start: int) -> None:
+        """Registra los metadatos de vectores añadidos a partir de `start`."""
+        for offset, metadata in enumerate(metadatas):
+            for field in self.fields:
+                value = metadata.get(field)
+                if value is not None:
+                    self._postings[field][value].append(start + offset)
+
+    def rebuild(self, vectorstore: FAISS_STORE) -> None:
+        """Reconstruye el índice a partir del docstore del vectorstore."""
+        self.clear()
+        docstore = vectorstore.docstore
+        for position, _id in sorted(vectorstore.index_to_docstore_id.items()):
+            self.add([docstore.search(_id).metadata], position)
+
+    def clear(self) -> None:
+        """Vacía el índice."""
+        for postings in self._postings.values():
+            postings.clear()
+
+    def values(self, field: str) -> List[Hashable]:
+        """Valores distintos de un campo indexado."""
+        return list(self._postings[field])
+
+    def select(self, filtro: Dict[str, Any]) -> Optional[np.ndarray]:
+        """Posiciones que cumplen todas las condiciones del filtro.
+
+        Retorna:
+            Optional[np.ndarray]: Posiciones ordenadas (int64), o None si algún campo
+                del filtro no está indexado.
+        """
+        if any(field not in self._postings for field in filtro):
+            return None
+        selected = None
+        for field, value in filtro.items():
+            positions = np.asarray(self._postings[field].get(value, []), dtype=np.int64)
+            selected = (
+                positions
+                if selected is None
+                else np.intersect1d(selected, positions, assume_unique=True)
+            )
+            if not len(selected):
+                break
+        return selected
+
+
+def normalize_filter(filtro: Filter) -> Optional[Dict[str, Any]]:
+    """Convierte un filtro por fuente (`str`) en un filtro por campos."""
+    if not filtro:
+        return None
+    if isinstance(filtro, str):
+        return {"source": filtro}
+    return dict(filtro)
+
+
+def filter_key(filtro: Optional[Dict[str, Any]]) -> Optional[Tuple]:
+    """Clave hashable de un filtro, para agrupar consultas y para la caché."""
+    if filtro is None:
+        return None
+    return tuple(sorted(filtro.items()))
@@ -0,0 +1,210 @@
+import json
+import os
+import shutil
+from collections.abc import Mapping
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, Optional, Union
+
+import faiss
+import numpy as np
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores import FAISS as FAISS_STORE
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+SNAPSHOT_VERSION = 1
+
+# Los índices IVF mapean sus listas invertidas; los planos y HNSW, sus vectores.
+# FAISS no admite combinar ambas opciones en un mismo índice.
+IVF_MMAP_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY
+FLAT_MMAP_FLAGS = getattr(faiss, "IO_FLAG_MMAP_IFC", 0) | faiss.IO_FLAG_READ_ONLY
+
+
+class MmapDocstore(Docstore):
+    """Docstore de solo lectura sobre archivos columnares mapeados en memoria.
+
+    Los textos y los metadatos (JSON) de los chunks se guardan concatenados en
+    `texts.bin` y `metadata.bin`, con un array de desplazamientos por columna; los
+    ids se guardan como un array de ancho fijo en orden de posición y una copia
+    ordenada para buscarlos por bisección. Abrirlo no lee el contenido: las páginas
+    se cargan bajo demanda y se comparten entre procesos a través de la caché de
+    páginas del sistema operativo.
+    """
+
+    def __init__(self, folder_path: str):
+        """Abre los archivos del docstore de la carpeta indicada."""
+        self.folder_path = folder_path
+        self.ids = _load_array(folder_path, "ids.npy")
+        self._ids_sorted = _load_array(folder_path, "ids_sorted.npy")
+        self._rows_sorted = _load_array(folder_path, "ids_sorted_rows.npy")
+        self._texts = _map_bytes(os.path.join(folder_path, "texts.bin"))
+        self._text_offsets = _load_array(folder_path, "text_offsets.npy")
+        self._metadata = _map_bytes(os.path.join(folder_path, "metadata.bin"))
+        self._metadata_offsets = _load_array(folder_path, "metadata_offsets.npy")
+
+    def __len__(self) -> int:
+        """Número de documentos."""
+        return len(self.ids)
+
+    def row(self, _id: str) -> Optional[int]:
+        """Fila (posición en el índice) de un id, o None si no existe."""
+        key = np.bytes_(_id.encode("utf-8"))
+        i = int(np.searchsorted(self._ids_sorted, key))
+        if i < len(self._ids_sorted) and self._ids_sorted[i] == key:
+            return int(self._rows_sorted[i])
+        return None
+
+    def document(self, row: int) -> Document:
+        """Documento de la fila indicada."""
+        text = _slice(self._texts, self._text_offsets, row).decode("utf-8")
+        metadata = json.loads(_slice(self._metadata, self._metadata_offsets, row))
+        return Document(
+            id=self.ids[row].decode("utf-8"), page_content=text, metadata=metadata
+        )
+
+    def search(self, search: str) -> Union[str, Document]:
+        """Busca un documento por id (igual que `InMemoryDocstore.search`)."""
+        row = self.row(search)
+        if row is None:
+            return f"ID {search} not found."
+        return self.document(row)
+
+
+class LazyIdMapping(Mapping):
+    """`index_to_docstore_id` de solo lectura que lee cada id del array mapeado."""
+
+    def __init__(self, ids: np.ndarray):
+        """Inicializa el mapeo sobre el array de ids en orden de posición."""
+        self._ids = ids
+
+    def __getitem__(self, position: int) -> str:
+        """Id del documento en la posición indicada del índice."""
+        if not 0 <= position < len(self._ids):
+            raise KeyError(position)
+        return self._ids[position].decode("utf-8")
+
+    def __iter__(self) -> Iterator[int]:
+        """Posiciones del índice."""
+        return iter(range(len(self._ids)))
+
+    def __len__(self) -> int:
+        """Número de posiciones."""
+        return len(self._ids)
+
+
+def write_snapshot(
+    vectorstore: FAISS_STORE, folder_path: str, store_version: str
+) -> None:
+    """Escribe una instantánea de solo lectura del vectorstore.
+
+    La instantánea se escribe en una carpeta temporal y se publica con un
+    renombrado, de modo que los procesos que la abren nunca ven una a medias.
+
+    Parámetros:
+        vectorstore (FAISS_STORE): Vectorstore a exportar.
+        folder_path (str): Carpeta de la instantánea.
+        store_version (str): Versión del vectorstore exportada
+            (`SegmentStore.version`: id del vectorstore y generación).
+    """
+    temp_path = f"{folder_path}.tmp-{os.getpid()}"
+    shutil.rmtree(temp_path, ignore_errors=True)
+    os.makedirs(temp_path)
+
+    faiss.write_index(vectorstore.index, os.path.join(temp_path, "index.faiss"))
+    ids = [vectorstore.index_to_docstore_id[p] for p in range(vectorstore.index.ntotal)]
+    text_offsets = [0]
+    metadata_offsets = [0]
+    with (
+        open(os.path.join(temp_path, "texts.bin"), "wb") as texts,
+        open(os.path.join(temp_path, "metadata.bin"), "wb") as metadata,
+    ):
+        for _id in ids:
+            document = vectorstore.docstore.search(_id)
+            text_offsets.append(
+                text_offsets[-1] + texts.write(document.page_content.encode("utf-8"))
+            )
+            metadata_offsets.append(
+                metadata_offsets[-1]
+                + metadata.write(
+                    json.dumps(document.metadata, ensure_ascii=False).encode("utf-8")
+                )
+            )
+
+    id_array = np.array([_id.encode("utf-8") for _id in ids], dtype=np.bytes_)
+    order = np.argsort(id_array, kind="stable")
+    np.save(os.path.join(temp_path, "ids.npy"), id_array)
+    np.save(os.path.join(temp_path, "ids_sorted.npy"), id_array[order])
+    np.save(os.path.join(temp_path, "ids_sorted_rows.npy"), order.astype(np.int64))
+    np.save(
+        os.path.join(temp_path, "text_offsets.npy"), np.asarray(text_offsets, np.int64)
+    )
+    np.save(
+        os.path.join(temp_path, "metadata_offsets.npy"),
+        np.asarray(metadata_offsets, np.int64),
+    )
+    with open(os.path.join(temp_path, "meta.json"), "w", encoding="utf-8") as file:
+        json.dump(
+            {
+                "version": SNAPSHOT_VERSION,
+                "store_version": store_version,
+                "count": len(ids),
+                "ivf": faiss.try_extract_index_ivf(vectorstore.index) is not None,
+                "created_at": datetime.now(timezone.utc).isoformat(),
+            },
+            file,
+        )
+
+    old_path = f"{folder_path}.old-{os.getpid()}"
+    if os.path.exists(folder_path):
+        os.replace(folder_path, old_path)
+    try:
+        os.replace(temp_path, folder_path)
+    except OSError:
+        # Otro proceso ha publicado una instantánea al mismo tiempo
+        shutil.rmtree(temp_path, ignore_errors=True)
+    # Los procesos que aún tienen mapeados los archivos antiguos siguen pudiendo leerlos
+    shutil.rmtree(old_path, ignore_errors=True)
+
+
+def snapshot_version(folder_path: str) -> Optional[str]:
+    """Versión del vectorstore exportada en la instantánea, o None si no existe."""
+    try:
+        return _read_meta(folder_path)["store_version"]
+    except (FileNotFoundError, json.JSONDecodeError, KeyError):
+        return None
+
+
+def load_snapshot(
+    folder_path: str, embeddings: Embeddings, **store_kwargs: Any
+) -> FAISS_STORE:
+    """Abre una instantánea mapeando en memoria el índice y el docstore."""
+    flags = IVF_MMAP_FLAGS if _read_meta(folder_path).get("ivf") else FLAT_MMAP_FLAGS
+    index = faiss.read_index(os.path.join(folder_path, "index.faiss"), flags)
+    docstore = MmapDocstore(folder_path)
+    return FAISS_STORE(
+        embedding_function=embeddings,
+        index=index,
+        docstore=docstore,
+        index_to_docstore_id=LazyIdMapping(docstore.ids),
+        **store_kwargs,
+    )
+
+
+def _read_meta(folder_path: str) -> Dict[str, Any]:
+    with open(os.path.join(folder_path, "meta.json"), encoding="utf-8") as file:
+        return json.load(file)
+
+
+def _load_array(folder_path: str, name: str) -> np.ndarray:
+    return np.load(os.path.join(folder_path, name), mmap_mode="r")
+
+
+def _map_bytes(path: str) -> Union[np.memmap, bytes]:
+    # np.memmap no admite archivos vacíos
+    if os.path.getsize(path) == 0:
+        return b""
+    return np.memmap(path, dtype=np.uint8, mode="r")
+
+
+def _slice(data: Union[np.memmap, bytes], offsets: np.ndarray, row: int) -> bytes:
+    return bytes(data[int(offsets[row]) : int(offsets[row + 1])])
@@ -0,0 +1,137 @@
+import hashlib
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Hashable, List, Optional, Tuple
+
+import numpy as np
+
+_MISSING = object()
+
+
+@dataclass
+class LRUStats:
+    """Aciertos y fallos de una caché LRU."""
+
+    hits: int = 0
+    misses: int = 0
+
+    @property
+    def hit_rate(self) -> float:
+        """Proporción de consultas servidas desde la caché."""
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+
+class TTLCache:
+    """Caché LRU en memoria con caducidad por tiempo y segura entre hilos."""
+
+    def __init__(self, max_size: int, ttl: float):
+        """Inicializa la caché con un tamaño máximo y un TTL en segundos."""
+        self.max_size = max_size
+        self.ttl = ttl
+        self.stats = LRUStats()
+        self._data: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> Any:
+        """Devuelve el valor guardado o None si no existe o ha caducado."""
+        with self._lock:
+            value, expires_at = self._data.get(key, (_MISSING, 0.0))
+            if value is _MISSING or expires_at < time.monotonic():
+                self._data.pop(key, None)
+                self.stats.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def put(self, key: Hashable, value: Any) -> None:
+        """Guarda un valor, desalojando el usado hace más tiempo si no cabe."""
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + self.ttl)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        """Vacía la caché."""
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self) -> int:
+        """Número de entradas guardadas (incluidas las caducadas aún no purgadas)."""
+        return len(self._data)
+
+
+class QueryCache:
+    """Caché de dos niveles para `search_similarity`.
+
+    - Nivel 1: texto normalizado de la consulta → embedding de la consulta.
+    - Nivel 2: (embedding, k, filtro, versión del índice) → ids del top-k.
+
+    Una consulta repetida evita tanto el modelo de embeddings como la búsqueda en
+    FAISS. La versión del índice forma parte de la clave del segundo nivel, de modo
+    que cualquier cambio en el vectorstore invalida los resultados guardados.
+    """
+
+    def __init__(
+        self,
+        max_queries: Optional[int] = None,
+        max_results: Optional[int] = None,
+        ttl: Optional[float] = None,
+    ):
+        """Inicializa ambos niveles (`QUERY_CACHE_SIZE`, `QUERY_CACHE_TTL`)."""
+        size = int(os.getenv("QUERY_CACHE_SIZE", "1024"))
+        ttl = ttl or float(os.getenv("QUERY_CACHE_TTL", "3600"))
+        self.vectors = TTLCache(max_queries or size, ttl)
+        self.results = TTLCache(max_results or size, ttl)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        """Normaliza la consulta para que variantes triviales compartan entrada."""
+        query = unicodedata.normalize("NFKC", query).casefold()
+        query = re.sub(r"\s+", " ", query)
+        return query.strip(" ¿?¡!.,;:")
+
+    def get_vector(self, query: str) -> Optional[List[float]]:
+        """Embedding guardado de la consulta normalizada."""
+        return self.vectors.get(self.normalize(query))
+
+    def put_vector(self, query: str, vector: List[float]) -> None:
+        """Guarda el embedding de la consulta normalizada."""
+        self.vectors.put(self.normalize(query), vector)
+
+    def get_results(
+        self, vector: List[float], k: int, filtro: Optional[Hashable], version: int
+    ) -> Optional[List[Tuple[str, float]]]:
+        """Ids y puntuaciones del top-k guardados para la búsqueda."""
+        return self.results.get(self._results_key(vector, k, filtro, version))
+
+    def put_results(
+        self,
+        vector: List[float],
+        k: int,
+        filtro: Optional[Hashable],
+        version: int,
+        results: List[Tuple[str, float]],
+    ) -> None:
+        """Guarda los ids y puntuaciones del top-k de la búsqueda."""
+        self.results.put(self._results_key(vector, k, filtro, version), results)
+
+    def invalidate(self) -> None:
+        """Descarta los resultados; los embeddings de consultas siguen siendo válidos."""
+        self.results.clear()
+
+    @staticmethod
+    def _results_key(
+        vector: List[float], k: int, filtro: Optional[Hashable], version: int
+    ) -> Tuple:
+        digest = hashlib.blake2b(
+            np.asarray(vector, dtype=np.float32).tobytes(), digest_size=16
+        ).hexdigest()
+        return digest, k, filtro, version
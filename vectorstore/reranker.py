@@ -0,0 +1,277 @@
+import math
+import os
+import threading
+import time
+from dataclasses import dataclass, replace
+from typing import Any, List, Optional, Protocol, Sequence, Tuple
+
+import numpy as np
+from loguru import logger
+
+from telemetry.instruments import RERANK_PAIRS, RERANK_SKIPPED, record_cache
+from telemetry.tracing import span
+from vectorstore.query_cache import QueryCache, TTLCache
+from vectorstore.search_result import SearchResult
+
+
+class PairScorer(Protocol):
+    """Modelo que puntúa pares (consulta, texto), como `CrossEncoder`."""
+
+    def predict(self, sentences: List[Tuple[str, str]], **kwargs: Any) -> Any:
+        """Puntuación de relevancia de cada par."""
+
+
+@dataclass
+class RerankStats:
+    """Uso acumulado del re-ranker."""
+
+    queries: int = 0
+    pairs: int = 0
+    cached_pairs: int = 0
+    skipped: int = 0
+    seconds: float = 0.0
+
+    @property
+    def pairs_per_second(self) -> float:
+        """Pares puntuados por segundo por el modelo."""
+        return self.pairs / self.seconds if self.seconds else 0.0
+
+
+class Reranker:
+    """Segunda etapa de recuperación con un cross-encoder en CPU.
+
+    La búsqueda en FAISS recupera `candidates` chunks por consulta (barata pero
+    aproximada) y el cross-encoder, que lee la consulta y el chunk juntos, los
+    vuelve a puntuar. Solo pasan al LLM los mejores: como máximo `k`, y solo los
+    que superan `min_score` y `relative_score` veces la puntuación del mejor, de
+    modo que las consultas con pocos chunks relevantes envían menos contexto.
+
+    - Los pares de todas las consultas de un lote se puntúan juntos, ordenados
+      por longitud y en lotes de `batch_size`, como en `EmbeddingEngine`.
+    - Las puntuaciones se guardan en una caché LRU por (consulta normalizada, id
+      del chunk); los ids de chunk son deterministas (`chunk_id`).
+    - Con `budget_ms`, si el coste estimado (pares pendientes en otras peticiones
+      más los nuevos, por el tiempo medio por par) no cabe en el presupuesto, se
+      re-puntúan solo los mejores candidatos que quepan; si no caben ni `k`, se
+      omite el re-ranking y se devuelve el orden de FAISS.
+
+    Con una sola etiqueta, `CrossEncoder` aplica una sigmoide y devuelve
+    puntuaciones en [0, 1], la escala de `min_score`. El modelo se carga en el
+    primer uso.
+    """
+
+    def __init__(
+        self,
+        model: Optional[PairScorer] = None,
+        model_name: Optional[str] = None,
+        enabled: Optional[bool] = None,
+        candidates: Optional[int] = None,
+        batch_size: Optional[int] = None,
+        min_score: Optional[float] = None,
+        relative_score: Optional[float] = None,
+        budget_ms: Optional[float] = None,
+        cache_size: Optional[int] = None,
+    ):
+        """Inicializa el re-ranker.
+
+        Parámetros:
+            model (Optional[PairScorer]): Modelo ya cargado (p. ej. un modelo de
+                prueba); por defecto, un `CrossEncoder` de `model_name`.
+            model_name (Optional[str]): Modelo de SentenceTransformers
+                (`RERANK_MODEL`).
+            enabled (Optional[bool]): Si es False, `rerank` solo recorta a `k`
+                (`RERANK`, desactivado por defecto).
+            candidates (Optional[int]): Candidatos por consulta que se piden a
+                FAISS (`RERANK_CANDIDATES`).
+            batch_size (Optional[int]): Pares por lote del modelo
+                (`RERANK_BATCH_SIZE`).
+            min_score (Optional[float]): Puntuación mínima (`RERANK_MIN_SCORE`).
+            relative_score (Optional[float]): Fracción de la mejor puntuación por
+                debajo de la cual se descarta un chunk (`RERANK_RELATIVE_SCORE`).
+            budget_ms (Optional[float]): Presupuesto de latencia por lote
+                (`RERANK_BUDGET_MS`); 0 sin límite.
+            cache_size (Optional[int]): Puntuaciones guardadas
+                (`RERANK_CACHE_SIZE`).
+        """
+        self.model_name = model_name or os.getenv(
+            "RERANK_MODEL", "cross-encoder/mmarco-mMiniLMv2-L12-H384-v1"
+        )
+        if enabled is None:
+            enabled = model is not None or os.getenv("RERANK", "0") == "1"
+        self.enabled = enabled
+        self.candidates = candidates or int(os.getenv("RERANK_CANDIDATES", "30"))
+        self.batch_size = batch_size or int(os.getenv("RERANK_BATCH_SIZE", "32"))
+        self.min_score = (
+            min_score
+            if min_score is not None
+            else float(os.getenv("RERANK_MIN_SCORE", "0.05"))
+        )
+        self.relative_score = (
+            relative_score
+            if relative_score is not None
+            else float(os.getenv("RERANK_RELATIVE_SCORE", "0.3"))
+        )
+        self.budget = (
+            budget_ms
+            if budget_ms is not None
+            else float(os.getenv("RERANK_BUDGET_MS", "0"))
+        ) / 1000
+        self.cache = TTLCache(
+            cache_size or int(os.getenv("RERANK_CACHE_SIZE", "10000")),
+            float(os.getenv("RERANK_CACHE_TTL", "86400")),
+        )
+        self.stats = RerankStats()
+        self._model = model
+        self._lock = threading.Lock()
+        # Media móvil del tiempo por par y pares en curso, para el presupuesto
+        self._seconds_per_pair = 0.0
+        self._inflight = 0
+
+    @property
+    def model(self) -> PairScorer:
+        """Cross-encoder, cargado en el primer uso."""
+        if self._model is None:
+            with self._lock:
+                if self._model is None:
+                    # SentenceTransformers tarda segundos en importarse
+                    from sentence_transformers import CrossEncoder
+
+                    logger.info(f"Cargando el re-ranker {self.model_name}")
+                    self._model = CrossEncoder(self.model_name, device="cpu")
+        return self._model
+
+    def fetch_k(self, k: int) -> int:
+        """Resultados que hay que pedir a la búsqueda para devolver `k`."""
+        return max(k, self.candidates) if self.enabled else k
+
+    def rerank(
+        self, query: str, results: List[SearchResult], k: int
+    ) -> List[SearchResult]:
+        """Re-puntúa los candidatos de una consulta y devuelve los mejores."""
+        return self.rerank_batch([query], [results], k)[0]
+
+    def rerank_batch(
+        self, queries: List[str], candidates: List[List[SearchResult]], k: int
+    ) -> List[List[SearchResult]]:
+        """Re-puntúa los candidatos de varias consultas con una sola pasada.
+
+        Parámetros:
+            queries (List[str]): Consultas.
+            candidates (List[List[SearchResult]]): Candidatos de cada consulta,
+                de mejor a peor según la primera etapa.
+            k (int): Máximo de resultados por consulta.
+
+        Retorna:
+            List[List[SearchResult]]: Los resultados de cada consulta, ordenados
+            por la puntuación del cross-encoder (o los `k` primeros candidatos si
+            el re-ranking está desactivado u omitido).
+        """
+        if not self.enabled or not any(candidates):
+            return [found[:k] for found in candidates]
+
+        with span("rerank", queries=len(queries)) as current:
+            keys = [QueryCache.normalize(query) for query in queries]
+            limit = self._affordable(len(queries))
+            if limit is not None:
+                if limit < min(k, max(len(found) for found in candidates)):
+                    RERANK_SKIPPED.inc()
+                    with self._lock:
+                        self.stats.skipped += 1
+                    current.set("skipped", True)
+                    return [found[:k] for found in candidates]
+                candidates = [found[:limit] for found in candidates]
+
+            scores: List[List[Optional[float]]] = [
+                [self.cache.get((key, result.id)) for result in found]
+                for key, found in zip(keys, candidates, strict=True)
+            ]
+            pending = [
+                (i, j)
+                for i, row in enumerate(scores)
+                for j, score in enumerate(row)
+                if score is None
+            ]
+            cached = sum(len(row) for row in scores) - len(pending)
+            record_cache("rerank", cached, len(pending))
+            RERANK_PAIRS.labels("cached").inc(cached)
+            current.set("pairs", len(pending))
+            current.set("cached_pairs", cached)
+            if pending:
+                pairs = [(queries[i], candidates[i][j].content) for i, j in pending]
+                for (i, j), score in zip(pending, self._score(pairs), strict=True):
+                    scores[i][j] = score
+                    self.cache.put((keys[i], candidates[i][j].id), score)
+            with self._lock:
+                self.stats.queries += len(queries)
+                self.stats.cached_pairs += cached
+            # Una consulta sin candidatos (p. ej. por un filtro) no tiene resultados
+            return [
+                self._select(found, row, k) if found else []
+                for found, row in zip(candidates, scores, strict=True)
+            ]
+
+    def _affordable(self, n_queries: int) -> Optional[int]:
+        """Candidatos por consulta que caben en el presupuesto, o None sin límite."""
+        if not self.budget or not self._seconds_per_pair:
+            return None
+        with self._lock:
+            capacity = self.budget / self._seconds_per_pair - self._inflight
+        return max(0, math.floor(capacity / n_queries))
+
+    def _score(self, pairs: List[Tuple[str, str]]) -> List[float]:
+        """Puntúa los pares en lotes agrupados por longitud."""
+        with self._lock:
+            self._inflight += len(pairs)
+        start = time.perf_counter()
+        try:
+            lengths = np.fromiter(
+                (len(q) + len(t) for q, t in pairs), np.int64, len(pairs)
+            )
+            order = np.argsort(-lengths, kind="stable")
+            raw = np.asarray(
+                self.model.predict(
+                    [pairs[i] for i in order],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                ),
+                dtype=np.float32,
+            ).reshape(-1)
+            scores = np.empty_like(raw)
+            scores[order] = raw
+        finally:
+            seconds = time.perf_counter() - start
+            with self._lock:
+                self._inflight -= len(pairs)
+                per_pair = seconds / len(pairs)
+                self._seconds_per_pair = (
+                    per_pair
+                    if not self._seconds_per_pair
+                    else 0.8 * self._seconds_per_pair + 0.2 * per_pair
+                )
+                self.stats.pairs += len(pairs)
+                self.stats.seconds += seconds
+        RERANK_PAIRS.labels("scored").inc(len(pairs))
+        return scores.tolist()
+
+    def _select(
+        self, results: List[SearchResult], scores: Sequence[float], k: int
+    ) -> List[SearchResult]:
+        """Los mejores `k` resultados que superan el corte de puntuación."""
+        ranked = sorted(
+            ((float(score), index) for index, score in enumerate(scores)),
+            key=lambda item: -item[0],
+        )
+        cutoff = max(self.min_score, ranked[0][0] * self.relative_score)
+        # El mejor resultado se conserva aunque no supere el corte
+        return [
+            replace(
+                results[index],
+                score=score,
+                metadata={
+                    **results[index].metadata,
+                    "retrieval_score": results[index].score,
+                },
+            )
+            for position, (score, index) in enumerate(ranked[:k])
+            if position == 0 or score >= cutoff
+        ]
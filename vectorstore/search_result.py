@@ -0,0 +1,17 @@
+from dataclasses import dataclass, field
+from typing import Any, Dict, Optional
+
+
+@dataclass
+class SearchResult:
+    """Resultado de una búsqueda en el vectorstore."""
+
+    id: str
+    content: str
+    source: Optional[str]
+    score: float
+    metadata: Dict[str, Any] = field(default_factory=dict)
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Formato de diccionario usado por `search_similarity`."""
+        return {"content": self.content, "source": self.source}
@@ -0,0 +1,579 @@
+import json
+import os
+import shutil
+import threading
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+import faiss
+import numpy as np
+from langchain_community.vectorstores import FAISS as FAISS_STORE
+from langchain_core.embeddings import Embeddings
+from loguru import logger
+
+from vectorstore.index_factory import index_kind
+
+try:
+    import fcntl
+except ImportError:  # Windows: el bloqueo solo cubre el proceso actual
+    fcntl = None
+
+MANIFEST_VERSION = 1
+LEGACY_SEGMENT = "."
+
+# Bloqueo de escritura de cada carpeta entre los hilos del proceso
+_STORE_LOCKS: Dict[str, threading.Lock] = {}
+_STORE_LOCKS_GUARD = threading.Lock()
+
+
+@contextmanager
+def store_lock(folder_path: str) -> Iterator[None]:
+    """Bloqueo exclusivo de escritura de un vectorstore, entre hilos y procesos.
+
+    Todo lo que modifica la carpeta publicada (ingesta, borrado, compactación,
+    importación o sustitución por el trabajador de ingesta) lo toma, de modo que
+    nadie publica encima de cambios que no ha visto. Entre procesos se usa
+    `flock` sobre `<carpeta>.lock`, junto a la carpeta y no dentro, porque esta
+    puede sustituirse. No es reentrante.
+    """
+    key = os.path.abspath(folder_path)
+    with _STORE_LOCKS_GUARD:
+        lock = _STORE_LOCKS.setdefault(key, threading.Lock())
+    with lock:
+        os.makedirs(os.path.dirname(key), exist_ok=True)
+        # Cerrar el archivo libera el flock
+        with open(f"{key}.lock", "a+b") as file:
+            if fcntl is not None:
+                fcntl.flock(file.fileno(), fcntl.LOCK_EX)
+            yield
+
+
+class SegmentStore:
+    """Persistencia segmentada y de solo anexado de un vectorstore FAISS.
+
+    Cada lote de ingesta se guarda como un segmento independiente
+    (`seg-000001/index.faiss` + `index.pkl`) y un `manifest.json` enumera los
+    segmentos vigentes. Añadir documentos solo escribe el segmento nuevo, por lo que
+    el coste de persistir es proporcional al lote y no al corpus.
+
+    Las eliminaciones se registran como lápidas en el manifiesto; cada lápida guarda
+    el número del siguiente segmento en el momento de borrar y solo se aplica a los
+    segmentos anteriores, de modo que un id eliminado puede volver a añadirse.
+    La compactación automática es escalonada por tamaño: solo fusiona segmentos de
+    tamaño parecido (ver `merge_candidates`), de modo que cada vector se reescribe
+    O(log N) veces. La compactación completa fusiona todos los segmentos en uno y
+    descarta las lápidas ya aplicadas. Ambas pueden ejecutarse en segundo plano
+    mientras se siguen anexando lotes.
+
+    Un directorio con el formato anterior (`index.faiss` + `index.pkl` en la raíz)
+    se trata como un único segmento heredado.
+    """
+
+    def __init__(
+        self,
+        folder_path: str,
+        embeddings: Embeddings,
+        max_segments: Optional[int] = None,
+        merge_factor: Optional[int] = None,
+        **store_kwargs: Any,
+    ):
+        """Inicializa el almacén de segmentos de la carpeta indicada.
+
+        Parámetros:
+            folder_path (str): Carpeta del vectorstore (`database/<nombre>`).
+            embeddings (Embeddings): Embeddings con los que se cargan los segmentos.
+            max_segments (Optional[int]): Número de segmentos a partir del cual se
+                fusionan los más pequeños aunque ningún escalón esté lleno
+                (`VECTORSTORE_MAX_SEGMENTS`).
+            merge_factor (Optional[int]): Segmentos de un mismo escalón de tamaño
+                que se fusionan en segundo plano (`VECTORSTORE_MERGE_FACTOR`).
+            **store_kwargs: Argumentos adicionales para `FAISS.load_local`.
+        """
+        self.folder_path = folder_path
+        self.embeddings = embeddings
+        self.max_segments = max_segments or int(
+            os.getenv("VECTORSTORE_MAX_SEGMENTS", "16")
+        )
+        self.merge_factor = merge_factor or int(
+            os.getenv("VECTORSTORE_MERGE_FACTOR", "4")
+        )
+        self.store_kwargs = store_kwargs
+        self._lock = threading.RLock()
+        # Versión leída del manifiesto y la firma (inodo, mtime, tamaño) con que se
+        # leyó; el inodo cambia cuando otro proceso sustituye la carpeta
+        self._version: Optional[tuple] = None
+        self._template: Optional[faiss.Index] = None
+        self._compaction: Optional[threading.Thread] = None
+        # Versión escrita por cada compactación de este objeto → versión anterior
+        self._compacted: Dict[str, str] = {}
+
+    @property
+    def manifest_path(self) -> str:
+        """Ruta del manifiesto de segmentos."""
+        return os.path.join(self.folder_path, "manifest.json")
+
+    @property
+    def template_path(self) -> str:
+        """Ruta del índice vacío (y entrenado) del que parten los segmentos."""
+        return os.path.join(self.folder_path, "template.faiss")
+
+    def exists(self) -> bool:
+        """Indica si hay un vectorstore persistido, segmentado o heredado."""
+        return os.path.exists(self.manifest_path) or os.path.exists(
+            os.path.join(self.folder_path, "index.faiss")
+        )
+
+    def read_manifest(self) -> Dict[str, Any]:
+        """Lee el manifiesto vigente."""
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, encoding="utf-8") as file:
+                return json.load(file)
+        segments = []
+        if os.path.exists(os.path.join(self.folder_path, "index.faiss")):
+            segments.append({"name": LEGACY_SEGMENT, "number": 0, "created_at": None})
+        return {
+            "version": MANIFEST_VERSION,
+            # Distingue un vectorstore reconstruido del anterior con la misma generación
+            "store_id": uuid.uuid4().hex,
+            "generation": 0,
+            "next_segment": 1,
+            "segments": segments,
+            "deleted": {},
+        }
+
+    def version(self) -> str:
+        """Identificador persistente del contenido: cambia con cada manifiesto escrito.
+
+        Lo escriba este proceso u otro, de modo que sirve para invalidar cachés en
+        disco. El manifiesto solo se vuelve a leer si ha cambiado su firma.
+        """
+        try:
+            stat = os.stat(self.manifest_path)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            return "empty"
+        cached = self._version
+        if cached is None or cached[0] != signature:
+            cached = self._version = (signature, _version_of(self.read_manifest()))
+        return cached[1]
+
+    def base_version(self, version: str) -> str:
+        """Versión anterior a las compactaciones de este objeto que llevan a `version`.
+
+        Compactar reescribe los segmentos sin cambiar su contenido, de modo que
+        quien tenía cargada esa versión anterior sigue al día.
+        """
+        while version in self._compacted:
+            version = self._compacted[version]
+        return version
+
+    def dimension(self) -> Optional[int]:
+        """Dimensión de los vectores guardados, o None si aún no se conoce."""
+        dimension = self.read_manifest().get("dimension")
+        if dimension is None and os.path.exists(self.template_path):
+            # Manifiestos anteriores: la plantilla vacía ya tiene la dimensión
+            dimension = faiss.read_index(self.template_path).d
+        return dimension
+
+    def empty_index(self, like: faiss.Index) -> faiss.Index:
+        """Devuelve un índice vacío compatible con los segmentos existentes.
+
+        Todos los segmentos parten de la misma plantilla para que los índices IVF
+        compartan el cuantizador y puedan fusionarse con `merge_from`. Si no hay
+        plantilla, se crea a partir de `like`.
+        """
+        with self._lock:
+            if self._template is None:
+                if os.path.exists(self.template_path):
+                    self._template = faiss.read_index(self.template_path)
+                else:
+                    self._template = faiss.clone_index(like)
+                    self._template.reset()
+                    os.makedirs(self.folder_path, exist_ok=True)
+                    faiss.write_index(self._template, self.template_path)
+            return faiss.clone_index(self._template)
+
+    def append(self, vectorstore: FAISS_STORE) -> str:
+        """Guarda un lote como un segmento nuevo y lo registra en el manifiesto.
+
+        Retorna:
+            str: Nombre del segmento creado.
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            number = self._reserve_segment(manifest)
+            name = _segment_name(number)
+            vectorstore.save_local(os.path.join(self.folder_path, name))
+            manifest["dimension"] = vectorstore.index.d
+            manifest["index_type"] = index_kind(vectorstore.index)
+            manifest["segments"].append(
+                {
+                    "name": name,
+                    "number": number,
+                    "count": vectorstore.index.ntotal,
+                    "created_at": _now(),
+                }
+            )
+            self._write_manifest(manifest)
+            pending = self._tiered_candidates(manifest["segments"])
+
+        if pending:
+            self.compact_in_background(full=False)
+        return name
+
+    def rebuild(self, vectorstore: FAISS_STORE) -> None:
+        """Sustituye todos los segmentos y la plantilla por un índice reentrenado.
+
+        El llamador debe tener el `store_lock` de la carpeta; las compactaciones en
+        curso se descartan al terminar porque sus segmentos ya no están.
+        """
+        with self._lock:
+            manifest = self.read_manifest()
+            number = self._reserve_segment(manifest)
+            name = _segment_name(number)
+            vectorstore.save_local(os.path.join(self.folder_path, name))
+            template = faiss.clone_index(vectorstore.index)
+            template.reset()
+            faiss.write_index(template, self.template_path + ".tmp")
+            os.replace(self.template_path + ".tmp", self.template_path)
+            self._template = template
+            old = manifest["segments"]
+            manifest["dimension"] = vectorstore.index.d
+            manifest["index_type"] = index_kind(vectorstore.index)
+            manifest["segments"] = [
+                {
+                    "name": name,
+                    "number": number,
+                    "count": vectorstore.index.ntotal,
+                    "created_at": _now(),
+                }
+            ]
+            manifest["deleted"] = {}
+            self._write_manifest(manifest)
+            for segment in old:
+                self._remove_segment(segment["name"])
+
+    def index_type(self) -> Optional[str]:
+        """Tipo del índice guardado (puede no ser el configurado), si se conoce."""
+        index_type = self.read_manifest().get("index_type")
+        if index_type is None and os.path.exists(self.template_path):
+            # Manifiestos anteriores: se deduce de la plantilla
+            index_type = index_kind(faiss.read_index(self.template_path))
+        return index_type
+
+    def delete(self, ids: Iterable[str]) -> None:
+        """Registra lápidas para los ids de los segmentos ya persistidos."""
+        with self._lock:
+            manifest = self.read_manifest()
+            for _id in ids:
+                manifest["deleted"][_id] = manifest["next_segment"]
+            self._write_manifest(manifest)
+
+    def load(self) -> Optional[FAISS_STORE]:
+        """Abre todos los segmentos como un único vectorstore lógico."""
+        with self._lock:
+            manifest = self.read_manifest()
+        return self._load_segments(manifest["segments"], manifest["deleted"])
+
+    def compact(self, full: bool = True) -> bool:
+        """Fusiona segmentos actuales en uno solo.
+
+        Los segmentos anexados mientras dura la compactación se conservan.
+
+        Parámetros:
+            full (bool): Si es True, se fusionan todos los segmentos; si no, solo
+                los de un escalón de tamaño lleno (`merge_candidates`).
+
+        Retorna:
+            bool: True si se ha compactado, False si no había nada que compactar.
+        """
+        with store_lock(self.folder_path), self._lock:
+            manifest = self.read_manifest()
+            deleted = dict(manifest["deleted"])
+            if full:
+                segments = manifest["segments"]
+                if len(segments) <= 1 and not deleted:
+                    return False
+            else:
+                segments = self._tiered_candidates(manifest["segments"])
+                if not segments:
+                    return False
+            # Reservar el número al tomar la instantánea: las lápidas posteriores
+            # tendrán un número mayor y también se aplicarán al segmento compactado
+            number = self._reserve_segment(manifest)
+            self._write_compacted(manifest)
+            folder = self._folder_identity()
+
+        merged = self._load_segments(segments, deleted)
+        name = _segment_name(number)
+        if merged is not None:
+            # En la generación en que se reservó el número, aunque se sustituya
+            merged.save_local(os.path.join(folder[0], name))
+
+        compacted = {segment["name"] for segment in segments}
+        with store_lock(self.folder_path), self._lock:
+            if self._folder_identity() != folder:
+                # Otro proceso ha publicado una carpeta nueva mientras se fusionaba
+                logger.warning(
+                    f"Compactación de '{self.folder_path}' descartada: la carpeta "
+                    "se ha sustituido"
+                )
+                return False
+            manifest = self.read_manifest()
+            current = {segment["name"] for segment in manifest["segments"]}
+            if not compacted <= current:
+                # Índice reentrenado (o vaciado) mientras se fusionaba
+                logger.warning(f"Compactación de '{self.folder_path}' descartada")
+                self._remove_segment(name)
+                return False
+            remaining = [s for s in manifest["segments"] if s["name"] not in compacted]
+            new_segments = []
+            if merged is not None:
+                new_segments.append(
+                    {
+                        "name": name,
+                        "number": number,
+                        "count": merged.index.ntotal,
+                        "created_at": _now(),
+                    }
+                )
+            manifest["segments"] = new_segments + remaining
+            # Una lápida ya aplicada se conserva si aún afecta a otro segmento
+            oldest = min(
+                (s["number"] for s in remaining if s["number"] < number), default=None
+            )
+            manifest["deleted"] = {
+                _id: seq
+                for _id, seq in manifest["deleted"].items()
+                if deleted.get(_id) != seq or (oldest is not None and oldest < seq)
+            }
+            self._write_compacted(manifest)
+            for segment in segments:
+                self._remove_segment(segment["name"])
+        logger.info(f"Compactados {len(segments)} segmentos en '{self.folder_path}'.")
+        return True
+
+    def compact_in_background(self, full: bool = True) -> threading.Thread:
+        """Lanza la compactación (ver `compact`) en un hilo si no hay otra en curso."""
+        with self._lock:
+            if self._compaction is None or not self._compaction.is_alive():
+                self._compaction = threading.Thread(
+                    target=self._compact_safely,
+                    args=(full,),
+                    name="vectorstore-compaction",
+                    daemon=True,
+                )
+                self._compaction.start()
+            return self._compaction
+
+    def wait_for_compaction(self) -> None:
+        """Espera a que termine la compactación en segundo plano, si hay una."""
+        compaction = self._compaction
+        if compaction is not None:
+            compaction.join()
+
+    def _compact_safely(self, full: bool) -> None:
+        try:
+            # Una fusión escalonada puede llenar el escalón siguiente
+            while self.compact(full) and not full:
+                pass
+        except Exception as e:
+            logger.error(f"Error al compactar '{self.folder_path}': {e}")
+
+    def _load_segments(
+        self, segments: List[Dict[str, Any]], deleted: Dict[str, int]
+    ) -> Optional[FAISS_STORE]:
+        vectorstore = None
+        for segment in segments:
+            store = FAISS_STORE.load_local(
+                folder_path=self._segment_path(segment["name"]),
+                embeddings=self.embeddings,
+                allow_dangerous_deserialization=True,
+                **self.store_kwargs,
+            )
+            tombstones = [
+                _id
+                for _id, seq in deleted.items()
+                if segment["number"] < seq and _id in store.docstore._dict
+            ]
+            delete_documents(store, tombstones)
+            if vectorstore is None:
+                vectorstore = store
+            else:
+                merge_vectorstores(vectorstore, store)
+        return vectorstore
+
+    def _tiered_candidates(self, segments: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Segmentos que fusiona la compactación escalonada."""
+        # El segmento heredado no registra su tamaño: solo entra en la completa
+        sized = [segment for segment in segments if "count" in segment]
+        chosen = merge_candidates(
+            [segment["count"] for segment in sized],
+            self.merge_factor,
+            overflowing=len(segments) > self.max_segments,
+        )
+        return [sized[i] for i in chosen]
+
+    def _reserve_segment(self, manifest: Dict[str, Any]) -> int:
+        number = manifest["next_segment"]
+        manifest["next_segment"] = number + 1
+        return number
+
+    def _write_manifest(self, manifest: Dict[str, Any]) -> None:
+        manifest["generation"] += 1
+        os.makedirs(self.folder_path, exist_ok=True)
+        temp_path = self.manifest_path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file)
+        os.replace(temp_path, self.manifest_path)
+
+    def _write_compacted(self, manifest: Dict[str, Any]) -> None:
+        """Escribe un manifiesto de compactación, que no cambia el contenido."""
+        previous = _version_of(manifest)
+        self._write_manifest(manifest)
+        self._compacted[_version_of(manifest)] = previous
+
+    def _folder_identity(self) -> Tuple[str, int, int]:
+        """Ruta real, dispositivo e inodo de la carpeta publicada.
+
+        Cambian cuando otro proceso sustituye la carpeta (ver `replace_folder`).
+        """
+        stat = os.stat(self.folder_path)
+        return os.path.realpath(self.folder_path), stat.st_dev, stat.st_ino
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.folder_path, name)
+
+    def _remove_segment(self, name: str) -> None:
+        if name == LEGACY_SEGMENT:
+            for file_name in ("index.faiss", "index.pkl"):
+                path = os.path.join(self.folder_path, file_name)
+                if os.path.exists(path):
+                    os.remove(path)
+        else:
+            shutil.rmtree(self._segment_path(name), ignore_errors=True)
+
+
+def merge_candidates(
+    sizes: List[int], factor: int, overflowing: bool = False
+) -> List[int]:
+    """Elige qué segmentos fusionar con una política escalonada por tamaño.
+
+    Los segmentos se agrupan en escalones de tamaño `[factor^t, factor^(t+1))` y se
+    fusiona el escalón más bajo que reúne `factor` segmentos. El resultado tiene al
+    menos `factor^(t+1)` elementos y pasa a un escalón superior, por lo que cada
+    elemento se reescribe como mucho log_factor(N) veces.
+
+    Parámetros:
+        sizes (List[int]): Número de elementos de cada segmento.
+        factor (int): Segmentos de un mismo escalón que se fusionan (≥ 2).
+        overflowing (bool): Si hay demasiados segmentos y ningún escalón está
+            lleno, se fusionan los `factor` más pequeños.
+
+    Retorna:
+        List[int]: Posiciones en `sizes` de los segmentos a fusionar (vacía si no
+        hay que fusionar).
+    """
+    factor = max(2, factor)
+    tiers: Dict[int, List[int]] = defaultdict(list)
+    for position, size in enumerate(sizes):
+        tier = 0
+        while size >= factor:
+            size //= factor
+            tier += 1
+        tiers[tier].append(position)
+    for tier in sorted(tiers):
+        if len(tiers[tier]) >= factor:
+            return tiers[tier]
+    if overflowing and len(sizes) > 1:
+        return sorted(range(len(sizes)), key=sizes.__getitem__)[:factor]
+    return []
+
+
+def merge_vectorstores(target: FAISS_STORE, source: FAISS_STORE) -> None:
+    """Añade el contenido de `source` a `target`.
+
+    Los índices IVF se fusionan desplazando los ids almacenados, y los que no
+    implementan `merge_from` (HNSW) reinsertando los vectores reconstruidos.
+    """
+    offset = len(target.index_to_docstore_id)
+    add_id = offset if faiss.try_extract_index_ivf(target.index) is not None else 0
+    try:
+        target.index.merge_from(source.index, add_id)
+    except RuntimeError:
+        if source.index.ntotal:
+            target.index.add(source.index.reconstruct_n(0, source.index.ntotal))
+    target.docstore.add(
+        {_id: source.docstore.search(_id) for _id in source.index_to_docstore_id.values()}
+    )
+    target.index_to_docstore_id.update(
+        {offset + position: _id for position, _id in source.index_to_docstore_id.items()}
+    )
+
+
+def delete_documents(vectorstore: FAISS_STORE, ids: List[str]) -> None:
+    """Elimina documentos por id manteniendo posiciones consecutivas en el índice.
+
+    LangChain asume que las posiciones se compactan tras `remove_ids`, lo que solo
+    ocurre en los índices planos: en los IVF se renumeran los ids almacenados y los
+    HNSW, que no admiten eliminaciones, se reconstruyen sin los vectores eliminados.
+    """
+    if not ids:
+        return
+    dropped = set(ids)
+    index = vectorstore.index
+    positions = sorted(
+        position
+        for position, _id in vectorstore.index_to_docstore_id.items()
+        if _id in dropped
+    )
+    keep = [
+        position
+        for position in range(len(vectorstore.index_to_docstore_id))
+        if vectorstore.index_to_docstore_id[position] not in dropped
+    ]
+    removed = np.asarray(positions, dtype=np.int64)
+
+    ivf = faiss.try_extract_index_ivf(index)
+    if ivf is not None:
+        index.remove_ids(removed)
+        _renumber_ivf_ids(ivf, removed)
+    else:
+        try:
+            index.remove_ids(removed)
+        except RuntimeError:
+            rebuilt = faiss.clone_index(index)
+            rebuilt.reset()
+            if keep:
+                rebuilt.add(index.reconstruct_n(0, index.ntotal)[keep])
+            vectorstore.index = rebuilt
+
+    vectorstore.docstore.delete([vectorstore.index_to_docstore_id[p] for p in positions])
+    vectorstore.index_to_docstore_id = {
+        new: vectorstore.index_to_docstore_id[old] for new, old in enumerate(keep)
+    }
+
+
+def _renumber_ivf_ids(ivf: faiss.IndexIVF, removed: np.ndarray) -> None:
+    # Cada id conservado baja tantas posiciones como ids eliminados le preceden
+    invlists = ivf.invlists
+    for list_no in range(invlists.nlist):
+        size = invlists.list_size(list_no)
+        if size:
+            ids = faiss.rev_swig_ptr(invlists.get_ids(list_no), size)
+            ids[:] = ids - np.searchsorted(removed, ids)
+
+
+def _version_of(manifest: Dict[str, Any]) -> str:
+    return f"{manifest.get('store_id', '')}:{manifest['generation']}"
+
+
+def _segment_name(number: int) -> str:
+    return f"seg-{number:06d}"
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat()
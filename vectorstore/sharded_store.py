@@ -0,0 +1,343 @@
+import hashlib
+import heapq
+import itertools
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional
+
+import faiss
+from langchain_core.embeddings import Embeddings
+
+from telemetry.tracing import span
+from vectorstore.document_processor import DocumentProcessor
+from vectorstore.file_manifest import ManifestDiff
+from vectorstore.metadata_index import Filter, normalize_filter
+from vectorstore.search_result import SearchResult
+from vectorstore.vectorstore_manager import SEARCH_MODES, VectorStoreManager
+
+
+def shard_for(source: str, n_shards: int) -> int:
+    """Shard al que pertenece una fuente en un reparto por hash.
+
+    El hash es estable entre procesos y ejecuciones (no depende de `PYTHONHASHSEED`).
+    """
+    digest = hashlib.blake2b(source.encode("utf-8"), digest_size=8).digest()
+    return int.from_bytes(digest, "little") % n_shards
+
+
+def merge_results(
+    rankings: List[List[SearchResult]], k: int, higher_is_better: bool
+) -> List[SearchResult]:
+    """Fusiona el top-k de varios shards en el top-k global.
+
+    Cada clasificación ya viene ordenada de mejor a peor, de modo que basta una
+    fusión de listas ordenadas que se detiene en el k-ésimo resultado.
+
+    Parámetros:
+        rankings (List[List[SearchResult]]): Resultados de cada shard.
+        k (int): Número de resultados a devolver.
+        higher_is_better (bool): True si una puntuación mayor es mejor (producto
+            interno, coseno, BM25 o RRF); False para distancias L2.
+    """
+    merged = heapq.merge(
+        *rankings, key=lambda result: result.score, reverse=higher_is_better
+    )
+    return list(itertools.islice(merged, k))
+
+
+class ShardedVectorStore:
+    """Conjunto de vectorstores (shards) que se consultan como uno solo.
+
+    Los shards pueden ser colecciones independientes (por jurisdicción o por tipo
+    de norma, cada una con su carpeta) o particiones de una misma carpeta
+    repartidas por el hash de la fuente. Cada shard es un `VectorStoreManager`
+    completo con sus propios segmentos, manifiesto e índices, de modo que se
+    actualiza o se reconstruye sin tocar los demás.
+
+    Las búsquedas calculan los embeddings de las consultas una sola vez, las
+    envían a todos los shards en paralelo en un pool de hilos (FAISS libera el
+    GIL durante la búsqueda) y fusionan los top-k según la estrategia de
+    distancia.
+    """
+
+    def __init__(
+        self,
+        shards: Dict[str, VectorStoreManager],
+        hashed: bool = False,
+        workers: Optional[int] = None,
+    ):
+        """Inicializa el conjunto a partir de sus shards.
+
+        Parámetros:
+            shards (Dict[str, VectorStoreManager]): Shards por nombre, en orden.
+            hashed (bool): Si es True, los shards reparten una misma carpeta por
+                el hash de la fuente y los filtros por fuente consultan un solo
+                shard.
+            workers (Optional[int]): Hilos de búsqueda (`SHARD_SEARCH_WORKERS`);
+                por defecto, uno por shard.
+        """
+        if not shards:
+            raise ValueError("Se necesita al menos un shard")
+        self.shards = shards
+        self.hashed = hashed
+        first = next(iter(shards.values()))
+        self.search_mode = first.search_mode
+        workers = workers or int(os.getenv("SHARD_SEARCH_WORKERS", "0")) or len(shards)
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="shard-search"
+        )
+
+    @classmethod
+    def from_collections(
+        cls,
+        collections: Dict[str, str],
+        embeddings: Optional[Embeddings] = None,
+        **kwargs: Any,
+    ) -> "ShardedVectorStore":
+        """Un shard por colección.
+
+        Parámetros:
+            collections (Dict[str, str]): Nombre del vectorstore → carpeta de sus
+                documentos, p. ej. `{"penal": "derecho_files/penal"}`.
+            embeddings (Optional[Embeddings]): Modelo de embeddings compartido.
+        """
+        shards = {
+            name: VectorStoreManager(path=path, name=name, embeddings=embeddings)
+            for name, path in collections.items()
+        }
+        return cls(shards, **kwargs)
+
+    @classmethod
+    def from_hash(
+        cls,
+        path: str,
+        name: str,
+        n_shards: int,
+        embeddings: Optional[Embeddings] = None,
+        **kwargs: Any,
+    ) -> "ShardedVectorStore":
+        """Reparte los documentos de una carpeta en `n_shards` por hash de fuente.
+
+        Los shards se guardan como `database/<name>_shardNN`. Cambiar el número de
+        shards reasigna las fuentes, por lo que exige reconstruirlos.
+        """
+        shards = {
+            f"{name}_shard{i:02d}": VectorStoreManager(
+                path=path, name=f"{name}_shard{i:02d}", embeddings=embeddings
+            )
+            for i in range(n_shards)
+        }
+        return cls(shards, hashed=True, **kwargs)
+
+    @classmethod
+    def from_env(cls, path: str, name: str) -> Optional["ShardedVectorStore"]:
+        """Conjunto de shards configurado en el entorno, o None si no hay ninguno.
+
+        `VECTORSTORE_COLLECTIONS` («nombre=carpeta» separados por comas) define
+        colecciones; si no, `VECTORSTORE_SHARDS` > 1 reparte `path` por hash.
+        """
+        collections = os.getenv("VECTORSTORE_COLLECTIONS", "").strip()
+        if collections:
+            pairs = [item.split("=", 1) for item in collections.split(",") if item]
+            return cls.from_collections(
+                {collection.strip(): folder.strip() for collection, folder in pairs}
+            )
+        n_shards = int(os.getenv("VECTORSTORE_SHARDS", "1"))
+        if n_shards > 1:
+            return cls.from_hash(path, name, n_shards)
+        return None
+
+    @property
+    def name(self) -> str:
+        """Nombres de los shards, para los mensajes."""
+        return ",".join(self.shards)
+
+    def _first(self) -> VectorStoreManager:
+        return next(iter(self.shards.values()))
+
+    def _owner(self, source: str) -> Optional[str]:
+        """Shard que contiene una fuente, si se conoce sin buscar en todos."""
+        if self.hashed:
+            return list(self.shards)[shard_for(source, len(self.shards))]
+        for name, shard in self.shards.items():
+            if shard.catalog.get(source) is not None:
+                return name
+        return None
+
+    def _files_by_shard(self) -> Dict[str, List[str]]:
+        """Reparto por hash de los archivos de la carpeta común."""
+        names = list(self.shards)
+        files = DocumentProcessor(self._first().path).list_files()
+        grouped: Dict[str, List[str]] = {name: [] for name in names}
+        for file_path in files:
+            grouped[names[shard_for(file_path, len(names))]].append(file_path)
+        return grouped
+
+    def detect_changes(self) -> Dict[str, ManifestDiff]:
+        """Cambios de los documentos de cada shard."""
+        if not self.hashed:
+            return {name: shard.detect_changes() for name, shard in self.shards.items()}
+        return {
+            name: self.shards[name].detect_changes(files=files)
+            for name, files in self._files_by_shard().items()
+        }
+
+    def apply_changes(self, diffs: Dict[str, ManifestDiff]) -> Dict[str, ManifestDiff]:
+        """Aplica los cambios de cada shard; solo se reindexa lo que ha cambiado."""
+        for name, diff in diffs.items():
+            self.shards[name].apply_changes(diff)
+        return diffs
+
+    def sync_vectorstore(self) -> Dict[str, ManifestDiff]:
+        """Sincroniza cada shard con sus documentos."""
+        return self.apply_changes(self.detect_changes())
+
+    def create_vectorstore(self) -> bool:
+        """Crea los shards que aún no existen."""
+        if all(shard.exist_vectorstore() for shard in self.shards.values()):
+            return False
+        self.sync_vectorstore()
+        return True
+
+    def rebuild_shard(self, name: str) -> ManifestDiff:
+        """Elimina y vuelve a indexar un solo shard desde sus documentos."""
+        shard = self.shards[name]
+        shard.delete_vectorstore()
+        if self.hashed:
+            diff = shard.detect_changes(files=self._files_by_shard()[name])
+        else:
+            diff = shard.detect_changes()
+        return shard.apply_changes(diff)
+
+    def delete_vectorstore(self) -> bool:
+        """Elimina todos los shards."""
+        deleted = [shard.delete_vectorstore() for shard in self.shards.values()]
+        return any(deleted)
+
+    def exist_vectorstore(self) -> bool:
+        """Verifica si existe algún shard."""
+        return any(shard.exist_vectorstore() for shard in self.shards.values())
+
+    def list_sources(self) -> List[str]:
+        """Fuentes de todos los shards."""
+        return sorted(
+            {source for shard in self.shards.values() for source in shard.list_sources()}
+        )
+
+    def extract_texts_by_source(self, source: str) -> List[str]:
+        """Textos de los chunks de una fuente, leídos del shard que la contiene."""
+        owner = self._owner(source)
+        return [] if owner is None else self.shards[owner].extract_texts_by_source(source)
+
+    def query_vector(self, query: str) -> List[float]:
+        """Embedding de una consulta; todos los shards comparten el modelo."""
+        return self._first().query_vector(query)
+
+    @property
+    def store_version(self) -> str:
+        """Versión del conjunto: cambia si cambia cualquiera de los shards."""
+        return "|".join(shard.store_version for shard in self.shards.values())
+
+    def reopen(self) -> Optional["ShardedVectorStore"]:
+        """Sustituye los shards de los que otro proceso ha publicado una generación.
+
+        Cada shard se carga aparte con `VectorStoreManager.reopen` y sustituye al
+        anterior en el diccionario; las búsquedas en curso terminan con el que
+        tenían.
+
+        Retorna:
+            Optional[ShardedVectorStore]: Este mismo conjunto si ha cambiado algún
+            shard, o None.
+        """
+        changed = False
+        for name, shard in list(self.shards.items()):
+            fresh = shard.reopen()
+            if fresh is not None:
+                self.shards[name] = fresh
+                changed = True
+        return self if changed else None
+
+    def higher_is_better(self, mode: str) -> bool:
+        """Sentido de las puntuaciones del modo de búsqueda y la estrategia."""
+        if mode != "dense":
+            # BM25 y Reciprocal Rank Fusion
+            return True
+        return self._first().index_factory.metric == faiss.METRIC_INNER_PRODUCT
+
+    def search_similarity(
+        self,
+        query: str,
+        k: Optional[int] = 5,
+        fuente: Optional[str] = None,
+        mode: Optional[str] = None,
+    ) -> str:
+        """Búsqueda de similitud en todos los shards con capacidad de filtrado."""
+        results = self.search_batch([query], k=k, filters=[fuente], mode=mode)[0]
+        return str([result.to_dict() for result in results])
+
+    def search_batch(
+        self,
+        queries: List[str],
+        k: int = 5,
+        filters: Optional[List[Filter]] = None,
+        mode: Optional[str] = None,
+    ) -> List[List[SearchResult]]:
+        """Busca varias consultas en todos los shards a la vez.
+
+        Los embeddings se calculan una vez y cada shard recibe solo las consultas
+        que pueden tener resultados en él: con shards por hash, un filtro por
+        fuente consulta únicamente el shard de esa fuente. El top-k de cada shard
+        se fusiona según `higher_is_better`; en modo `dense` el resultado es el
+        mismo que con un único índice. En los modos `lexical` e `hybrid` cada
+        shard puntúa con sus propias estadísticas BM25 y sus propios rangos, por
+        lo que la fusión es aproximada.
+
+        Retorna:
+            List[List[SearchResult]]: Los resultados de cada consulta, en orden.
+        """
+        mode = (mode or self.search_mode).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {mode}")
+        if filters is None:
+            filters = [None] * len(queries)
+        elif len(filters) != len(queries):
+            raise ValueError("Debe haber un filtro por consulta")
+        filters = [normalize_filter(filtro) for filtro in filters]
+
+        with span("search.shards", shards=len(self.shards), queries=len(queries)):
+            vectors = None
+            if mode != "lexical":
+                vectors = self._first()._query_vectors(queries)
+            futures = []
+            for name, shard in self.shards.items():
+                rows = [
+                    i for i, filtro in enumerate(filters) if self._routes(name, filtro)
+                ]
+                if not rows:
+                    continue
+                future = self.executor.submit(
+                    shard.search_batch,
+                    [queries[i] for i in rows],
+                    k,
+                    [filters[i] for i in rows],
+                    mode,
+                    None if vectors is None else [vectors[i] for i in rows],
+                )
+                futures.append((rows, future))
+
+            rankings: List[List[List[SearchResult]]] = [[] for _ in queries]
+            for rows, future in futures:
+                for i, results in zip(rows, future.result(), strict=True):
+                    rankings[i].append(results)
+            higher_is_better = self.higher_is_better(mode)
+            return [merge_results(found, k, higher_is_better) for found in rankings]
+
+    def _routes(self, name: str, filtro: Optional[Dict[str, Any]]) -> bool:
+        """Indica si una consulta con este filtro puede tener resultados en el shard."""
+        if not self.hashed or filtro is None or "source" not in filtro:
+            return True
+        return self._owner(filtro["source"]) == name
+
+    def close(self) -> None:
+        """Detiene el pool de búsqueda."""
+        self.executor.shutdown(wait=False)
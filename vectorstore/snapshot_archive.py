@@ -0,0 +1,531 @@
+import argparse
+import gzip
+import hashlib
+import hmac
+import io
+import json
+import os
+import shutil
+import sys
+import tarfile
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from loguru import logger
+
+ARCHIVE_FORMAT = "rag-vectorstore-snapshot"
+ARCHIVE_VERSION = 2
+HEADER_NAME = "snapshot.json"
+SIGNATURE_NAME = "snapshot.sig"
+MAX_HEADER_SIZE = 64 << 20
+FILES_PREFIX = "files/"
+# La instantánea de solo lectura se regenera en el nodo que importa
+EXCLUDED_DIRS = ("serving",)
+READ_SIZE = 1 << 20
+
+
+@dataclass
+class SnapshotInfo:
+    """Cabecera de un archivo de instantánea.
+
+    `files` describe el estado completo del vectorstore exportado (ruta relativa →
+    `sha256` y `size`); `shipped` enumera los archivos incluidos en el archivo,
+    todos en una exportación completa y solo los nuevos o cambiados en un delta.
+    """
+
+    name: str
+    store_version: str
+    embedding_model: str
+    distance_strategy: str
+    index_type: str
+    dimension: Optional[int]
+    files: Dict[str, Dict[str, Any]]
+    shipped: List[str]
+    base: Optional[str] = None
+    created_at: str = field(
+        default_factory=lambda: datetime.now(timezone.utc).isoformat()
+    )
+    format: str = ARCHIVE_FORMAT
+    version: int = ARCHIVE_VERSION
+
+    @property
+    def is_delta(self) -> bool:
+        """Indica si el archivo solo contiene los cambios respecto a `base`."""
+        return self.base is not None
+
+    @property
+    def size(self) -> int:
+        """Bytes del vectorstore exportado, sin comprimir."""
+        return sum(entry["size"] for entry in self.files.values())
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "SnapshotInfo":
+        """Lee una cabecera, comprobando que el formato es conocido."""
+        if data.get("format") != ARCHIVE_FORMAT:
+            raise ValueError("El archivo no es una instantánea de vectorstore")
+        if data.get("version", 0) > ARCHIVE_VERSION:
+            raise ValueError(
+                f"Versión de instantánea {data['version']} no soportada "
+                f"(máxima {ARCHIVE_VERSION})"
+            )
+        known = cls.__dataclass_fields__
+        return cls(**{key: value for key, value in data.items() if key in known})
+
+
+def snapshot_key() -> bytes:
+    """Clave compartida con que se firman y verifican las instantáneas.
+
+    Los segmentos incluyen docstores serializados con pickle, así que importar
+    una instantánea equivale a ejecutar código de quien la creó: solo se aceptan
+    las firmadas con la misma `SNAPSHOT_KEY`.
+
+    Lanza:
+        ValueError: Si `SNAPSHOT_KEY` no está configurada.
+    """
+    key = os.getenv("SNAPSHOT_KEY", "")
+    if not key:
+        raise ValueError(
+            "Configure SNAPSHOT_KEY (la misma en todos los nodos) para exportar o "
+            "importar instantáneas"
+        )
+    return key.encode("utf-8")
+
+
+def store_files(folder_path: str) -> Dict[str, str]:
+    """Archivos de un vectorstore que forman parte de una instantánea.
+
+    Retorna:
+        Dict[str, str]: Ruta relativa (con `/`) → ruta en disco, sin la
+        instantánea de solo lectura ni los archivos temporales.
+    """
+    files = {}
+    for root, dirs, names in os.walk(folder_path):
+        dirs[:] = sorted(
+            d
+            for d in dirs
+            if not (root == folder_path and d in EXCLUDED_DIRS) and ".tmp" not in d
+        )
+        for name in sorted(names):
+            if ".tmp" in name or name.endswith("-journal"):
+                continue
+            path = os.path.join(root, name)
+            files[os.path.relpath(path, folder_path).replace(os.sep, "/")] = path
+    return files
+
+
+def file_digest(path: str) -> Dict[str, Any]:
+    """SHA-256 y tamaño de un archivo, leído por bloques."""
+    digest = hashlib.sha256()
+    size = 0
+    with open(path, "rb") as file:
+        while block := file.read(READ_SIZE):
+            digest.update(block)
+            size += len(block)
+    return {"sha256": digest.hexdigest(), "size": size}
+
+
+def export_snapshot(
+    folder_path: str,
+    output: BinaryIO,
+    metadata: Dict[str, Any],
+    key: bytes,
+    base: Optional[SnapshotInfo] = None,
+    compresslevel: Optional[int] = None,
+) -> SnapshotInfo:
+    """Escribe una instantánea del vectorstore de una carpeta en un flujo.
+
+    El archivo es un tar comprimido con gzip que se escribe de forma secuencial,
+    de modo que `output` puede ser un socket o una respuesta HTTP. El primer
+    miembro es la cabecera (`snapshot.json`), el segundo su firma HMAC-SHA256
+    (`snapshot.sig`) y los siguientes, los archivos bajo `files/`. La cabecera
+    incluye el SHA-256 de cada archivo, de modo que la firma los cubre a todos.
+
+    Parámetros:
+        folder_path (str): Carpeta del vectorstore (`database/<nombre>`).
+        output (BinaryIO): Flujo de salida.
+        metadata (Dict[str, Any]): `name`, `store_version`, `embedding_model`,
+            `distance_strategy`, `index_type` y `dimension` del vectorstore.
+        key (bytes): Clave de la firma (ver `snapshot_key`).
+        base (Optional[SnapshotInfo]): Cabecera de una instantánea anterior; si se
+            indica, solo se incluyen los archivos nuevos o cambiados desde ella.
+        compresslevel (Optional[int]): Nivel de gzip
+            (`SNAPSHOT_COMPRESSION_LEVEL`); los vectores float32 apenas se
+            comprimen, por lo que un nivel bajo suele ser más rápido sin ser mayor.
+
+    Retorna:
+        SnapshotInfo: La cabecera escrita.
+    """
+    if compresslevel is None:
+        compresslevel = int(os.getenv("SNAPSHOT_COMPRESSION_LEVEL", "3"))
+    paths = store_files(folder_path)
+    files = {relative: file_digest(path) for relative, path in paths.items()}
+    shipped = [
+        relative
+        for relative, entry in files.items()
+        if base is None or base.files.get(relative) != entry
+    ]
+    info = SnapshotInfo(
+        files=files,
+        shipped=shipped,
+        base=base.store_version if base is not None else None,
+        **metadata,
+    )
+
+    header = json.dumps(asdict(info), ensure_ascii=False).encode("utf-8")
+    # mtime=0: la misma instantánea produce siempre los mismos bytes
+    with (
+        gzip.GzipFile(
+            fileobj=output, mode="wb", compresslevel=compresslevel, mtime=0
+        ) as compressed,
+        tarfile.open(fileobj=compressed, mode="w|", format=tarfile.PAX_FORMAT) as tar,
+    ):
+        member = tarfile.TarInfo(HEADER_NAME)
+        member.size = len(header)
+        member.mtime = int(time.time())
+        tar.addfile(member, io.BytesIO(header))
+        signature = _sign(header, key).encode("ascii")
+        member = tarfile.TarInfo(SIGNATURE_NAME)
+        member.size = len(signature)
+        member.mtime = int(time.time())
+        tar.addfile(member, io.BytesIO(signature))
+        for relative in shipped:
+            member = tar.gettarinfo(paths[relative], arcname=FILES_PREFIX + relative)
+            if member.size != files[relative]["size"]:
+                raise RuntimeError(f"'{relative}' ha cambiado durante la exportación")
+            with open(paths[relative], "rb") as file:
+                tar.addfile(member, file)
+    return info
+
+
+def read_header(source: str, key: bytes) -> SnapshotInfo:
+    """Lee solo la cabecera de una instantánea (ruta, URL o `-`), verificando su firma."""
+    with open_input(source) as stream, tarfile.open(fileobj=stream, mode="r|gz") as tar:
+        return _read_header(tar, key)
+
+
+def check_compatible(info: SnapshotInfo, expected: Dict[str, Any]) -> None:
+    """Rechaza una instantánea de otro modelo de embeddings o estrategia.
+
+    Parámetros:
+        info (SnapshotInfo): Cabecera de la instantánea.
+        expected (Dict[str, Any]): `embedding_model`, `distance_strategy` y,
+            opcionalmente, `dimension` del vectorstore de destino.
+    """
+    mismatches = [
+        f"{key}: '{getattr(info, key)}' en la instantánea, '{value}' en este nodo"
+        for key, value in expected.items()
+        if value is not None and getattr(info, key) not in (None, value)
+    ]
+    if mismatches:
+        raise ValueError("Instantánea incompatible: " + "; ".join(mismatches))
+
+
+def import_snapshot(
+    folder_path: str,
+    stream: BinaryIO,
+    expected: Dict[str, Any],
+    key: bytes,
+    current_version: Optional[str] = None,
+) -> SnapshotInfo:
+    """Restaura una instantánea en la carpeta de un vectorstore.
+
+    La firma de la cabecera se comprueba antes de extraer nada. Los archivos se
+    extraen en una carpeta provisional a medida que llegan,
+    comprobando el SHA-256 de cada uno, y la carpeta sustituye a la actual solo si
+    todo es correcto. Un delta parte de una copia con enlaces duros de la carpeta
+    actual, que debe estar en la versión `base` del delta.
+
+    Parámetros:
+        folder_path (str): Carpeta del vectorstore (`database/<nombre>`).
+        stream (BinaryIO): Flujo de la instantánea.
+        expected (Dict[str, Any]): Ver `check_compatible`.
+        key (bytes): Clave con que se firmó la instantánea (ver `snapshot_key`).
+        current_version (Optional[str]): Versión del vectorstore local, si existe.
+
+    Retorna:
+        SnapshotInfo: La cabecera de la instantánea importada.
+
+    Lanza:
+        ValueError: Si la instantánea no está firmada con `key`, es incompatible,
+            está dañada o es un delta de otra versión; la carpeta actual no se
+            modifica.
+    """
+    staging = f"{folder_path}.import-{os.getpid()}"
+    shutil.rmtree(staging, ignore_errors=True)
+    try:
+        with tarfile.open(fileobj=stream, mode="r|gz") as tar:
+            info = _read_header(tar, key)
+            check_compatible(info, expected)
+            if info.is_delta:
+                if info.base != current_version:
+                    raise ValueError(
+                        f"El delta parte de la versión '{info.base}' y el vectorstore "
+                        f"local está en '{current_version}'"
+                    )
+                link_tree(folder_path, staging)
+            os.makedirs(staging, exist_ok=True)
+            received = set()
+            while (member := tar.next()) is not None:
+                relative = _member_path(member, info)
+                if relative is None:
+                    continue
+                _extract(
+                    tar, member, os.path.join(staging, relative), info.files[relative]
+                )
+                received.add(relative)
+        _verify(staging, info, received)
+        replace_folder(staging, folder_path)
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+    return info
+
+
+@contextmanager
+def open_input(source: str) -> Iterator[BinaryIO]:
+    """Abre una instantánea desde un archivo, una URL HTTP(S) o `-` (stdin).
+
+    Las descargas se autentican ante el servidor con `SNAPSHOT_TOKEN`.
+    """
+    if source == "-":
+        yield sys.stdin.buffer
+    elif source.startswith(("http://", "https://")):
+        import httpx
+
+        token = os.getenv("SNAPSHOT_TOKEN", "")
+        headers = {"Authorization": f"Bearer {token}"} if token else {}
+        with httpx.stream(
+            "GET", source, headers=headers, timeout=None, follow_redirects=True
+        ) as r:
+            r.raise_for_status()
+            yield io.BufferedReader(_IteratorReader(r.iter_raw(READ_SIZE)), READ_SIZE)
+    else:
+        with open(source, "rb") as file:
+            yield file
+
+
+@contextmanager
+def open_output(destination: str) -> Iterator[BinaryIO]:
+    """Abre el destino de una exportación: un archivo (publicado al terminar) o `-`."""
+    if destination == "-":
+        yield sys.stdout.buffer
+        return
+    if os.path.dirname(destination):
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+    temp_path = f"{destination}.tmp-{os.getpid()}"
+    try:
+        with open(temp_path, "wb") as file:
+            yield file
+        os.replace(temp_path, destination)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+class _IteratorReader(io.RawIOBase):
+    """Flujo de lectura sobre un iterador de bloques de bytes."""
+
+    def __init__(self, blocks: Iterator[bytes]):
+        self._blocks = blocks
+        self._pending = b""
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer: Any) -> int:
+        while not self._pending:
+            self._pending = next(self._blocks, None)
+            if self._pending is None:
+                self._pending = b""
+                return 0
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def _read_header(tar: tarfile.TarFile, key: bytes) -> SnapshotInfo:
+    """Lee la cabecera y su firma, los dos primeros miembros del archivo."""
+    member = tar.next()
+    if member is None or member.name != HEADER_NAME:
+        raise ValueError("La instantánea no empieza por su cabecera")
+    if member.size > MAX_HEADER_SIZE:
+        raise ValueError("Cabecera de la instantánea demasiado grande")
+    header = tar.extractfile(member).read()
+    member = tar.next()
+    if member is None or member.name != SIGNATURE_NAME or member.size > 128:
+        raise ValueError("La instantánea no está firmada")
+    signature = tar.extractfile(member).read().decode("ascii", "replace")
+    if not hmac.compare_digest(signature, _sign(header, key)):
+        raise ValueError(
+            "Firma de la instantánea no válida: no se creó con esta SNAPSHOT_KEY"
+        )
+    return SnapshotInfo.from_dict(json.loads(header))
+
+
+def _sign(header: bytes, key: bytes) -> str:
+    """Firma HMAC-SHA256 de la cabecera, en hexadecimal."""
+    return hmac.new(key, header, hashlib.sha256).hexdigest()
+
+
+def _member_path(member: tarfile.TarInfo, info: SnapshotInfo) -> Optional[str]:
+    """Ruta relativa de un miembro, rechazando las que salen de la carpeta."""
+    if not member.isfile():
+        return None
+    if not member.name.startswith(FILES_PREFIX):
+        raise ValueError(f"Miembro inesperado en la instantánea: '{member.name}'")
+    relative = member.name[len(FILES_PREFIX) :]
+    parts = relative.split("/")
+    if relative.startswith("/") or ".." in parts or relative not in info.files:
+        raise ValueError(f"Ruta no válida en la instantánea: '{member.name}'")
+    return relative
+
+
+def _extract(
+    tar: tarfile.TarFile, member: tarfile.TarInfo, path: str, entry: Dict[str, Any]
+) -> None:
+    """Extrae un archivo comprobando su SHA-256."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    if os.path.exists(path):
+        # Puede ser un enlace duro a la versión actual: no se escribe encima
+        os.remove(path)
+    digest = hashlib.sha256()
+    source = tar.extractfile(member)
+    with open(path, "wb") as file:
+        while block := source.read(READ_SIZE):
+            digest.update(block)
+            file.write(block)
+    if digest.hexdigest() != entry["sha256"]:
+        raise ValueError(f"Suma de comprobación incorrecta: '{member.name}'")
+
+
+def _verify(staging: str, info: SnapshotInfo, received: set) -> None:
+    """Comprueba que la carpeta provisional tiene exactamente los archivos de `info`."""
+    missing = set(info.shipped) - received
+    if missing:
+        raise ValueError(f"Faltan {len(missing)} archivos en la instantánea")
+    present = store_files(staging)
+    for relative in set(present) - set(info.files):
+        # Archivos eliminados desde la versión base del delta
+        os.remove(present.pop(relative))
+    for relative, entry in info.files.items():
+        path = present.get(relative)
+        if path is None or os.path.getsize(path) != entry["size"]:
+            raise ValueError(f"El archivo '{relative}' no coincide con la instantánea")
+
+
+def link_tree(source: str, target: str, copy: Tuple[str, ...] = ()) -> None:
+    """Copia una carpeta con enlaces duros (o copias si no se pueden crear).
+
+    Los archivos cuya ruta relativa empieza por algún prefijo de `copy` se copian
+    siempre: son los que se modifican en el sitio y, enlazados, cambiarían
+    también en la carpeta original.
+    """
+    for relative, path in store_files(source).items():
+        destination = os.path.join(target, relative)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        if relative.startswith(copy):
+            shutil.copy2(path, destination)
+            continue
+        try:
+            os.link(path, destination)
+        except OSError:
+            shutil.copy2(path, destination)
+
+
+def replace_folder(staging: str, folder_path: str) -> None:
+    """Sustituye la carpeta del vectorstore por la provisional de forma atómica.
+
+    La carpeta provisional pasa a ser una generación (`<carpeta>.gen-<id>`) y
+    `folder_path` es un enlace simbólico a la generación vigente, que se
+    sustituye con un único `rename`: quien abre la carpeta ve la generación
+    anterior o la nueva, nunca una carpeta que falta. Una carpeta real (de un
+    vectorstore recién creado o anterior a este formato) se retira justo antes de
+    publicar el enlace. Quien escriba en la carpeta debe tener `store_lock`.
+    """
+    parent = os.path.dirname(folder_path) or "."
+    os.makedirs(parent, exist_ok=True)
+    generation = f"{folder_path}.gen-{uuid.uuid4().hex[:12]}"
+    os.replace(staging, generation)
+    link = f"{folder_path}.link-{os.getpid()}"
+    try:
+        os.symlink(os.path.basename(generation), link, target_is_directory=True)
+    except OSError:
+        # Sin enlaces simbólicos (p. ej. Windows sin privilegios): dos `rename`
+        old_path = f"{folder_path}.old-{os.getpid()}"
+        if os.path.exists(folder_path):
+            os.replace(folder_path, old_path)
+        os.replace(generation, folder_path)
+        shutil.rmtree(old_path, ignore_errors=True)
+        return
+    old_path = None
+    if os.path.islink(folder_path):
+        old_path = os.path.join(parent, os.readlink(folder_path))
+    elif os.path.exists(folder_path):
+        old_path = f"{folder_path}.old-{os.getpid()}"
+        os.replace(folder_path, old_path)
+    os.replace(link, folder_path)
+    if old_path is not None:
+        shutil.rmtree(old_path, ignore_errors=True)
+
+
+def remove_folder(folder_path: str) -> None:
+    """Elimina la carpeta de un vectorstore y, si es un enlace, su generación.
+
+    Lanza:
+        FileNotFoundError: Si la carpeta no existe.
+    """
+    if os.path.islink(folder_path):
+        target = os.path.join(
+            os.path.dirname(folder_path) or ".", os.readlink(folder_path)
+        )
+        os.remove(folder_path)
+        shutil.rmtree(target, ignore_errors=True)
+    else:
+        shutil.rmtree(folder_path)
+
+
+def main() -> None:
+    """Exporta o importa el vectorstore configurado por `VECTORSTORE_NAME`."""
+    from vectorstore.vectorstore_manager import VectorStoreManager
+
+    parser = argparse.ArgumentParser(description=main.__doc__)
+    commands = parser.add_subparsers(dest="command", required=True)
+    export = commands.add_parser("export", help="Exportar una instantánea")
+    export.add_argument("output", help="Archivo de destino, o - para stdout")
+    export.add_argument("--base", help="Instantánea anterior para exportar un delta")
+    load = commands.add_parser("import", help="Importar una instantánea")
+    load.add_argument("source", help="Archivo, URL HTTP(S) o - para stdin")
+    info = commands.add_parser("info", help="Mostrar la cabecera de una instantánea")
+    info.add_argument("source")
+    args = parser.parse_args()
+
+    load_dotenv()
+    if args.command == "info":
+        header = asdict(read_header(args.source, snapshot_key()))
+        header["files"] = len(header["files"])
+        header["shipped"] = len(header["shipped"])
+        print(json.dumps(header, indent=2, ensure_ascii=False))
+        return
+    manager = VectorStoreManager(
+        path=os.getenv("VECTORSTORE_PATH", "derecho_files"),
+        name=os.getenv("VECTORSTORE_NAME", "legislacion_MAX_INNER_PRODUCT"),
+    )
+    start = time.perf_counter()
+    if args.command == "export":
+        result = manager.export_snapshot(args.output, base=args.base)
+    else:
+        result = manager.import_snapshot(args.source)
+    logger.info(
+        f"Instantánea {'delta ' if result.is_delta else ''}{result.store_version}: "
+        f"{len(result.shipped)} de {len(result.files)} archivos "
+        f"({result.size / 1e6:.1f} MB) en {time.perf_counter() - start:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+import json
+import os
+import uuid
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterable, List, Optional
+
+from langchain_community.vectorstores import FAISS as FAISS_STORE
+from langchain_core.documents import Document
+
+# Operaciones del diario a partir de las cuales se reescribe como instantánea
+MIN_JOURNAL_COMPACTION = 1000
+TEXTS_FILE = "catalog_texts.bin"
+# Desplazamiento de los chunks catalogados antes de guardar sus textos
+NO_TEXT = -1
+
+
+@dataclass
+class SourceEntry:
+    """Chunks de una fuente en el vectorstore, en el orden en que se añadieron."""
+
+    source: str
+    chunk_ids: List[str] = field(default_factory=list)
+    chunk_bytes: List[int] = field(default_factory=list)
+    chunk_offsets: List[int] = field(default_factory=list)
+    ingested_at: str = ""
+
+    @property
+    def chunks(self) -> int:
+        """Número de chunks de la fuente."""
+        return len(self.chunk_ids)
+
+    @property
+    def bytes(self) -> int:
+        """Tamaño en bytes (UTF-8) del texto de la fuente."""
+        return sum(self.chunk_bytes)
+
+
+class SourceCatalog:
+    """Catálogo persistente de fuentes (`catalog.jsonl`).
+
+    Asocia cada fuente con los ids de sus chunks en orden, su tamaño y la fecha de
+    ingesta, de modo que listar las fuentes o extraer el texto de una de ellas no
+    requiere recorrer el docstore. Se guarda como un diario de solo añadido (una
+    operación `add` o `remove` por línea, escrita en cada lote) que se reescribe
+    como instantánea cuando acumula demasiadas operaciones.
+
+    Los textos de los chunks se anexan a `catalog_texts.bin` y cada operación
+    `add` guarda su desplazamiento, de modo que `texts` lee los de una fuente sin
+    cargar los segmentos. Al reescribir el diario, si más de la mitad del archivo
+    son textos eliminados, se copian los vigentes a un archivo nuevo, que la
+    instantánea nombra con una operación `texts` antes de borrar el anterior.
+    """
+
+    def __init__(self, path: str):
+        """Inicializa el catálogo y lo carga desde el diario si existe."""
+        self.path = path
+        self.entries: Dict[str, SourceEntry] = {}
+        self._source_by_id: Dict[str, str] = {}
+        self._operations = 0
+        self._texts_file = TEXTS_FILE
+        if os.path.exists(path):
+            self._replay()
+
+    @property
+    def texts_path(self) -> str:
+        """Archivo con los textos de los chunks."""
+        return os.path.join(os.path.dirname(self.path), self._texts_file)
+
+    @property
+    def has_texts(self) -> bool:
+        """Indica si todos los chunks catalogados tienen su texto guardado."""
+        return all(NO_TEXT not in entry.chunk_offsets for entry in self.entries.values())
+
+    def exists(self) -> bool:
+        """Indica si el catálogo está guardado en disco."""
+        return os.path.exists(self.path)
+
+    def sources(self) -> List[str]:
+        """Fuentes del vectorstore."""
+        return list(self.entries)
+
+    def get(self, source: str) -> Optional[SourceEntry]:
+        """Entrada de una fuente, o None si no está en el vectorstore."""
+        return self.entries.get(source)
+
+    @property
+    def total_chunks(self) -> int:
+        """Número total de chunks catalogados."""
+        return len(self._source_by_id)
+
+    def texts(self, source: str) -> Optional[List[str]]:
+        """Textos de los chunks de una fuente, en orden, leídos del disco.
+
+        Retorna:
+            Optional[List[str]]: Los textos, o None si la fuente no está
+            catalogada o alguno de sus chunks se catalogó sin texto.
+        """
+        entry = self.entries.get(source)
+        if entry is None or NO_TEXT in entry.chunk_offsets:
+            return None
+        texts = []
+        with open(self.texts_path, "rb") as file:
+            for offset, size in zip(entry.chunk_offsets, entry.chunk_bytes, strict=True):
+                file.seek(offset)
+                texts.append(file.read(size).decode("utf-8"))
+        return texts
+
+    def add(self, documents: List[Document], ids: List[str]) -> None:
+        """Registra chunks recién añadidos al vectorstore."""
+        # Los textos se escriben antes que la operación que los referencia
+        offsets = self._write_texts([doc.page_content for doc in documents])
+        operations = _add_operations(documents, ids, offsets)
+        for operation in operations:
+            self._apply(operation)
+        self._append(operations)
+
+    def remove(self, ids: Iterable[str]) -> None:
+        """Elimina chunks del catálogo."""
+        ids = [_id for _id in ids if _id in self._source_by_id]
+        if not ids:
+            return
+        operation = {"op": "remove", "ids": ids}
+        self._apply(operation)
+        self._append([operation])
+
+    def rebuild(self, vectorstore: FAISS_STORE) -> None:
+        """Reconstruye el catálogo recorriendo el docstore del vectorstore."""
+        self.entries.clear()
+        self._source_by_id.clear()
+        docstore = vectorstore.docstore
+        ids = [_id for _, _id in sorted(vectorstore.index_to_docstore_id.items())]
+        documents = [docstore.search(_id) for _id in ids]
+        previous = self.texts_path
+        self._texts_file = _new_texts_file()
+        offsets = self._write_texts([doc.page_content for doc in documents])
+        for operation in _add_operations(documents, ids, offsets):
+            self._apply(operation)
+        self.save()
+        _remove(previous)
+
+    def clear(self) -> None:
+        """Vacía el catálogo en memoria."""
+        self.entries.clear()
+        self._source_by_id.clear()
+        self._operations = 0
+        self._texts_file = TEXTS_FILE
+
+    def save(self) -> None:
+        """Reescribe el diario como una instantánea (una operación por fuente)."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        previous = self._compact_texts()
+        temp_path = self.path + ".tmp"
+        with open(temp_path, "w", encoding="utf-8") as file:
+            texts = {"op": "texts", "file": self._texts_file}
+            file.write(json.dumps(texts) + "\n")
+            for entry in self.entries.values():
+                file.write(json.dumps(_snapshot(entry), ensure_ascii=False) + "\n")
+        os.replace(temp_path, self.path)
+        self._operations = len(self.entries)
+        if previous is not None:
+            _remove(previous)
+
+    def _write_texts(self, texts: List[str]) -> List[int]:
+        """Anexa textos al archivo de textos y devuelve sus desplazamientos."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        offsets = []
+        with open(self.texts_path, "ab") as file:
+            offset = file.seek(0, os.SEEK_END)
+            for text in texts:
+                offsets.append(offset)
+                offset += file.write(text.encode("utf-8"))
+        return offsets
+
+    def _compact_texts(self) -> Optional[str]:
+        """Copia los textos vigentes a un archivo nuevo si sobran más de la mitad.
+
+        Retorna:
+            Optional[str]: El archivo anterior, que se borra cuando la instantánea
+            del diario ya nombra el nuevo; None si no se ha compactado.
+        """
+        try:
+            size = os.path.getsize(self.texts_path)
+        except FileNotFoundError:
+            return None
+        live = sum(
+            size
+            for entry in self.entries.values()
+            for size, offset in zip(entry.chunk_bytes, entry.chunk_offsets, strict=True)
+            if offset != NO_TEXT
+        )
+        if size <= 2 * live:
+            return None
+        previous = self.texts_path
+        self._texts_file = _new_texts_file()
+        with open(previous, "rb") as source, open(self.texts_path, "wb") as target:
+            for entry in self.entries.values():
+                offsets = []
+                for size, offset in zip(
+                    entry.chunk_bytes, entry.chunk_offsets, strict=True
+                ):
+                    if offset == NO_TEXT:
+                        offsets.append(NO_TEXT)
+                        continue
+                    source.seek(offset)
+                    offsets.append(target.tell())
+                    target.write(source.read(size))
+                entry.chunk_offsets = offsets
+        return previous
+
+    def _apply(self, operation: Dict[str, Any]) -> None:
+        if operation["op"] == "texts":
+            self._texts_file = operation["file"]
+            return
+        if operation["op"] == "add":
+            source = operation["source"]
+            entry = self.entries.setdefault(source, SourceEntry(source))
+            entry.chunk_ids.extend(operation["ids"])
+            entry.chunk_bytes.extend(operation["bytes"])
+            # Diarios anteriores a los textos: no hay desplazamientos
+            entry.chunk_offsets.extend(
+                operation.get("offsets", [NO_TEXT] * len(operation["ids"]))
+            )
+            entry.ingested_at = operation["at"]
+            for _id in operation["ids"]:
+                self._source_by_id[_id] = source
+            return
+
+        removed: Dict[str, set] = defaultdict(set)
+        for _id in operation["ids"]:
+            source = self._source_by_id.pop(_id, None)
+            if source is not None:
+                removed[source].add(_id)
+        for source, ids in removed.items():
+            entry = self.entries[source]
+            kept = [
+                chunk
+                for chunk in zip(
+                    entry.chunk_ids, entry.chunk_bytes, entry.chunk_offsets, strict=True
+                )
+                if chunk[0] not in ids
+            ]
+            if not kept:
+                del self.entries[source]
+                continue
+            entry.chunk_ids = [_id for _id, _, _ in kept]
+            entry.chunk_bytes = [size for _, size, _ in kept]
+            entry.chunk_offsets = [offset for _, _, offset in kept]
+
+    def _append(self, operations: List[Dict[str, Any]]) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with open(self.path, "a", encoding="utf-8") as file:
+            for operation in operations:
+                file.write(json.dumps(operation, ensure_ascii=False) + "\n")
+        self._operations += len(operations)
+        if self._operations > max(MIN_JOURNAL_COMPACTION, 4 * len(self.entries)):
+            self.save()
+
+    def _replay(self) -> None:
+        with open(self.path, encoding="utf-8") as file:
+            for line in file:
+                if not line.strip():
+                    continue
+                try:
+                    operation = json.loads(line)
+                except json.JSONDecodeError:
+                    # Línea incompleta por una escritura interrumpida
+                    break
+                self._apply(operation)
+                self._operations += 1
+
+
+def _add_operations(
+    documents: List[Document], ids: List[str], offsets: List[int]
+) -> List[Dict[str, Any]]:
+    """Agrupa por fuente los chunks añadidos en operaciones `add` del diario."""
+    grouped: Dict[str, Dict[str, list]] = defaultdict(
+        lambda: {"ids": [], "bytes": [], "offsets": []}
+    )
+    for doc, _id, offset in zip(documents, ids, offsets, strict=True):
+        group = grouped[doc.metadata.get("source", "")]
+        group["ids"].append(_id)
+        group["bytes"].append(len(doc.page_content.encode("utf-8")))
+        group["offsets"].append(offset)
+    now = datetime.now(timezone.utc).isoformat()
+    return [
+        {"op": "add", "source": source, "at": now, **group}
+        for source, group in grouped.items()
+    ]
+
+
+def _snapshot(entry: SourceEntry) -> Dict[str, Any]:
+    return {
+        "op": "add",
+        "source": entry.source,
+        "at": entry.ingested_at,
+        "ids": entry.chunk_ids,
+        "bytes": entry.chunk_bytes,
+        "offsets": entry.chunk_offsets,
+    }
+
+
+def _new_texts_file() -> str:
+    return f"catalog_texts-{uuid.uuid4().hex[:8]}.bin"
+
+
+def _remove(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,102 @@
+import os
+import sqlite3
+import threading
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from vectorstore.vector_rows import VectorRows
+
+
+class VectorFile:
+    """Vectores float32 de precisión completa en disco, indexados por id de chunk.
+
+    Acompaña a los índices cuantizados (`SQ_FP16`, `SQ8`, `PQ`, `IVF_PQ`) para
+    re-puntuar de forma exacta los mejores candidatos sin mantener los vectores
+    completos en memoria: la matriz (`VectorRows`, en bloques `vectors-*.f32`) se
+    lee mapeada en memoria y `ids.sqlite` asocia cada id con su fila. Las filas de
+    los chunks eliminados se reutilizan en los siguientes lotes. La carpeta se
+    crea con el primer lote.
+    """
+
+    def __init__(self, folder_path: str):
+        """Abre el almacén de la carpeta indicada, si existe."""
+        self.folder_path = folder_path
+        self._lock = threading.Lock()
+        self._connection: Optional[sqlite3.Connection] = None
+        self._rows = VectorRows(folder_path, self._db)
+
+    def __len__(self) -> int:
+        """Número de vectores guardados."""
+        with self._lock:
+            if not self._rows.exists:
+                return 0
+            return self._db().execute("SELECT COUNT(*) FROM ids").fetchone()[0]
+
+    def add(self, ids: List[str], vectors: List[List[float]]) -> None:
+        """Guarda los vectores de los chunks indicados."""
+        if not ids:
+            return
+        matrix = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            rows = self._rows.write(matrix)
+            self._db().executemany(
+                "INSERT OR REPLACE INTO ids (id, row) VALUES (?, ?)",
+                list(zip(ids, rows, strict=True)),
+            )
+            self._db().commit()
+
+    def get(self, ids: List[str]) -> Optional[np.ndarray]:
+        """Vectores de los ids indicados, en orden, o None si falta alguno."""
+        if not ids:
+            return None
+        with self._lock:
+            if not self._rows.exists:
+                return None
+            rows = self._lookup(ids)
+            if len(rows) < len(set(ids)):
+                return None
+            return self._rows.read([rows[_id] for _id in ids])
+
+    def delete(self, ids: List[str]) -> None:
+        """Elimina los vectores de los ids indicados y libera sus filas."""
+        with self._lock:
+            if not self._rows.exists:
+                return
+            self._rows.free(self._lookup(ids).values())
+            for start in range(0, len(ids), 500):
+                part = ids[start : start + 500]
+                placeholders = ",".join("?" * len(part))
+                self._db().execute(f"DELETE FROM ids WHERE id IN ({placeholders})", part)
+            self._db().commit()
+
+    def clear(self) -> None:
+        """Elimina todos los vectores."""
+        with self._lock:
+            if not self._rows.exists:
+                return
+            self._db().execute("DELETE FROM ids")
+            self._rows.clear()
+            self._db().commit()
+
+    def _lookup(self, ids: List[str]) -> Dict[str, int]:
+        """Fila de cada id guardado."""
+        rows = {}
+        for start in range(0, len(ids), 500):
+            part = ids[start : start + 500]
+            query = "SELECT id, row FROM ids WHERE id IN ({})".format(
+                ",".join("?" * len(part))
+            )
+            rows.update(self._db().execute(query, part).fetchall())
+        return rows
+
+    def _db(self) -> sqlite3.Connection:
+        if self._connection is None:
+            os.makedirs(self.folder_path, exist_ok=True)
+            self._connection = sqlite3.connect(
+                os.path.join(self.folder_path, "ids.sqlite"), check_same_thread=False
+            )
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS ids (id TEXT PRIMARY KEY, row INTEGER)"
+            )
+        return self._connection
@@ -0,0 +1,232 @@
+import json
+import os
+import shutil
+import sqlite3
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+INITIAL_CAPACITY = 1024
+# Filas máximas de un bloque: por encima, la matriz crece con bloques de este tamaño
+BLOCK_ROWS = 16384
+
+
+class VectorRows:
+    """Matriz float32 en disco cuyas filas se asignan y se reutilizan.
+
+    Es el almacenamiento común de `VectorFile` y `CachedEmbeddings`:
+
+    - `vectors-000000.f32`, `vectors-000001.f32`…: bloques de filas mapeados en
+      memoria. La matriz crece añadiendo bloques (del doble de filas hasta
+      `BLOCK_ROWS`), sin reescribir los que ya existen.
+    - `meta.json`: dimensión y archivo y filas de cada bloque.
+    - Tablas `row_count` y `free_rows` de la base SQLite del propietario: filas
+      usadas y filas liberadas, que se reutilizan antes de crecer. El propietario
+      guarda en la misma base qué fila ocupa cada clave, de modo que todo se
+      confirma junto.
+
+    Un bloque enlazado con enlaces duros desde otra carpeta (la copia de trabajo
+    del trabajador de ingesta) se copia antes de escribir en él, de modo que la
+    otra carpeta no cambia: copiar la carpeta solo duplica los bloques que se
+    modifican después, normalmente el último.
+
+    Varios procesos pueden compartir la carpeta: `write` abre una transacción
+    `BEGIN IMMEDIATE`, que retiene el bloqueo de escritura de la base hasta que
+    el propietario confirma, y vuelve a leer los bloques antes de asignar filas.
+    No es segura entre hilos: el propietario serializa los accesos. La matriz se
+    crea con las primeras filas.
+    """
+
+    def __init__(self, folder_path: str, db: Callable[[], sqlite3.Connection]):
+        """Abre la matriz de la carpeta indicada, si existe.
+
+        Parámetros:
+            folder_path (str): Carpeta de los bloques y `meta.json`.
+            db (Callable[[], sqlite3.Connection]): Conexión a la base del
+                propietario, que se pide solo al asignar o liberar filas.
+        """
+        self.folder_path = folder_path
+        self._db = db
+        self._meta: Dict[str, Any] = {}
+        self._blocks: List[np.memmap] = []
+        self._starts = np.zeros(0, dtype=np.int64)
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._tables_ready = False
+        self._reload()
+
+    @property
+    def exists(self) -> bool:
+        """Indica si la matriz ya se ha creado (en este u otro proceso)."""
+        if not self._meta:
+            self._reload()
+        return bool(self._meta)
+
+    @property
+    def capacity(self) -> int:
+        """Filas reservadas en los bloques."""
+        return sum(block["rows"] for block in self._meta.get("blocks", []))
+
+    def read(self, rows: List[int]) -> np.ndarray:
+        """Vectores de las filas indicadas, en orden.
+
+        Si otro proceso ha añadido o copiado bloques, se vuelven a mapear.
+        """
+        self._reload()
+        positions = np.asarray(rows, dtype=np.int64)
+        matrix = np.empty((len(positions), self._meta["dimension"]), dtype=np.float32)
+        blocks = np.searchsorted(self._starts, positions, side="right") - 1
+        for block in np.unique(blocks):
+            mask = blocks == block
+            matrix[mask] = self._blocks[block][positions[mask] - self._starts[block]]
+        return matrix
+
+    def write(self, matrix: np.ndarray) -> List[int]:
+        """Guarda las filas de `matrix` (float32) en filas libres o nuevas.
+
+        Retorna:
+            List[int]: Fila asignada a cada vector, en orden. El propietario
+            confirma la transacción de su base, que libera el bloqueo.
+        """
+        connection = self._connection()
+        if not connection.in_transaction:
+            connection.execute("BEGIN IMMEDIATE")
+        # Otro proceso puede haber creado o hecho crecer la matriz
+        self._reload()
+        if not self._meta:
+            os.makedirs(self.folder_path, exist_ok=True)
+            self._meta = {"dimension": matrix.shape[1], "blocks": []}
+            self._grow(INITIAL_CAPACITY)
+        rows = self._allocate(len(matrix))
+        positions = np.asarray(rows, dtype=np.int64)
+        blocks = np.searchsorted(self._starts, positions, side="right") - 1
+        for block in np.unique(blocks):
+            self._detach(block)
+            mask = blocks == block
+            self._blocks[block][positions[mask] - self._starts[block]] = matrix[mask]
+            self._blocks[block].flush()
+        return rows
+
+    def free(self, rows: Iterable[int]) -> None:
+        """Marca filas como libres para los siguientes `write`."""
+        self._connection().executemany(
+            "INSERT OR IGNORE INTO free_rows (row) VALUES (?)", [(row,) for row in rows]
+        )
+
+    def clear(self) -> None:
+        """Libera todas las filas (el propietario vacía sus claves)."""
+        self._connection().execute("DELETE FROM free_rows")
+        self._connection().execute("UPDATE row_count SET size = 0")
+
+    def _connection(self) -> sqlite3.Connection:
+        connection = self._db()
+        if not self._tables_ready:
+            pending = connection.in_transaction
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS free_rows (row INTEGER PRIMARY KEY)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS row_count "
+                "(id INTEGER PRIMARY KEY CHECK (id = 0), size INTEGER NOT NULL)"
+            )
+            # Las versiones anteriores guardaban las filas usadas en `meta.json`
+            connection.execute(
+                "INSERT OR IGNORE INTO row_count (id, size) VALUES (0, ?)",
+                (self._meta.get("size", 0),),
+            )
+            if not pending:
+                connection.commit()
+            self._tables_ready = True
+        return connection
+
+    def _reload(self) -> None:
+        """Lee `meta.json` si ha cambiado y mapea los bloques nuevos o copiados."""
+        meta_path = os.path.join(self.folder_path, "meta.json")
+        try:
+            stat = os.stat(meta_path)
+        except FileNotFoundError:
+            return
+        signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        if signature == self._signature:
+            return
+        with open(meta_path, encoding="utf-8") as file:
+            meta = json.load(file)
+        if "blocks" not in meta:
+            # Las versiones anteriores guardaban la matriz en un único archivo
+            meta["blocks"] = [{"file": "vectors.f32", "rows": meta.pop("capacity")}]
+        self._signature = signature
+        self._meta = meta
+        self._map()
+
+    def _allocate(self, count: int) -> List[int]:
+        free = [
+            row
+            for (row,) in self._connection().execute(
+                "SELECT row FROM free_rows ORDER BY row LIMIT ?", (count,)
+            )
+        ]
+        self._connection().executemany(
+            "DELETE FROM free_rows WHERE row = ?", [(row,) for row in free]
+        )
+        (size,) = self._connection().execute("SELECT size FROM row_count").fetchone()
+        rows = free + list(range(size, size + count - len(free)))
+        size += count - len(free)
+        self._connection().execute("UPDATE row_count SET size = ?", (size,))
+        if size > self.capacity:
+            self._grow(size)
+        return rows
+
+    def _grow(self, minimum: int) -> None:
+        """Añade bloques hasta tener al menos `minimum` filas."""
+        while self.capacity < minimum:
+            rows = min(max(self.capacity, INITIAL_CAPACITY), BLOCK_ROWS)
+            name = f"vectors-{len(self._meta['blocks']):06d}.f32"
+            path = os.path.join(self.folder_path, name)
+            # Un resto de un intento anterior puede estar enlazado con otra carpeta
+            if os.path.exists(path):
+                os.remove(path)
+            with open(path, "wb") as file:
+                file.truncate(rows * self._meta["dimension"] * 4)
+            self._meta["blocks"].append({"file": name, "rows": rows})
+        self._save_meta()
+        self._map()
+
+    def _detach(self, block: int) -> None:
+        """Copia el bloque antes de escribir en él si otra carpeta lo enlaza."""
+        name = self._meta["blocks"][block]["file"]
+        path = os.path.join(self.folder_path, name)
+        if os.stat(path).st_nlink == 1:
+            return
+        copy_name = f"vectors-{block:06d}-{uuid.uuid4().hex[:8]}.f32"
+        shutil.copyfile(path, os.path.join(self.folder_path, copy_name))
+        self._meta["blocks"][block]["file"] = copy_name
+        self._save_meta()
+        self._map()
+        os.remove(path)
+
+    def _map(self) -> None:
+        """Mapea los bloques de `meta.json`, reutilizando los ya mapeados."""
+        mapped = {os.path.basename(block.filename): block for block in self._blocks}
+        self._blocks = [
+            mapped[block["file"]]
+            if len(mapped.get(block["file"], ())) == block["rows"]
+            else np.memmap(
+                os.path.join(self.folder_path, block["file"]),
+                dtype=np.float32,
+                mode="r+",
+                shape=(block["rows"], self._meta["dimension"]),
+            )
+            for block in self._meta["blocks"]
+        ]
+        self._starts = np.cumsum(
+            [0] + [block["rows"] for block in self._meta["blocks"][:-1]], dtype=np.int64
+        )
+
+    def _save_meta(self) -> None:
+        path = os.path.join(self.folder_path, "meta.json")
+        meta = {"dimension": self._meta["dimension"], "blocks": self._meta["blocks"]}
+        with open(path + ".tmp", "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+        os.replace(path + ".tmp", path)
+        stat = os.stat(path)
+        self._signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
@@ -1,147 +1,1165 @@
 import os
 import shutil
-from typing import Any, List, Optional
-from zipfile import ZipFile
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Any, BinaryIO, Dict, Iterator, List, Optional, Tuple, Union
 
 import faiss
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+import numpy as np
 from langchain_community.docstore.in_memory import InMemoryDocstore
 from langchain_community.vectorstores import FAISS as FAISS_STORE
 from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from loguru import logger
 
+from telemetry.instruments import (
+    INGESTED_BYTES,
+    INGESTED_CHUNKS,
+    SEARCH_QUERIES,
+    SEARCH_RESULT_BYTES,
+    SEARCH_RESULTS,
+    record_cache,
+    utf8_len,
+)
+from telemetry.tracing import span, traced, traced_iter
 from vectorstore.distance_strategy import DistanceStrategyManager
 from vectorstore.document_processor import DocumentProcessor
-from vectorstore.embeddings import EmbeddingManager
+from vectorstore.embeddings import EmbeddingManager, embed_queries, embedding_model_id
+from vectorstore.file_manifest import FileManifest, ManifestDiff, file_fingerprint
+from vectorstore.index_factory import (
+    IndexFactory,
+    IndexReport,
+    index_kind,
+    recall_latency_report,
+)
+from vectorstore.ingestion_pipeline import IngestionPipeline, IngestProgress
+from vectorstore.legal_splitter import LegalTextSplitter, chunk_id
+from vectorstore.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from vectorstore.metadata_index import (
+    Filter,
+    MetadataIndex,
+    filter_key,
+    normalize_filter,
+)
+from vectorstore.mmap_store import load_snapshot, snapshot_version, write_snapshot
+from vectorstore.query_cache import QueryCache
+from vectorstore.search_result import SearchResult
+from vectorstore.segment_store import SegmentStore, delete_documents, store_lock
+from vectorstore.snapshot_archive import (
+    SnapshotInfo,
+    export_snapshot,
+    import_snapshot,
+    open_input,
+    open_output,
+    read_header,
+    remove_folder,
+    snapshot_key,
+)
+from vectorstore.source_catalog import SourceCatalog
+from vectorstore.vector_file import VectorFile
+
+# Candidatos a recuperar antes de filtrar por fuente (igual que LangChain)
+FETCH_K = 20
+SEARCH_MODES = ("dense", "lexical", "hybrid")
+# Cargas de una generación nueva antes de desistir si se sustituye mientras tanto
+REOPEN_ATTEMPTS = 3
 
 
 class VectorStoreManager:
     """Clase para gestionar los vectorstore de FAISS."""
 
-    def __init__(self, path: str, name: str):
-        """Inicialización de la clase con configuración específica."""
+    def __init__(
+        self,
+        path: str,
+        name: str,
+        read_only: Optional[bool] = None,
+        embeddings: Optional[Embeddings] = None,
+    ):
+        """Inicialización de la clase con configuración específica.
+
+        Parámetros:
+            path (str): Carpeta de los documentos a indexar.
+            name (str): Nombre del vectorstore en `database/`.
+            read_only (Optional[bool]): Modo de servicio de solo lectura, que abre
+                una instantánea mapeada en memoria (`VECTORSTORE_READ_ONLY`).
+            embeddings (Optional[Embeddings]): Modelo de embeddings; por defecto, el
+                de `EmbeddingManager`.
+        """
         self.path = path
         self.name = name
-        self.embeddings = EmbeddingManager.get_embeddings()
+        if read_only is None:
+            read_only = os.getenv("VECTORSTORE_READ_ONLY", "0") == "1"
+        self.read_only = read_only
+        self.embeddings = embeddings or EmbeddingManager.get_embeddings()
         self.manager_strategy = DistanceStrategyManager()
         self.strategy = self.manager_strategy.strategy
-        self.vectorstore = None
+        self.index_factory = IndexFactory(self.strategy)
+        self.segments = SegmentStore(
+            os.path.join("database", self.name),
+            embeddings=self.embeddings,
+            relevance_score_fn=self.index_factory.relevance_score_fn(),
+            distance_strategy=self.strategy,
+        )
+        self.file_manifest = FileManifest(
+            os.path.join("database", self.name, "files.json")
+        )
+        self.lexical_index = LexicalIndex(os.path.join("database", self.name, "lexical"))
+        self.search_mode = os.getenv("SEARCH_MODE", "dense").lower()
+        self.catalog = SourceCatalog(os.path.join("database", self.name, "catalog.jsonl"))
+        # Vectores completos en disco para re-puntuar los índices cuantizados
+        self.full_vectors = self._open_full_vectors()
+        # División por artículos, compartida por todas las vías de ingesta
+        self.text_splitter = LegalTextSplitter()
+        # El índice FAISS se carga (o se crea vacío) en el primer uso
+        self._vectorstore: Optional[FAISS_STORE] = None
+        self.query_cache = QueryCache()
+        # Se incrementa con cada cambio del índice e invalida los resultados en caché
+        self.index_version = 0
+        # Versión en disco que reflejan el índice y los archivos en memoria (ver
+        # `reopen` y `_writing`)
+        self._loaded_version = self.segments.version()
+        # Escrituras en curso que tienen el bloqueo del vectorstore
+        self._writers = 0
+        # Índice invertido de metadatos para las búsquedas filtradas
+        self.metadata_index = MetadataIndex()
+        self._metadata_index_stale = True
+        # Lotes retenidos hasta reunir la muestra de entrenamiento de índices IVF
+        self._pending_batches: List[tuple] = []
+        # Ids de los chunks añadidos por fuente, para el manifiesto de archivos
+        self._chunk_ids_by_source: Dict[str, List[str]] = defaultdict(list)
+        self.failed_files: List[str] = []
 
-        # Inicialización del índice FAISS
-        self._initialize_vectorstore()
+    @property
+    def vectorstore(self) -> FAISS_STORE:
+        """Vectorstore FAISS, cargado desde disco (o creado vacío) en el primer uso."""
+        if self._vectorstore is None:
+            self._vectorstore = self.load_vectorstore()
+        return self._vectorstore
 
-    def _initialize_vectorstore(self):
-        """Inicializa el vectorstore con configuración básica."""
-        if self.exist_vectorstore():
-            self.vectorstore = self.load_vectorstore()
-        else:
-            # Crear índice base con dimensión correcta
-            dummy_embed = self.embeddings.embed_query(
-                "Propiedad de Jairo Daniel Mendoza Torres"
+    @vectorstore.setter
+    def vectorstore(self, vectorstore: Optional[FAISS_STORE]) -> None:
+        self._vectorstore = vectorstore
+
+    def _open_full_vectors(self) -> Optional[VectorFile]:
+        """Abre los vectores completos si el índice cuantizado se re-puntúa."""
+        if not (self.index_factory.is_quantized and self.index_factory.rerank_k):
+            return None
+        return VectorFile(os.path.join("database", self.name, "vectors"))
+
+    def _empty_vectorstore(self, index: Any) -> FAISS_STORE:
+        """Crea un vectorstore vacío sobre el índice indicado."""
+        return FAISS_STORE(
+            embedding_function=self.embeddings,
+            index=index,
+            docstore=InMemoryDocstore(),
+            index_to_docstore_id={},
+            relevance_score_fn=self.index_factory.relevance_score_fn(),
+            distance_strategy=self.strategy,
+        )
+
+    def _add_embeddings(
+        self, documents: List[Document], vectors: List[List[float]]
+    ) -> List[str]:
+        """Añade documentos ya vectorizados y entrena el índice si hace falta.
+
+        Los ids son deterministas (`chunk_id`): los chunks que ya están en el
+        índice, o repetidos en el lote, no se vuelven a añadir.
+        """
+        with self._writing():
+            documents, vectors = self._new_chunks(documents, vectors)
+            if not documents:
+                return []
+            index = self.vectorstore.index
+            if not index.is_trained:
+                matrix = np.asarray(vectors, dtype=np.float32)
+                if index.ntotal == 0:
+                    # Dimensionar nlist con el primer lote en lugar del valor por defecto
+                    index = self.index_factory.build(
+                        matrix.shape[1], n_vectors=len(matrix)
+                    )
+                    self.vectorstore.index = index
+                self.index_factory.train(index, matrix)
+
+            # El lote se persiste como un segmento propio con los mismos ids
+            batch = self._empty_vectorstore(self.segments.empty_index(like=index))
+            start = index.ntotal
+            ids = self.vectorstore.add_embeddings(
+                text_embeddings=zip(
+                    [doc.page_content for doc in documents], vectors, strict=True
+                ),
+                metadatas=[doc.metadata for doc in documents],
+                ids=[chunk_id(doc) for doc in documents],
+            )
+            batch.add_embeddings(
+                text_embeddings=zip(
+                    [doc.page_content for doc in documents], vectors, strict=True
+                ),
+                metadatas=[doc.metadata for doc in documents],
+                ids=ids,
+            )
+            self._save_vectorstore(batch)
+            if self.full_vectors is not None:
+                self.full_vectors.add(ids, vectors)
+            self.catalog.add(documents, ids)
+            self.lexical_index.add(ids, [doc.page_content for doc in documents])
+            if not self._metadata_index_stale:
+                self.metadata_index.add([doc.metadata for doc in documents], start)
+            if self.index_factory.needs_retrain(
+                self.vectorstore.index, self.vectorstore.index.ntotal
+            ):
+                self._retrain_index()
+            self._bump_index_version()
+            for doc, _id in zip(documents, ids, strict=True):
+                self._chunk_ids_by_source[doc.metadata.get("source")].append(_id)
+            INGESTED_CHUNKS.inc(len(documents))
+            INGESTED_BYTES.inc(sum(utf8_len(doc.page_content) for doc in documents))
+            return ids
+
+    def _retrain_index(self) -> None:
+        """Reconstruye el índice con el corpus actual y lo guarda como un segmento.
+
+        El primer lote puede no bastar para entrenar el índice configurado (ver
+        `IndexFactory.needs_retrain`); el índice entrenado con él se sustituye
+        cuando el corpus ha crecido lo suficiente.
+        """
+        vectorstore = self.vectorstore
+        previous = index_kind(vectorstore.index)
+        ids = [
+            vectorstore.index_to_docstore_id[i] for i in range(vectorstore.index.ntotal)
+        ]
+        corpus = self._corpus_vectors(ids)
+        index = self.index_factory.build(corpus.shape[1], n_vectors=len(corpus))
+        self.index_factory.train(index, corpus)
+        index.add(corpus)
+        vectorstore.index = index
+        self.segments.rebuild(vectorstore)
+        self._metadata_index_stale = True
+        ivf = faiss.try_extract_index_ivf(index)
+        logger.info(
+            f"Índice de '{self.name}' reentrenado con {len(corpus)} vectores: "
+            f"{previous} → {index_kind(index)}"
+            + (f" (nlist={ivf.nlist})" if ivf is not None else "")
+        )
+
+    def _corpus_vectors(self, ids: List[str]) -> np.ndarray:
+        """Vectores de los chunks indicados, sin recalcularlos si es posible."""
+        corpus = self.full_vectors.get(ids) if self.full_vectors is not None else None
+        positions = {
+            _id: pos for pos, _id in self.vectorstore.index_to_docstore_id.items()
+        }
+        try:
+            if corpus is None:
+                corpus = self.vectorstore.index.reconstruct_batch(
+                    np.asarray([positions[_id] for _id in ids], dtype=np.int64)
+                )
+        except RuntimeError:
+            # Los índices IVF y PQ no conservan los vectores originales
+            texts = [self.vectorstore.docstore.search(_id).page_content for _id in ids]
+            corpus = np.asarray(self.embeddings.embed_documents(texts), dtype=np.float32)
+        return np.ascontiguousarray(corpus, dtype=np.float32)
+
+    def _new_chunks(
+        self, documents: List[Document], vectors: List[List[float]]
+    ) -> Tuple[List[Document], List[List[float]]]:
+        """Descarta los chunks cuyo id ya está en el índice o repetido en el lote."""
+        docstore = self.vectorstore.docstore
+        seen = set()
+        keep = []
+        for i, doc in enumerate(documents):
+            _id = chunk_id(doc)
+            if _id in seen or isinstance(docstore.search(_id), Document):
+                continue
+            seen.add(_id)
+            keep.append(i)
+        if len(keep) == len(documents):
+            return documents, vectors
+        logger.debug(f"{len(documents) - len(keep)} chunks ya indexados omitidos")
+        return [documents[i] for i in keep], [vectors[i] for i in keep]
+
+    def _ingest(
+        self,
+        path: str,
+        files: Optional[List[str]] = None,
+        progress: Optional[IngestProgress] = None,
+    ) -> int:
+        """Ingiere en streaming los archivos de una carpeta (o solo los indicados).
+
+        Los archivos que no se pueden analizar se añaden a `failed_files`.
+
+        Retorna:
+            int: Número de chunks añadidos al vectorstore.
+        """
+        processor = DocumentProcessor(path)
+        write = self._write_batch
+        if progress is not None:
+
+            def write(documents: List[Document], vectors: List[List[float]]) -> None:
+                self._write_batch(documents, vectors)
+                progress.batch_written(len(documents))
+
+        # Cada etapa se mide por separado en `rag_stage_seconds`; los archivos se
+        # dividen en los procesos que los analizan
+        pipeline = IngestionPipeline(
+            split=None,
+            embed=traced("ingest.embed", self.embeddings.embed_documents),
+            write=traced("ingest.write", write),
+        )
+        documents = processor.iter_documents(files, self.text_splitter.split_documents)
+        if progress is not None:
+            documents = progress.track(documents, processor.failed_files)
+        start = time.perf_counter()
+        with span("ingest", path=path) as current:
+            count = pipeline.run(traced_iter("ingest.parse", documents))
+            self._flush_pending_batches()
+            current.set("chunks", count)
+        self.failed_files.extend(processor.failed_files)
+        elapsed = time.perf_counter() - start
+        if count and elapsed:
+            logger.info(
+                f"Ingesta: {count} chunks en {elapsed:.1f} s "
+                f"({count / elapsed:.1f} chunks/s)"
+            )
+        return count
+
+    def _write_batch(self, documents: List[Document], vectors: List[List[float]]) -> None:
+        """Añade un lote, reteniéndolo si el índice aún necesita entrenarse."""
+        if self.vectorstore.index.is_trained and not self._pending_batches:
+            self._add_embeddings(documents, vectors)
+            return
+        self._pending_batches.append((documents, vectors))
+        pending = sum(len(batch) for batch, _ in self._pending_batches)
+        if pending >= self.index_factory.train_sample:
+            self._flush_pending_batches()
+
+    def _flush_pending_batches(self) -> None:
+        if not self._pending_batches:
+            return
+        documents = [doc for batch, _ in self._pending_batches for doc in batch]
+        vectors = [vec for _, batch in self._pending_batches for vec in batch]
+        self._pending_batches = []
+        self._add_embeddings(documents, vectors)
+
+    def detect_changes(
+        self,
+        path: Optional[str] = None,
+        detect_deletions: bool = True,
+        files: Optional[List[str]] = None,
+    ) -> ManifestDiff:
+        """Detecta en una sola pasada los archivos nuevos, modificados o eliminados.
+
+        Parámetros:
+            path (Optional[str]): Carpeta a comparar; por defecto `self.path`.
+            detect_deletions (bool): Si es True, los archivos registrados de la
+                carpeta que ya no existen se marcan como eliminados.
+            files (Optional[List[str]]): Archivos de la carpeta que corresponden a
+                este vectorstore (p. ej. los de un shard); por defecto, todos.
+
+        Retorna:
+            ManifestDiff: Los cambios respecto al manifiesto de archivos.
+        """
+        path = path or self.path
+        if files is None:
+            files = DocumentProcessor(path).list_files()
+        if not self.file_manifest.exists():
+            self._bootstrap_file_manifest(files)
+        return self.file_manifest.diff(files, root=path if detect_deletions else None)
+
+    def apply_changes(
+        self, diff: ManifestDiff, progress: Optional[IngestProgress] = None
+    ) -> ManifestDiff:
+        """Reindexa solo lo que ha cambiado según `diff`.
+
+        Los chunks de los archivos eliminados o modificados se eliminan por id, los
+        archivos renombrados conservan sus embeddings, las copias de un archivo ya
+        indexado se indexan con su propia fuente reutilizando los embeddings del
+        original y solo los archivos nuevos o modificados pasan por el pipeline de
+        ingesta. Los que no se pueden analizar
+        quedan en `failed_files` y no se registran en el manifiesto de archivos.
+
+        Parámetros:
+            diff (ManifestDiff): Cambios detectados con `detect_changes`.
+            progress (Optional[IngestProgress]): Avance por archivo y por lote.
+        """
+        with self._writing():
+            self.failed_files = []
+            # Antes de eliminar nada: el original de una copia puede estar modificado
+            for path, original in diff.duplicates.items():
+                record = self.file_manifest.records.get(original)
+                if record is None:
+                    # Ya no está registrado: otro proceso ha cambiado el vectorstore
+                    diff.added.append(path)
+                    continue
+                ids = self._copy_source(record.chunk_ids, path)
+                self.file_manifest.record(path, diff.fingerprints[path], ids)
+
+            for path in diff.deleted + diff.changed:
+                record = self.file_manifest.remove(path)
+                if record:
+                    self.delete_documents(record.chunk_ids)
+
+            for new_path, old_path in diff.renamed.items():
+                record = self.file_manifest.remove(old_path)
+                if record is None:
+                    # Ya no está registrado: otro proceso ha cambiado el vectorstore
+                    diff.added.append(new_path)
+                    continue
+                ids = self._move_source(record.chunk_ids, new_path)
+                self.file_manifest.record(new_path, diff.fingerprints[new_path], ids)
+
+            to_ingest = diff.added + diff.changed
+            if to_ingest:
+                self._chunk_ids_by_source.clear()
+                for folder in sorted({os.path.dirname(path) for path in to_ingest}):
+                    files = [
+                        path for path in to_ingest if os.path.dirname(path) == folder
+                    ]
+                    self._ingest(folder, files, progress)
+                for path in to_ingest:
+                    if path not in self.failed_files:
+                        self.file_manifest.record(
+                            path, diff.fingerprints[path], self._chunk_ids_by_source[path]
+                        )
+
+            for path in diff.unchanged:
+                # Actualizar la fecha de modificación para no volver a calcular el hash
+                if path in diff.fingerprints:
+                    record = self.file_manifest.records[path]
+                    _, record.size, record.mtime = diff.fingerprints[path]
+            self.file_manifest.save()
+            return diff
+
+    def sync_vectorstore(self) -> ManifestDiff:
+        """Sincroniza el vectorstore con los archivos de `self.path`."""
+        return self.apply_changes(self.detect_changes())
+
+    def delete_documents(self, ids: List[str]) -> None:
+        """Elimina chunks por id del vectorstore y de sus segmentos en disco."""
+        with self._writing():
+            delete_documents(self.vectorstore, ids)
+            self.segments.delete(ids)
+            if self.full_vectors is not None:
+                self.full_vectors.delete(ids)
+            self.catalog.remove(ids)
+            self.lexical_index.delete(ids)
+            # Las posiciones se han renumerado: el índice de metadatos se reconstruye
+            # en la siguiente búsqueda filtrada
+            self._metadata_index_stale = True
+            self._bump_index_version()
+
+    def _bump_index_version(self) -> None:
+        """Marca el índice como modificado e invalida los resultados en caché."""
+        self.index_version += 1
+        self.query_cache.invalidate()
+        # Los cambios de este proceso ya están en el índice en memoria
+        self._loaded_version = self.segments.version()
+
+    def _move_source(self, ids: List[str], source: str) -> List[str]:
+        """Reasigna chunks a otra fuente reutilizando sus embeddings."""
+        ids, documents, vectors = self._source_chunks(ids, source)
+        self.delete_documents(ids)
+        return self._add_embeddings(documents, vectors)
+
+    def _copy_source(self, ids: List[str], source: str) -> List[str]:
+        """Copia chunks con otra fuente reutilizando sus embeddings."""
+        _, documents, vectors = self._source_chunks(ids, source)
+        return self._add_embeddings(documents, vectors)
+
+    def _source_chunks(
+        self, ids: List[str], source: str
+    ) -> Tuple[List[str], List[Document], List[List[float]]]:
+        """Ids vigentes, documentos con la fuente indicada y embeddings de chunks."""
+        positions = {
+            _id: pos for pos, _id in self.vectorstore.index_to_docstore_id.items()
+        }
+        ids = [_id for _id in ids if _id in positions]
+        documents = [
+            Document(
+                page_content=doc.page_content, metadata={**doc.metadata, "source": source}
             )
-            index = faiss.IndexFlatL2(len(dummy_embed))
-
-            self.vectorstore = FAISS_STORE(
-                embedding_function=self.embeddings,
-                index=index,
-                docstore=InMemoryDocstore(),
-                index_to_docstore_id={},
-                distance_strategy=self.strategy,
+            for doc in (self.vectorstore.docstore.search(_id) for _id in ids)
+        ]
+        vectors = self.full_vectors.get(ids) if self.full_vectors is not None else None
+        try:
+            if vectors is None:
+                vectors = [
+                    self.vectorstore.index.reconstruct(positions[_id]) for _id in ids
+                ]
+        except RuntimeError:
+            # Los índices IVF y PQ no conservan los vectores originales
+            vectors = self.embeddings.embed_documents(
+                [doc.page_content for doc in documents]
+            )
+        return ids, documents, vectors
+
+    def _bootstrap_file_manifest(self, files: List[str]) -> None:
+        """Registra los archivos ya indexados de un vectorstore sin manifiesto."""
+        if not self.vectorstore.index.ntotal:
+            return
+        ids_by_source = {
+            source: self.catalog.get(source).chunk_ids
+            for source in self.catalog.sources()
+        }
+        # Versiones anteriores indexaban copias en `temp/`: se emparejan por nombre
+        by_name = {os.path.basename(source or ""): source for source in ids_by_source}
+        for path in files:
+            source = (
+                path if path in ids_by_source else by_name.get(os.path.basename(path))
             )
+            if source is not None:
+                self.file_manifest.record(
+                    path, file_fingerprint(path), ids_by_source[source]
+                )
+        self.file_manifest.save()
+
+    def tune_index(
+        self, nprobe: Optional[int] = None, ef_search: Optional[int] = None
+    ) -> None:
+        """Ajusta `nprobe` (IVF) o `efSearch` (HNSW) del índice cargado."""
+        self.index_factory.tune(self.vectorstore.index, nprobe, ef_search)
+
+    def index_report(
+        self,
+        queries: List[str],
+        k: int = 5,
+        configs: Optional[List[dict]] = None,
+        sample_size: int = 100_000,
+    ) -> List[IndexReport]:
+        """Compara recall@k y latencia de los índices aproximados con el índice exacto.
+
+        Parámetros:
+            queries (List[str]): Consultas de prueba.
+            k (int): Número de vecinos a comparar.
+            configs (Optional[List[dict]]): Configuraciones de `IndexFactory` a evaluar.
+            sample_size (int): Máximo de vectores del corpus a utilizar.
+
+        Retorna:
+            List[IndexReport]: Un informe por índice, empezando por el exacto.
+        """
+        n_vectors = min(self.vectorstore.index.ntotal, sample_size)
+        ids = [self.vectorstore.index_to_docstore_id[i] for i in range(n_vectors)]
+        corpus = self._corpus_vectors(ids)
+        query_vectors = np.asarray(self.embeddings.embed_documents(queries), np.float32)
+        return recall_latency_report(corpus, query_vectors, self.strategy, k, configs)
 
     def create_vectorstore(self) -> bool:
         """Crea y guarda un nuevo vectorstore desde documentos."""
         if self.exist_vectorstore():
             return False
 
-        documents = DocumentProcessor(self.path).files_to_texts()
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
-        )
-        texts = text_splitter.split_documents(documents)
-
-        # Re-inicializar con documentos
-        self.vectorstore.add_documents(texts)
-        self._save_vectorstore()
+        self.sync_vectorstore()
         return True
 
     def delete_vectorstore(self) -> bool:
         """Elimina el vectorstore especificado."""
-        try:
-            shutil.rmtree(f"database/{self.name}")
-            return True
-        except FileNotFoundError:
-            return False
+        with self._writing():
+            try:
+                remove_folder(self.segments.folder_path)
+                self.file_manifest = FileManifest(self.file_manifest.manifest_path)
+                self.catalog.clear()
+                self.lexical_index.clear()
+                self.full_vectors = self._open_full_vectors()
+                self.vectorstore = None
+                self._metadata_index_stale = True
+                self._bump_index_version()
+                self.segments = SegmentStore(
+                    self.segments.folder_path,
+                    embeddings=self.embeddings,
+                    **self.segments.store_kwargs,
+                )
+                return True
+            except FileNotFoundError:
+                return False
 
     def search_similarity(
-        self, query: str, k: Optional[int] = 5, fuente: Optional[str] = None
+        self,
+        query: str,
+        k: Optional[int] = 5,
+        fuente: Optional[str] = None,
+        mode: Optional[str] = None,
     ) -> str:
-        """Búsqueda de similitud con capacidad de filtrado."""
-        if not self.vectorstore:
-            self.vectorstore = self.load_vectorstore()
+        """Búsqueda de similitud con capacidad de filtrado.
 
-        filter_dict = {"source": fuente} if fuente else {}
+        Las consultas repetidas reutilizan el embedding y el top-k guardados en
+        `query_cache` mientras el índice no cambie.
+        """
+        results = self.search_batch([query], k=k, filters=[fuente], mode=mode)[0]
+        return str([result.to_dict() for result in results])
 
-        results = self.vectorstore.similarity_search(query=query, k=k, filter=filter_dict)
+    def search_batch(
+        self,
+        queries: List[str],
+        k: int = 5,
+        filters: Optional[List[Filter]] = None,
+        mode: Optional[str] = None,
+        vectors: Optional[List[List[float]]] = None,
+    ) -> List[List[SearchResult]]:
+        """Búsqueda de similitud para varias consultas a la vez.
 
-        return str(
-            [
-                {"content": doc.page_content, "source": doc.metadata.get("source")}
-                for doc in results
+        Los embeddings de las consultas que no están en `query_cache` se calculan en
+        una sola llamada al modelo y todas las búsquedas pendientes se resuelven con
+        una única búsqueda matricial en FAISS.
+
+        Parámetros:
+            queries (List[str]): Consultas a buscar.
+            k (int): Número de resultados por consulta.
+            filters (Optional[List[Filter]]): Filtro de cada consulta: una fuente,
+                un diccionario campo → valor de metadatos o None para no filtrar.
+            mode (Optional[str]): `dense` (FAISS), `lexical` (BM25) o `hybrid`
+                (ambos fusionados con Reciprocal Rank Fusion). Por defecto,
+                `SEARCH_MODE`.
+            vectors (Optional[List[List[float]]]): Embeddings ya calculados de las
+                consultas, p. ej. por un `ShardedVectorStore` que los comparte entre
+                sus shards.
+
+        Retorna:
+            List[List[SearchResult]]: Los resultados de cada consulta, en orden.
+        """
+        mode = (mode or self.search_mode).lower()
+        if mode not in SEARCH_MODES:
+            raise ValueError(f"Modo de búsqueda desconocido: {mode}")
+        if filters is None:
+            filters = [None] * len(queries)
+        elif len(filters) != len(queries):
+            raise ValueError("Debe haber un filtro por consulta")
+        filters = [normalize_filter(filtro) for filtro in filters]
+        SEARCH_QUERIES.labels(mode).inc(len(queries))
+        with span("search", mode=mode, queries=len(queries), k=k):
+            return self._search_batch(queries, k, filters, mode, vectors)
+
+    def _search_batch(
+        self,
+        queries: List[str],
+        k: int,
+        filters: List[Optional[Dict[str, Any]]],
+        mode: str,
+        vectors: Optional[List[List[float]]] = None,
+    ) -> List[List[SearchResult]]:
+        """Búsqueda de `search_batch` con los filtros ya normalizados."""
+        if mode == "lexical":
+            hits = [
+                self._lexical_ids(query, k, filtro)
+                for query, filtro in zip(queries, filters, strict=True)
             ]
+            return self._to_results(hits)
+
+        if vectors is None:
+            vectors = self._query_vectors(queries)
+        cache_keys = [(mode, filter_key(filtro)) for filtro in filters]
+        hits = [
+            self.query_cache.get_results(vector, k, key, self.index_version)
+            for vector, key in zip(vectors, cache_keys, strict=True)
+        ]
+        pending = [i for i, found in enumerate(hits) if found is None]
+        record_cache("query_results", len(hits) - len(pending), len(pending))
+        if pending:
+            # En modo híbrido cada lado aporta más candidatos de los que se devuelven
+            fetch_k = k if mode == "dense" else max(FETCH_K, k)
+            searched = self._search_ids_batch(
+                np.asarray([vectors[i] for i in pending], dtype=np.float32),
+                fetch_k,
+                [filters[i] for i in pending],
+            )
+            for i, found in zip(pending, searched, strict=True):
+                if mode == "hybrid":
+                    lexical = self._lexical_ids(queries[i], fetch_k, filters[i])
+                    found = reciprocal_rank_fusion([found, lexical], k)
+                hits[i] = found
+                self.query_cache.put_results(
+                    vectors[i], k, cache_keys[i], self.index_version, found
+                )
+        return self._to_results(hits)
+
+    def query_vector(self, query: str) -> List[float]:
+        """Embedding de una consulta, de la caché si ya se ha buscado."""
+        return self._query_vectors([query])[0]
+
+    @property
+    def store_version(self) -> str:
+        """Versión persistente del contenido del vectorstore.
+
+        A diferencia de `index_version`, se conserva entre reinicios y cambia también
+        cuando otro proceso modifica el vectorstore o este se reconstruye.
+        """
+        return self.segments.version()
+
+    @property
+    def index_type(self) -> str:
+        """Tipo del índice construido, que con un corpus pequeño puede ser plano.
+
+        Puede no coincidir con `INDEX_TYPE` hasta que el corpus basta para
+        entrenar el índice configurado (ver `IndexFactory.needs_retrain`).
+        """
+        if self._vectorstore is not None:
+            return index_kind(self._vectorstore.index)
+        return self.segments.index_type() or self.index_factory.index_type
+
+    def _query_vectors(self, queries: List[str]) -> List[List[float]]:
+        """Embeddings de las consultas, calculando en un solo lote los que faltan."""
+        vectors = [self.query_cache.get_vector(query) for query in queries]
+        missing = list(
+            dict.fromkeys(
+                query
+                for query, vector in zip(queries, vectors, strict=True)
+                if vector is None
+            )
         )
+        record_cache("query_vector", len(queries) - len(missing), len(missing))
+        if not missing:
+            return vectors
+        with span("search.embed_query", queries=len(missing)):
+            embedded = dict(
+                zip(missing, embed_queries(self.embeddings, missing), strict=True)
+            )
+        for query in missing:
+            self.query_cache.put_vector(query, embedded[query])
+        return [
+            embedded[query] if vector is None else vector
+            for query, vector in zip(queries, vectors, strict=True)
+        ]
+
+    def _lexical_ids(
+        self, query: str, k: int, filtro: Optional[Dict[str, Any]]
+    ) -> List[Tuple[str, float]]:
+        """Top-k de BM25, filtrando después por metadatos si hace falta."""
+        if filtro is None:
+            with span("search.lexical"):
+                return self.lexical_index.search(query, k)
+        docstore = self.vectorstore.docstore
+        hits = []
+        with span("search.lexical"):
+            candidates = self.lexical_index.search(query, max(FETCH_K, k) * 4)
+        for _id, score in candidates:
+            document = docstore.search(_id)
+            if isinstance(document, Document) and all(
+                document.metadata.get(field) == value for field, value in filtro.items()
+            ):
+                hits.append((_id, score))
+                if len(hits) == k:
+                    break
+        return hits
+
+    def _to_results(
+        self, hits: List[List[Tuple[str, float]]]
+    ) -> List[List[SearchResult]]:
+        """Convierte los ids y puntuaciones en `SearchResult`."""
+        with span("search.docstore") as current:
+            results = self._lookup_results(hits)
+            count = sum(len(row) for row in results)
+            size = sum(utf8_len(result.content) for row in results for result in row)
+            current.set("results", count)
+            current.set("bytes", size)
+        SEARCH_RESULTS.inc(count)
+        SEARCH_RESULT_BYTES.inc(size)
+        return results
+
+    def _lookup_results(
+        self, hits: List[List[Tuple[str, float]]]
+    ) -> List[List[SearchResult]]:
+        docstore = self.vectorstore.docstore
+        results = []
+        for found in hits:
+            row = []
+            for _id, score in found:
+                document = docstore.search(_id)
+                if not isinstance(document, Document):
+                    # El índice léxico puede ir por delante de una instantánea
+                    continue
+                row.append(
+                    SearchResult(
+                        id=_id,
+                        content=document.page_content,
+                        source=document.metadata.get("source"),
+                        score=score,
+                        metadata=dict(document.metadata),
+                    )
+                )
+            results.append(row)
+        return results
+
+    def _search_ids_batch(
+        self, vectors: np.ndarray, k: int, filters: List[Optional[Dict[str, Any]]]
+    ) -> List[List[Tuple[str, float]]]:
+        """Busca varias consultas con una búsqueda matricial por cada filtro distinto."""
+        groups = defaultdict(list)
+        for i, filtro in enumerate(filters):
+            groups[filter_key(filtro)].append(i)
+        results: List[List[Tuple[str, float]]] = [[] for _ in filters]
+        with span("search.faiss", queries=len(vectors), groups=len(groups)):
+            for rows in groups.values():
+                found = self._search_group(vectors[rows], k, filters[rows[0]])
+                for i, hits in zip(rows, found, strict=True):
+                    results[i] = hits
+        return results
+
+    def _search_group(
+        self, vectors: np.ndarray, k: int, filtro: Optional[Dict[str, Any]]
+    ) -> List[List[Tuple[str, float]]]:
+        """Busca un grupo de consultas que comparten el mismo filtro.
+
+        Si todos los campos del filtro están indexados, la búsqueda se restringe al
+        subconjunto que lo cumple; si no, se recuperan `FETCH_K` candidatos y se
+        filtran después. Con un índice cuantizado y `rerank_k`, se recuperan
+        `rerank_k` candidatos y se ordenan de nuevo con los vectores completos.
+        """
+        index = self.vectorstore.index
+        candidates = k
+        if self.full_vectors is not None:
+            candidates = max(k, self.index_factory.rerank_k)
+        selected = None
+        if filtro is not None:
+            selected = self._get_metadata_index().select(filtro)
+            if selected is not None and not len(selected):
+                return [[] for _ in vectors]
+
+        if filtro is None:
+            scores, positions = index.search(vectors, candidates)
+        elif selected is not None:
+            scores, positions = self.index_factory.search_subset(
+                index, vectors, candidates, selected, self._stored_vectors
+            )
+        else:
+            scores, positions = index.search(vectors, max(FETCH_K, candidates))
+
+        docstore = self.vectorstore.docstore
+        results = []
+        for vector, row_scores, row_positions in zip(
+            vectors, scores, positions, strict=True
+        ):
+            hits = []
+            for score, position in zip(row_scores, row_positions, strict=True):
+                if position == -1:
+                    continue
+                _id = self.vectorstore.index_to_docstore_id[position]
+                if filtro is not None and selected is None:
+                    metadata = docstore.search(_id).metadata
+                    if any(metadata.get(f) != v for f, v in filtro.items()):
+                        continue
+                hits.append((_id, float(score)))
+                if len(hits) == candidates:
+                    break
+            results.append(self._rerank(vector, hits)[:k])
+        return results
+
+    def _stored_vectors(self, positions: np.ndarray) -> Optional[np.ndarray]:
+        """Vectores completos de las posiciones indicadas, si están guardados."""
+        if self.full_vectors is None:
+            return None
+        ids = self.vectorstore.index_to_docstore_id
+        return self.full_vectors.get([ids[int(position)] for position in positions])
+
+    def _rerank(
+        self, vector: np.ndarray, hits: List[Tuple[str, float]]
+    ) -> List[Tuple[str, float]]:
+        """Re-puntúa candidatos con sus vectores completos, si están guardados."""
+        if self.full_vectors is None or not hits:
+            return hits
+        full = self.full_vectors.get([_id for _id, _ in hits])
+        if full is None:
+            # Chunks indexados antes de activar la re-puntuación
+            return hits
+        order, scores = self.index_factory.rerank(vector, full)
+        return [(hits[i][0], float(scores[i])) for i in order]
+
+    def _get_metadata_index(self) -> MetadataIndex:
+        """Devuelve el índice de metadatos, reconstruyéndolo si está desfasado."""
+        if self._metadata_index_stale:
+            self.metadata_index.rebuild(self.vectorstore)
+            self._metadata_index_stale = False
+        return self.metadata_index
 
     def list_sources(self) -> List[str]:
         """Lista todas las fuentes únicas en el vectorstore."""
-        if not self.vectorstore:
+        if not self.catalog.exists() and self._vectorstore is None:
+            # Vectorstore sin catálogo: se construye al cargarlo
             self.vectorstore = self.load_vectorstore()
+        return self.catalog.sources()
 
-        sources = set()
-        for doc in self.vectorstore.docstore._dict.values():
-            if hasattr(doc, "metadata"):
-                sources.add(doc.metadata.get("source", ""))
-        return list(sources)
-
-    def _save_vectorstore(self):
-        """Guarda el vectorstore en disco."""
-        save_path = os.path.join("database", self.name)
-        self.vectorstore.save_local(save_path)
+    def _save_vectorstore(self, batch: FAISS_STORE) -> None:
+        """Guarda un lote en disco como un segmento nuevo del vectorstore."""
+        with span("ingest.save", chunks=batch.index.ntotal):
+            self.segments.append(batch)
 
     def load_vectorstore(self) -> FAISS_STORE:
-        """Carga el vectorstore desde disco."""
-        return FAISS_STORE.load_local(
-            folder_path=os.path.join("database", self.name),
-            embeddings=self.embeddings,
-            allow_dangerous_deserialization=True,
-            distance_strategy=self.strategy,
+        """Carga el vectorstore desde disco, abriendo todos sus segmentos.
+
+        En modo de solo lectura se abre la instantánea mapeada en memoria.
+        """
+        self._bump_index_version()
+        self._metadata_index_stale = True
+        if self.read_only:
+            vectorstore = self._load_snapshot()
+        else:
+            vectorstore = self.segments.load()
+        if vectorstore is None:
+            return self._empty_vectorstore(self.index_factory.build(self._dimension()))
+        if not self.read_only and (
+            self.catalog.total_chunks != vectorstore.index.ntotal
+            or not self.catalog.has_texts
+        ):
+            # Vectorstore anterior al catálogo (o a sus textos) o catálogo desfasado
+            self.catalog.rebuild(vectorstore)
+        if not self.read_only and len(self.lexical_index) != vectorstore.index.ntotal:
+            # Vectorstore anterior al índice léxico o índice desfasado
+            ids = [_id for _, _id in sorted(vectorstore.index_to_docstore_id.items())]
+            self.lexical_index.rebuild(
+                ids, [vectorstore.docstore.search(_id).page_content for _id in ids]
+            )
+        self.index_factory.tune(vectorstore.index)
+        return vectorstore
+
+    def _dimension(self) -> int:
+        """Dimensión de los embeddings, sin cargar el modelo si ya está guardada."""
+        dimension = self.segments.dimension()
+        if dimension is None:
+            # Vectorstore nuevo: se pregunta al modelo
+            dimension = len(self.embeddings.embed_query("dimension"))
+        return dimension
+
+    @property
+    def snapshot_path(self) -> str:
+        """Carpeta de la instantánea de solo lectura."""
+        return os.path.join(self.segments.folder_path, "serving")
+
+    def build_snapshot(self) -> str:
+        """Publica una instantánea de solo lectura del vectorstore actual.
+
+        La instantánea guarda el índice FAISS y los chunks en archivos que el modo
+        de solo lectura mapea en memoria, de modo que el arranque no depende del
+        tamaño del corpus y varios procesos comparten la caché de páginas.
+
+        Retorna:
+            str: Carpeta de la instantánea.
+        """
+        vectorstore = self.vectorstore
+        # Las compactaciones de este proceso no cambian el contenido exportado
+        self._is_current()
+        write_snapshot(vectorstore, self.snapshot_path, self._loaded_version)
+        return self.snapshot_path
+
+    def _load_snapshot(self) -> Optional[FAISS_STORE]:
+        """Abre la instantánea si refleja la versión actual de los segmentos.
+
+        La versión incluye el id del vectorstore, de modo que no se sirve la
+        instantánea de uno reconstruido o importado con la misma generación. Si no
+        coincide, se cargan los segmentos sin escribir nada en disco: la
+        instantánea la publica el proceso de escritura (`build_snapshot`).
+        """
+        if snapshot_version(self.snapshot_path) != self.segments.version():
+            if os.path.isdir(self.snapshot_path):
+                logger.warning(
+                    f"La instantánea de '{self.name}' no corresponde a la versión "
+                    "actual; se cargan los segmentos"
+                )
+            return self.segments.load()
+        return load_snapshot(
+            self.snapshot_path, self.embeddings, **self.segments.store_kwargs
         )
 
+    def _check_writable(self) -> None:
+        if self.read_only:
+            raise RuntimeError(f"El vectorstore '{self.name}' es de solo lectura")
+
+    @contextmanager
+    def _writing(self) -> Iterator[None]:
+        """Bloquea el vectorstore frente a otros escritores mientras se modifica.
+
+        Si otro proceso (p. ej. el trabajador de ingesta) ha publicado una versión
+        nueva desde que se abrió, se recarga antes de escribir sobre ella. Las
+        escrituras anidadas, también las del hilo de escritura de una ingesta en
+        curso, usan el bloqueo que ya tiene este gestor.
+        """
+        self._check_writable()
+        if self._writers:
+            yield
+            return
+        with store_lock(self.segments.folder_path):
+            if not self._is_current():
+                logger.info(
+                    f"Vectorstore '{self.name}' modificado por otro proceso; "
+                    "se recarga antes de escribir"
+                )
+                self.reload()
+            self._writers += 1
+            try:
+                yield
+            finally:
+                self._writers -= 1
+
+    def _is_current(self) -> bool:
+        """Indica si el índice en memoria corresponde a la versión del disco.
+
+        Las compactaciones de este proceso no cambian el contenido: si solo ellas
+        han cambiado la versión, se adopta la nueva sin recargar.
+        """
+        version = self.segments.version()
+        if version == "empty" or version == self._loaded_version:
+            return True
+        if self.segments.base_version(version) == self._loaded_version:
+            self._loaded_version = version
+            return True
+        return False
+
+    def compact_vectorstore(self, background: bool = True) -> bool:
+        """Fusiona los segmentos del vectorstore en uno solo.
+
+        Parámetros:
+            background (bool): Si es True, la compactación se ejecuta en un hilo y
+                el método retorna de inmediato.
+
+        Retorna:
+            bool: True si se ha lanzado o realizado la compactación.
+        """
+        if background:
+            self.segments.compact_in_background(full=True)
+            return True
+        return self.segments.compact()
+
     def add_files_vectorstore(self) -> bool:
         """Añade nuevos documentos al vectorstore."""
         temp_folder = "docs"
         if not os.path.exists(temp_folder):
             return False
 
-        documents = DocumentProcessor(temp_folder).files_to_texts()
-        if not documents:
-            return False
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
+        diff = self.apply_changes(
+            self.detect_changes(temp_folder, detect_deletions=False)
         )
-        texts = text_splitter.split_documents(documents)
-
-        self.vectorstore.add_documents(texts)
-        self._save_vectorstore()
-        return True
+        return diff.has_changes
 
     def download_vectorstore(self) -> str:
-        """Genera un ZIP del vectorstore."""
-        zip_path = "temp/vectorstore.zip"
-        with ZipFile(zip_path, "w") as zipf:
-            for root, _, files in os.walk(f"database/{self.name}"):
-                for file in files:
-                    zipf.write(os.path.join(root, file))
-        return zip_path
+        """Genera una instantánea comprimida del vectorstore en `temp/`."""
+        archive_path = os.path.join("temp", f"{self.name}.tar.gz")
+        self.export_snapshot(archive_path)
+        return archive_path
+
+    @property
+    def embedding_model(self) -> str:
+        """Identificador del modelo de embeddings con que se indexan los chunks."""
+        return embedding_model_id(self.embeddings)
+
+    def export_snapshot(
+        self, destination: Union[str, BinaryIO], base: Optional[str] = None
+    ) -> SnapshotInfo:
+        """Exporta el vectorstore como un único archivo comprimido y verificable.
+
+        El archivo se firma con `SNAPSHOT_KEY`; solo lo aceptan los nodos que
+        comparten esa clave.
+
+        Parámetros:
+            destination (Union[str, BinaryIO]): Ruta del archivo (`-` para stdout)
+                o flujo de salida.
+            base (Optional[str]): Instantánea anterior (ruta o URL); si se indica,
+                se exporta un delta con los archivos nuevos o cambiados.
+
+        Retorna:
+            SnapshotInfo: Cabecera de la instantánea.
+        """
+        metadata = {
+            "name": self.name,
+            "store_version": self.store_version,
+            "embedding_model": self.embedding_model,
+            "distance_strategy": self.strategy.value,
+            "index_type": self.index_type,
+            "dimension": self.segments.dimension(),
+        }
+        folder_path = self.segments.folder_path
+        key = snapshot_key()
+        base_info = read_header(base, key) if base else None
+        with span("snapshot.export"):
+            if not isinstance(destination, str):
+                return export_snapshot(folder_path, destination, metadata, key, base_info)
+            with open_output(destination) as output:
+                return export_snapshot(folder_path, output, metadata, key, base_info)
+
+    def import_snapshot(self, source: Union[str, BinaryIO]) -> SnapshotInfo:
+        """Sustituye el vectorstore por una instantánea exportada en otro nodo.
+
+        La instantánea se rechaza si no está firmada con `SNAPSHOT_KEY` o si se
+        creó con otro modelo de embeddings u otra estrategia de distancia. Los
+        índices se cargan de los archivos importados sin volver a calcular ningún
+        embedding.
+
+        Parámetros:
+            source (Union[str, BinaryIO]): Ruta, URL HTTP(S), `-` (stdin) o flujo.
+
+        Retorna:
+            SnapshotInfo: Cabecera de la instantánea importada.
+        """
+        with self._writing():
+            expected = {
+                "embedding_model": self.embedding_model,
+                "distance_strategy": self.strategy.value,
+                "dimension": self.segments.dimension(),
+            }
+            key = snapshot_key()
+            current = self.store_version if self.exist_vectorstore() else None
+            folder_path = self.segments.folder_path
+            with span("snapshot.import"):
+                if isinstance(source, str):
+                    with open_input(source) as stream:
+                        info = import_snapshot(
+                            folder_path, stream, expected, key, current
+                        )
+                else:
+                    info = import_snapshot(folder_path, source, expected, key, current)
+            if info.index_type != self.index_factory.index_type:
+                logger.warning(
+                    f"La instantánea usa un índice {info.index_type} y INDEX_TYPE es "
+                    f"{self.index_factory.index_type}; se conserva el de la instantánea"
+                )
+            self.reload()
+            return info
+
+    def reopen(self) -> Optional["VectorStoreManager"]:
+        """Abre la generación del vectorstore que otro proceso ha publicado en disco.
+
+        El vectorstore actual no se modifica: el nuevo se carga por completo aparte
+        y quien lo usa sustituye su referencia cuando está listo, de modo que las
+        búsquedas en curso terminan sobre la generación anterior y ninguna espera
+        a la carga. Mientras dura la carga, ambas generaciones ocupan memoria. Si
+        se publica otra generación durante la carga, se carga esa.
+
+        Retorna:
+            Optional[VectorStoreManager]: El vectorstore cargado con la generación
+            nueva, o None si el índice en memoria ya es el del disco (o aún no se
+            ha cargado).
+        """
+        if self._vectorstore is None or self._is_current():
+            return None
+        with span("vectorstore.reopen"):
+            for attempt in range(REOPEN_ATTEMPTS):
+                fresh = VectorStoreManager(
+                    self.path,
+                    self.name,
+                    read_only=self.read_only,
+                    embeddings=self.embeddings,
+                )
+                try:
+                    fresh.vectorstore = fresh.load_vectorstore()
+                    break
+                except FileNotFoundError:
+                    # Se ha publicado otra generación durante la carga y la que se
+                    # estaba leyendo se ha eliminado: se carga la nueva
+                    if attempt == REOPEN_ATTEMPTS - 1:
+                        raise
+            version = fresh._loaded_version
+        logger.info(f"Vectorstore '{self.name}' recargado en la versión {version}")
+        return fresh
+
+    def reload(self) -> None:
+        """Vuelve a abrir los archivos del vectorstore tras reemplazarlos en disco."""
+        self.segments = SegmentStore(
+            self.segments.folder_path,
+            embeddings=self.embeddings,
+            **self.segments.store_kwargs,
+        )
+        self.file_manifest = FileManifest(self.file_manifest.manifest_path)
+        self.lexical_index = LexicalIndex(self.lexical_index.folder_path)
+        self.catalog = SourceCatalog(self.catalog.path)
+        self.full_vectors = self._open_full_vectors()
+        self.vectorstore = None
+        self._metadata_index_stale = True
+        self._bump_index_version()
 
     def exist_vectorstore(self) -> bool:
         """Verifica si el vectorstore existe."""
@@ -149,16 +1167,15 @@ class VectorStoreManager:
 
     def extract_texts_by_source(self, source: str) -> List[str]:
         """Extract texts of documents that belong to a specific source."""
-        if not self.vectorstore:
-            self.vectorstore = self.load_vectorstore()
-
-        docstore_dict = self.vectorstore.docstore._dict
-        texts = []
-        for document in docstore_dict.values():
-            source_doc = document.metadata.get("source", None)
-            if source_doc == source:
-                texts.append(document.page_content)
-        return texts
+        entry = self.catalog.get(source)
+        if entry is None:
+            return []
+        texts = self.catalog.texts(source)
+        if texts is not None:
+            return texts
+        # Catálogo de solo lectura anterior a los textos: hay que cargar el docstore
+        docstore = self.vectorstore.docstore
+        return [docstore.search(_id).page_content for _id in entry.chunk_ids]
 
     def save_text_to_file_temp(self, source: str) -> bool:
         """Guarda los textos de una fuente en un archivo temporal."""
@@ -185,34 +1202,20 @@ class VectorStoreManager:
         if not os.path.exists(path_files):
             return False
 
-        documents = DocumentProcessor(path_files).files_to_texts()
-        if not documents:
-            return False
-
-        text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000, chunk_overlap=200, length_function=len
-        )
-        texts = text_splitter.split_documents(documents)
-        self.vectorstore = self.load_vectorstore()
-        self.vectorstore.add_documents(documents=texts)
-        self.vectorstore.save_local(folder_path=os.path.join("database", self.name))
-        return True
+        diff = self.apply_changes(self.detect_changes(path_files, detect_deletions=False))
+        return diff.has_changes
 
     async def aadd_documents(self, documents: List[Document]) -> None:
         """Versión asíncrona para añadir documentos al vectorstore."""
-        if not self.vectorstore:
-            self.vectorstore = self.load_vectorstore()
-        await self.vectorstore.aadd_documents(documents=documents)
-        self._save_vectorstore()
+        vectors = await self.embeddings.aembed_documents(
+            [doc.page_content for doc in documents]
+        )
+        self._add_embeddings(documents, vectors)
 
     async def asimilarity_search_with_score(self, query: str, k: int = 5) -> List[tuple]:
         """Versión asíncrona de similarity_search_with_score."""
-        if not self.vectorstore:
-            self.vectorstore = self.load_vectorstore()
         return await self.vectorstore.asimilarity_search_with_score(query=query, k=k)
 
     def as_retriever(self, search_type: str = "similarity", **kwargs) -> Any:
         """Convierte el vectorstore en un retriever para búsquedas avanzadas."""
-        if not self.vectorstore:
-            self.vectorstore = self.load_vectorstore()
-        return self.vectorstore.as_retriever(search_type=search_type, **kwargs)
\ No newline at end of file
+        return self.vectorstore.as_retriever(search_type=search_type, **kwargs)